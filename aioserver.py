@@ -0,0 +1,568 @@
+"""Fully async entry point: the admin API and the bot webhook on one event loop.
+
+Serves the same routes as server.py (which stays the default WSGI app) with
+aiohttp, so thousands of concurrent status polls cost coroutines instead of
+gunicorn threads. bot/dp come from bot.py, and storage goes through the same
+dispatchers as server.py: cached status lookups and JSON-store reads are
+answered inline, while anything that can block (Postgres, journal fsyncs)
+runs on a small executor sized to the DB pool, so no coroutine ever waits on
+a pool slot while holding the loop.
+
+Run with:  gunicorn aioserver:create_app --worker-class aiohttp.GunicornWebWorker
+or:        python aioserver.py
+"""
+import os
+import time
+import asyncio
+import logging
+import functools
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import server
+import metrics
+import listing
+import bulk
+import responses
+import profiling
+from server import updates, status_cache
+from prefilter import DISPATCH, INVALID
+from config import DB_POOL_MAX, BULK_MAX_ITEMS, COMPRESS_MIN_SIZE, COMPRESS_LEVEL
+
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix='aio-storage')
+
+# Flask's signed session cookie, so /auth logins work across both servers
+_session_serializer = server.app.session_interface.get_signing_serializer(server.app)
+_SESSION_COOKIE = server.app.config['SESSION_COOKIE_NAME']
+
+# JSON bodies bigger than this are compressed on a thread, off the loop
+COMPRESS_INLINE_MAX = 64 * 1024
+
+
+async def offload(fn, *args):
+    """Run a blocking storage call off the event loop"""
+    # In a copy of this context, so its spans land in the request's trace
+    call = functools.partial(contextvars.copy_context().run, fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+
+def get_session(request: web.Request) -> dict:
+    raw = request.cookies.get(_SESSION_COOKIE)
+    if not raw:
+        return {}
+    try:
+        return dict(_session_serializer.loads(raw))
+    except Exception:
+        return {}
+
+
+async def read_json(request: web.Request) -> dict:
+    try:
+        data = await request.json()
+    except Exception:
+        raise web.HTTPBadRequest(text='Invalid JSON')
+    return data if isinstance(data, dict) else {}
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    started = time.perf_counter()
+    info = request.match_info
+    route = info.route.resource.canonical if info.route.resource is not None else 'unmatched'
+    trace = server.tracer.begin(request.method + ' ' + route)
+    status = 500
+    try:
+        resp = await handler(request)
+        status = resp.status
+        return resp
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        server.HTTP_REQUESTS.labels(route, request.method, status).inc()
+        server.HTTP_SECONDS.labels(route, request.method).observe(time.perf_counter() - started)
+        server.tracer.finish(trace, status)
+
+
+@web.middleware
+async def cors_middleware(request: web.Request, handler):
+    if request.method == 'OPTIONS':
+        resp = web.Response()
+        resp.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        resp.headers['Access-Control-Allow-Headers'] = request.headers.get('Access-Control-Request-Headers', '*')
+    else:
+        resp = await handler(request)
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp
+
+
+@web.middleware
+async def compression_middleware(request: web.Request, handler):
+    resp = await handler(request)
+    # FileResponse/StreamResponse (exports) aren't web.Response and pass through
+    if (not isinstance(resp, web.Response) or resp.status != 200 or resp.content_type != 'application/json'
+            or 'Content-Encoding' in resp.headers or not isinstance(resp.body, bytes)):
+        return resp
+    resp.headers['Vary'] = 'Accept-Encoding'
+    body = resp.body
+    coding = responses.json_encoding(len(body), request.headers.get('Accept-Encoding', ''), COMPRESS_MIN_SIZE)
+    if coding is None:
+        return resp
+    with profiling.span('compress'):
+        if len(body) > COMPRESS_INLINE_MAX:
+            body = await asyncio.get_running_loop().run_in_executor(None, responses.compress, body, coding,
+                                                                    COMPRESS_LEVEL)
+        else:
+            body = responses.compress(body, coding, COMPRESS_LEVEL)
+    resp.body = body
+    resp.headers['Content-Encoding'] = coding
+    return resp
+
+
+@web.middleware
+async def auth_middleware(request: web.Request, handler):
+    if server.API_AUTH and request.method != 'OPTIONS' and request.path.startswith('/api/'):
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else request.path
+        claims, error = server.authorize(route, request.headers.get('Authorization'),
+                                         request.cookies.get(server.TOKEN_COOKIE))
+        if error is not None:
+            return web.json_response({'error': error[0]}, status=error[1])
+        request['token'] = claims
+    return await handler(request)
+
+
+# -------------- Telegram webhook --------------
+async def tg_webhook(request: web.Request):
+    # Until the startup thread has imported aiogram, wait for it in the
+    # executor: importing on the loop would stall every other request
+    tg = server.loaded_telegram() or await offload(server.telegram)
+    prefilter = tg.prefilter
+    body = await request.read()
+    with profiling.span('prefilter'):
+        verdict, data = prefilter.check(body)
+    if verdict == INVALID:
+        logging.error('Webhook qayta ishlashda xatolik: invalid JSON')
+        return web.Response(text='Error', status=400)
+    if verdict != DISPATCH:
+        return web.Response(text='OK')
+    try:
+        from aiogram import types
+        with profiling.span('decode'):
+            update = types.Update.model_validate(data)
+    except Exception as e:
+        prefilter.forget(data['update_id'])
+        logging.error(f'Webhook qayta ishlashda xatolik: {e}')
+        return web.Response(text='Error', status=400)
+    if not updates.submit(update):
+        if updates.full_policy == 'reject':
+            prefilter.forget(update.update_id)
+            return web.Response(text='Busy', status=503)
+        logging.warning('Update queue full, update %s dropped', update.update_id)
+    return web.Response(text='OK')
+
+
+# -------------- Static pages / auth --------------
+def _static(request: web.Request, page: responses.StaticPage):
+    code, headers, body = page.respond(request.headers.get('Accept-Encoding', ''),
+                                       request.headers.get('If-None-Match', ''))
+    return web.Response(body=body, status=code, headers=headers)
+
+
+async def serve_admin(request: web.Request):
+    return _static(request, server.admin_page)
+
+
+async def serve_login(request: web.Request):
+    return _static(request, server.login_page)
+
+
+async def auth(request: web.Request):
+    if not server.check_auth(request.query):
+        return web.Response(text="Auth xatosi")
+    sess = get_session(request)
+    sess['tg_id'] = request.query['id']
+    sess['username'] = request.query.get('username', '')
+    token, role, ttl = server.login_token(request.query)
+    if role == server.tokens.ADMIN:
+        resp = web.Response(status=302, headers={'Location': '/admin.html'})
+    else:
+        resp = web.Response(text=f"Xush kelibsiz, {sess['username'] or sess['tg_id']}!")
+    resp.set_cookie(_SESSION_COOKIE, _session_serializer.dumps(sess), httponly=True)
+    resp.set_cookie(server.TOKEN_COOKIE, token, max_age=ttl, httponly=True, samesite='Lax', secure=request.secure)
+    return resp
+
+
+async def index(request: web.Request):
+    sess = get_session(request)
+    if 'tg_id' in sess:
+        return web.Response(text=f"Siz tizimga kirdingiz: {sess['username'] or sess['tg_id']}")
+    raise web.HTTPFound('/login.html')
+
+
+async def debug(request: web.Request):
+    tg = server.loaded_telegram()
+    return web.json_response({
+        'USE_DB': server.USE_DB,
+        'DATABASE_URL_set': bool(server.DATABASE_URL),
+        'SUBS_JSON': server.SUBS_JSON,
+        'version': server.VERSION,
+        'server': 'aiohttp',
+        'db_pool': server._pool.stats() if server._pool is not None else None,
+        'store': server.store.stats() if not server.USE_DB else None,
+        'expiry_columns': server.expiry_columns.stats() if not server.USE_DB else None,
+        'change_feed': server.change_feed.stats() if not server.USE_DB else None,
+        'status_cache': status_cache.stats(),
+        'updates': updates.stats(),
+        'prefilter': tg.prefilter.stats() if tg is not None else None,
+        'sweeper': server.sweeper.stats(),
+        'payments': server.payment_intake.stats(),
+        'sender': tg.sender.stats() if tg is not None else None,
+        'startup': server.startup.stats(),
+        'tokens': server.token_signer.stats(),
+        'tracing': server.tracer.stats(),
+    })
+
+
+async def ready(request: web.Request):
+    stats = server.startup.stats()
+    return web.json_response(stats, status=200 if stats['ready'] else 503)
+
+
+async def metrics_endpoint(request: web.Request):
+    return web.Response(body=metrics.render().encode('utf-8'),
+                        headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def version(request: web.Request):
+    return web.json_response({'version': server.VERSION, 'subs_json': server.SUBS_JSON})
+
+
+# -------------- API --------------
+async def api_stats(request: web.Request):
+    try:
+        months = int(request.query.get('months', 12))
+    except ValueError:
+        months = 0
+    if not 1 <= months <= 60:
+        return web.json_response({'error': "months 1 dan 60 gacha bo‘lsin"}, status=400)
+    started = time.perf_counter()
+    try:
+        out = await offload(server.stats, months)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+    out['took_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return web.json_response(out)
+
+
+async def api_subscriptions(request: web.Request):
+    try:
+        if not listing.wants_page(request.query):
+            return await _full_list(request)
+        query = listing.parse_query(request.query)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+    try:
+        tag = await _etag(server.page_etag, query, request.query_string.encode())
+        return await _conditional(request, tag, server.list_page, query)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def _full_list(request: web.Request):
+    return await _conditional(request, await _etag(server.list_etag), server.list_subs)
+
+
+async def _etag(fn, *args):
+    # The list tags call store.sync(): in shared mode that can wait on another
+    # worker's flock and replay its log entries, so keep it off the loop
+    if server.STATUS_BLOCKS:
+        return await offload(fn, *args)
+    return fn(*args)
+
+
+async def _conditional(request: web.Request, tag, fn, *args):
+    """JSON of offload(fn, *args) with a weak ETag, or a 304 without calling it
+    when If-None-Match has ``tag``; tag None: the ETag is a hash of the body"""
+    wanted = request.headers.get('If-None-Match', '')
+    if tag is not None and responses.etag_matches(wanted, tag):
+        return web.Response(status=304, headers={'ETag': 'W/"%s"' % tag})
+    data = await offload(fn, *args)
+    with profiling.span('encode'):
+        resp = web.json_response(data)
+    if tag is None:
+        tag = hashlib.sha1(resp.body).hexdigest()
+        if responses.etag_matches(wanted, tag):
+            return web.Response(status=304, headers={'ETag': 'W/"%s"' % tag})
+    resp.headers['ETag'] = 'W/"%s"' % tag
+    return resp
+
+
+async def api_subscriptions_changes(request: web.Request):
+    try:
+        since = int(request.query.get('since', 0))
+    except ValueError:
+        return web.json_response({'error': 'since: versiya raqami kerak'}, status=400)
+    try:
+        return web.json_response(await offload(server.changes, since))
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def api_subscriptions_export(request: web.Request):
+    fmt = request.query.get('format', 'ndjson')
+    if fmt not in listing.EXPORT_FORMATS:
+        return web.json_response({'error': 'format: ' + ', '.join(listing.EXPORT_FORMATS)}, status=400)
+    try:
+        query = listing.parse_query(request.query)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    mimetype, chunks = listing.EXPORT_FORMATS[fmt]
+    resp = web.StreamResponse(headers={
+        'Content-Type': mimetype,
+        'Content-Disposition': 'attachment; filename=subscriptions.%s' % fmt,
+    })
+    await resp.prepare(request)
+    # The row iterator may hold a server-side cursor: pull it chunk by chunk in the executor
+    gen = chunks(server.iter_subs(query))
+    try:
+        while True:
+            chunk = await offload(next, gen, None)
+            if chunk is None:
+                break
+            await resp.write(chunk.encode('utf-8'))
+    finally:
+        await offload(gen.close)
+    await resp.write_eof()
+    return resp
+
+
+async def api_subscription(request: web.Request):
+    data = await read_json(request)
+    uid = str(data.get('uid'))
+    days = int(data.get('days', 0))
+    note = data.get('note')
+    if not uid or days < 1:
+        return web.json_response({'error': "UID va kun to‘g‘ri kiritilsin"}, status=400)
+    try:
+        expiry = await offload(server.set_days, uid, days, note)
+        return web.json_response({'ok': True, 'uid': uid, 'expiry': expiry})
+    except ValueError as e:  # a uid or note the store can't hold (binary: integer uids)
+        return web.json_response({'error': str(e)}, status=400)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def api_subscription_add(request: web.Request):
+    data = await read_json(request)
+    uid = str(data.get('uid'))
+    add = int(data.get('add', 0))
+    if not uid or add < 1:
+        return web.json_response({'error': "UID va kunni to‘g‘ri kiriting"}, status=400)
+    return await _mutate(server.add_days, uid, add)
+
+
+async def api_subscription_reset(request: web.Request):
+    data = await read_json(request)
+    uid = str(data.get('uid'))
+    if not uid:
+        return web.json_response({'error': "UID kiritilmadi"}, status=400)
+    return await _mutate(server.reset, uid)
+
+
+async def api_subscription_note(request: web.Request):
+    data = await read_json(request)
+    uid = str(data.get('uid'))
+    note = data.get('note', '')
+    if not uid:
+        return web.json_response({'error': "UID kiritilmadi"}, status=400)
+    return await _mutate(server.set_note, uid, note)
+
+
+async def api_subscription_delete(request: web.Request):
+    data = await read_json(request)
+    uid = str(data.get('uid'))
+    if not uid:
+        return web.json_response({'error': "UID kiritilmadi"}, status=400)
+    return await _mutate(server.delete, uid)
+
+
+async def _mutate(fn, *args):
+    try:
+        expiry = await offload(fn, *args)
+        return web.json_response({'ok': True, 'uid': args[0], 'expiry': expiry})
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=404)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def api_subscriptions_bulk(request: web.Request):
+    try:
+        items = bulk.parse_items(await request.json(), BULK_MAX_ITEMS)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    started = time.perf_counter()
+    try:
+        results = await offload(server.bulk_apply, items)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+    return web.json_response(bulk.summary(results, time.perf_counter() - started))
+
+
+async def api_payments(request: web.Request):
+    status = request.query.get('status', server.PENDING)
+    if status not in server.PAYMENT_STATUSES:
+        return web.json_response({'error': 'status: ' + ', '.join(server.PAYMENT_STATUSES)}, status=400)
+    try:
+        return web.json_response(await offload(server.list_payments, status))
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def api_payment_approve(request: web.Request):
+    try:
+        pid, months = server.parse_payment_decision(await read_json(request))
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    body, code = await offload(server.decide_payment, server.approve_payment, pid, months)
+    return web.json_response(body, status=code)
+
+
+async def api_payment_reject(request: web.Request):
+    try:
+        pid, _ = server.parse_payment_decision(await read_json(request))
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    body, code = await offload(server.decide_payment, server.reject_payment, pid)
+    return web.json_response(body, status=code)
+
+
+async def api_broadcast(request: web.Request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = None
+    try:
+        text, query = server.parse_broadcast(data)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    from sender import SenderFull  # with bot.py, on first use
+    try:
+        uids = await offload(lambda: [row['uid'] for row in server.iter_subs(query)])
+        tg = server.loaded_telegram() or await offload(server.telegram)
+        return web.json_response(await tg.broadcast(uids, text))
+    except SenderFull as e:
+        return web.json_response({'error': str(e)}, status=503)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def api_broadcast_status(request: web.Request):
+    tg = server.loaded_telegram()
+    stats = tg.sender.broadcast_stats(request.match_info['bid']) if tg is not None else None
+    if stats is None:
+        return web.json_response({'error': "Topilmadi"}, status=404)
+    return web.json_response(stats)
+
+
+async def api_profile(request: web.Request):
+    try:
+        seconds, interval = server.profile_args(request.query)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    profiling.expect_slow()
+    # On the default executor: a storage worker shouldn't sit out the whole profile
+    out = await asyncio.get_running_loop().run_in_executor(None, server.run_profile, seconds, interval)
+    if out is None:
+        return web.json_response({'error': "Profil allaqachon olinmoqda"}, status=409)
+    return web.Response(text=out, content_type='text/plain', charset='utf-8')
+
+
+async def api_profile_slow(request: web.Request):
+    return web.json_response({'tracing': server.tracer.stats(), 'slow': server.tracer.recent()})
+
+
+async def api_subscription_status(request: web.Request):
+    try:
+        tg_id = server.status_uid(request.query.get('tg_id'), request.get('token'),
+                                  lambda: get_session(request).get('tg_id'))
+    except PermissionError as e:
+        return web.json_response({'error': str(e)}, status=403)
+    if not tg_id:
+        return web.json_response({'subscribed': False, 'days_left': 0})
+    uid = str(tg_id)
+    try:
+        if server.STATUS_BLOCKS and not status_cache.peek(uid):
+            st = await offload(server.status, uid)
+        else:
+            # Cache hits and the in-memory store's lookups need no thread
+            st = server.status(uid)
+    except Exception:
+        return web.json_response({'subscribed': False, 'days_left': 0})
+    tag = server.status_etag(st)
+    if responses.etag_matches(request.headers.get('If-None-Match', ''), tag):
+        return web.Response(status=304, headers={'ETag': 'W/"%s"' % tag})
+    return web.json_response(st, headers={'ETag': 'W/"%s"' % tag})
+
+
+# -------------- app factory --------------
+async def on_startup(app: web.Application, setup_webhook: bool = False):
+    updates.attach()
+    server.start_background(setup_webhook=setup_webhook)
+
+
+async def on_cleanup(app: web.Application):
+    server.sweeper.stop()
+    server.payment_intake.stop()
+    server.stop_sender()
+    await updates.detach()
+    _executor.shutdown(wait=False)
+
+
+def create_app(setup_webhook: bool = False) -> web.Application:
+    """``gunicorn 'aioserver:create_app()'``. The webhook is registered by one
+    process only: the first gunicorn worker (gunicorn.conf.py) or ``python aioserver.py``."""
+    server.init_storage()
+    server.admin_page.load()
+    server.login_page.load()
+    app = web.Application(middlewares=[metrics_middleware, cors_middleware, auth_middleware, compression_middleware])
+    app.router.add_post('/tg/webhook', tg_webhook)
+    app.router.add_get('/admin.html', serve_admin)
+    app.router.add_get('/login.html', serve_login)
+    app.router.add_get('/auth', auth)
+    app.router.add_get('/', index)
+    app.router.add_get('/_debug', debug)
+    app.router.add_get('/_version', version)
+    app.router.add_get('/_ready', ready)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_get('/api/stats', api_stats)
+    app.router.add_get('/api/subscriptions', api_subscriptions)
+    app.router.add_get('/api/subscriptions/changes', api_subscriptions_changes)
+    app.router.add_get('/api/subscriptions/export', api_subscriptions_export)
+    app.router.add_post('/api/subscriptions/bulk', api_subscriptions_bulk)
+    app.router.add_post('/api/subscription', api_subscription)
+    app.router.add_post('/api/subscription/add', api_subscription_add)
+    app.router.add_post('/api/subscription/reset', api_subscription_reset)
+    app.router.add_post('/api/subscription/note', api_subscription_note)
+    app.router.add_post('/api/subscription/delete', api_subscription_delete)
+    app.router.add_get('/api/subscription/status', api_subscription_status)
+    app.router.add_get('/api/payments', api_payments)
+    app.router.add_post('/api/payments/approve', api_payment_approve)
+    app.router.add_post('/api/payments/reject', api_payment_reject)
+    app.router.add_post('/api/broadcast', api_broadcast)
+    app.router.add_get('/api/broadcast/{bid}', api_broadcast_status)
+    app.router.add_get('/api/profile', api_profile)
+    app.router.add_get('/api/profile/slow', api_profile_slow)
+    app.on_startup.append(functools.partial(on_startup, setup_webhook=setup_webhook))
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(setup_webhook=bool(os.environ.get('RENDER')) and server.TG_UPDATES == 'webhook'), host="0.0.0.0", port=int(os.environ.get("PORT", 10000)))
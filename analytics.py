@@ -0,0 +1,163 @@
+"""Dashboard numbers for /api/stats: active, expiring soon, churn by month, revenue.
+
+With the JSON store, ``ExpiryColumns`` is fed through ``subscribe`` like the
+expiry heap: one int64 slot (epoch seconds) per uid in an ``array``, updated
+in O(1) per mutation, so a request never walks the record dicts or parses a
+timestamp. With NumPy installed the counts are vectorised over that buffer
+without copying it; without NumPy a plain loop over the array does the same.
+Postgres answers the same questions with one aggregate query (server.py).
+"""
+from array import array
+from bisect import bisect_right
+from threading import Lock
+from datetime import datetime, timedelta
+
+try:
+    import numpy
+except ImportError:  # optional: only makes the counts faster
+    numpy = None
+
+WINDOWS = (1, 3, 7)  # "expires within N days" buckets
+NONE = -(1 << 63)  # no expiry / free slot; sorts below every real date
+EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(dt: datetime) -> int:
+    return (dt - EPOCH) // timedelta(seconds=1)
+
+
+def month_starts(now: datetime, months: int) -> list:
+    """First instant of each of the last ``months`` months (UTC), oldest first"""
+    year, month = now.year, now.month
+    out = []
+    for _ in range(months):
+        out.append(datetime(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return out[::-1]
+
+
+def monthly_price(plans: dict) -> int:
+    """Price of one month: the 1-month plan, else the cheapest per-month rate"""
+    if 1 in plans:
+        return plans[1]
+    return min((price // months for months, price in plans.items()), default=0)
+
+
+def report(total: int, active: int, no_expiry: int, expiring: dict, churn: dict, plans: dict) -> dict:
+    price = monthly_price(plans)
+    return {
+        'total': total,
+        'active': active,
+        'expired': total - active - no_expiry,
+        'no_expiry': no_expiry,
+        'expiring': {'%dd' % days: expiring[days] for days in WINDOWS},
+        'churn_by_month': churn,
+        'revenue': {
+            'monthly_price': price,
+            'monthly': active * price,  # if every active subscriber renews monthly
+            'at_risk': expiring[WINDOWS[-1]] * price,
+        },
+    }
+
+
+class ExpiryColumns:
+    """uid -> slot map over an int64 column of expiry times"""
+
+    def __init__(self):
+        self._slot = {}  # uid -> index into _expiry
+        self._expiry = array('q')
+        self._free = []
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._slot)
+
+    def on_change(self, uid: str, old, new):
+        expiry = NONE
+        if new is not None and new.get('expiry'):
+            try:
+                at = datetime.fromisoformat(new['expiry'])
+            except (TypeError, ValueError):
+                at = None
+            if at is not None:
+                if at.tzinfo is not None:
+                    at = at.replace(tzinfo=None) - at.utcoffset()
+                expiry = _seconds(at)
+        with self._lock:
+            self._set(uid, new is not None, expiry)
+
+    def _set(self, uid: str, present: bool, expiry: int):
+        slot = self._slot.get(uid)
+        if not present:
+            if slot is not None:
+                del self._slot[uid]
+                self._expiry[slot] = NONE
+                self._free.append(slot)
+        elif slot is not None:
+            self._expiry[slot] = expiry
+        elif self._free:
+            slot = self._slot[uid] = self._free.pop()
+            self._expiry[slot] = expiry
+        else:
+            self._slot[uid] = len(self._expiry)
+            self._expiry.append(expiry)
+
+    def load_columns(self, uids, expiry, *marks):
+        """on_change(uid, None, record) for a whole snapshot given as int64 columns
+        (see binstore.BinarySnapshot.columns): the expiry column is copied as is"""
+        with self._lock:
+            if self._slot or self._free:
+                for uid, at in zip(uids, expiry):
+                    self._set(str(uid), True, at)
+                return
+            self._expiry = array('q', expiry.tobytes())
+            self._slot = dict(zip(map(str, uids), range(len(self._expiry))))
+
+    def counts(self, now: datetime, months: int) -> dict:
+        """report() arguments, minus the plans"""
+        now_s = _seconds(now)
+        starts = month_starts(now, months)
+        edges = [_seconds(m) for m in starts]
+        limits = [now_s + days * 86400 for days in WINDOWS]
+        with self._lock:
+            total = len(self._slot)
+            free = len(self._free)
+            if numpy is not None:
+                col = numpy.frombuffer(self._expiry, dtype=numpy.int64)
+                live = col > now_s
+                active = int(numpy.count_nonzero(live))
+                soon = col[live]
+                expiring = [int(numpy.count_nonzero(soon <= limit)) for limit in limits]
+                # Expired within the window: bucket i is [edges[i], edges[i+1])
+                past = col[(col >= edges[0]) & ~live]
+                churned = numpy.bincount(numpy.searchsorted(edges, past, side='right') - 1,
+                                         minlength=months).tolist()
+                # Free slots hold NONE like records without an expiry
+                no_expiry = int(numpy.count_nonzero(col == NONE)) - free
+                del col
+            else:
+                active = no_expiry = 0
+                expiring = [0] * len(WINDOWS)
+                churned = [0] * months
+                first = edges[0]
+                for e in self._expiry:
+                    if e > now_s:
+                        active += 1
+                        for i, limit in enumerate(limits):
+                            if e <= limit:
+                                expiring[i] += 1
+                    elif e >= first:
+                        churned[bisect_right(edges, e) - 1] += 1
+                    elif e == NONE:
+                        no_expiry += 1
+                no_expiry -= free
+        return {
+            'total': total,
+            'active': active,
+            'no_expiry': no_expiry,
+            'expiring': dict(zip(WINDOWS, expiring)),
+            'churn': {m.strftime('%Y-%m'): n for m, n in zip(starts, churned)},
+        }
+
+    def stats(self) -> dict:
+        return {'records': len(self._slot), 'slots': len(self._expiry), 'numpy': numpy is not None}
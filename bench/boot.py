@@ -0,0 +1,134 @@
+"""Cold-start timings of the service, checked against targets.
+
+Measures, each in fresh interpreters (median of ``--runs``):
+    import    ``import server`` alone: no I/O, no aiogram/psycopg2
+    listen    spawn of ``python server.py`` until it answers /_version
+    ready     spawn until /_ready says the startup steps are done
+
+Exits 1 if a median is over its target, so it can gate CI runs. The JSON
+backend with a generated dataset is used unless --database-url is given.
+
+    python bench/boot.py --size 10000 --runs 5
+"""
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datasets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds, on a free-tier sized box (1 shared CPU)
+TARGETS = {'import': 500, 'listen': 1500, 'ready': 5000}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def time_import(env: dict) -> float:
+    code = 'import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)'
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return float(out.strip().splitlines()[-1]) * 1000
+
+
+def _get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as r:
+            return r.status, r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except OSError:
+        return None, None
+
+
+def time_boot(env: dict, timeout: float = 60.0) -> tuple:
+    """(ms until the port answers, ms until /_ready is 200, /_ready body)"""
+    port = free_port()
+    env = dict(env, PORT=str(port))
+    base = 'http://127.0.0.1:%d' % port
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, 'server.py'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    listen = ready = None
+    body = None
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and ready is None:
+            if proc.poll() is not None:
+                raise RuntimeError('server exited with code %s' % proc.returncode)
+            if listen is None:
+                status, _ = _get(base + '/_version')
+                if status == 200:
+                    listen = (time.perf_counter() - started) * 1000
+            if listen is not None:
+                status, raw = _get(base + '/_ready')
+                if status == 200:
+                    ready = (time.perf_counter() - started) * 1000
+                    body = json.loads(raw)
+            time.sleep(0.01)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    if ready is None:
+        raise RuntimeError('server did not become ready in %ss' % timeout)
+    return listen, ready, body
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--size', type=int, default=10000, help='subscribers in the JSON dataset')
+    p.add_argument('--database-url', help='boot against this Postgres instead (add ?sslmode=disable)')
+    p.add_argument('--runs', type=int, default=5)
+    for name, ms in TARGETS.items():
+        p.add_argument('--%s-target' % name, type=float, default=ms, help='ms (default %d)' % ms)
+    args = p.parse_args(argv)
+
+    env = dict(os.environ, SWEEP_ENABLED='0', TOKEN_SECRET=os.urandom(16).hex())
+    env.pop('RENDER', None)  # never touch the real webhook
+    if args.database_url:
+        env['DATABASE_URL'] = args.database_url
+    else:
+        env.pop('DATABASE_URL', None)
+        env['SUBS_PATH'] = os.path.join(tempfile.mkdtemp(prefix='abakus-boot-'), 'subscriptions.json')
+        datasets.write_json(env['SUBS_PATH'], args.size)
+
+    samples = {'import': [], 'listen': [], 'ready': []}
+    steps = None
+    for _ in range(args.runs):
+        samples['import'].append(time_import(env))
+        listen, ready, body = time_boot(env)
+        samples['listen'].append(listen)
+        samples['ready'].append(ready)
+        steps = body['steps']
+
+    failed = 0
+    for name, values in samples.items():
+        median = statistics.median(values)
+        target = getattr(args, '%s_target' % name)
+        over = median > target
+        failed += over
+        print('%-7s median %7.0f ms  (min %5.0f, max %5.0f)  target %5.0f ms  %s' % (
+            name, median, min(values), max(values), target, 'OVER' if over else 'ok'))
+    print('startup steps (last run):', ', '.join('%s %.3fs' % (k, v['seconds'] or 0) for k, v in steps.items()))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
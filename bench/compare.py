@@ -0,0 +1,70 @@
+"""Compare two bench/load.py result files and flag regressions.
+
+    python bench/compare.py base.json new.json [--threshold 10]
+
+Prints the change of throughput and latency percentiles per scenario. Exits
+with status 1 if any scenario's rps dropped, or its p50/p95/p99 latency
+grew, by more than the threshold percentage, so it can gate CI runs. A
+warning is shown when the runs used different setups (size, server,
+backend, concurrency, workers), because their numbers are not comparable then.
+"""
+import sys
+import json
+import argparse
+
+SETUP_KEYS = ('server', 'backend', 'size', 'concurrency', 'workers', 'duration_s', 'api_latency_ms')
+# metric, True if higher is better
+METRICS = (('rps', True), ('p50_ms', False), ('p95_ms', False), ('p99_ms', False), ('rss_max_mb', False))
+# memory is reported but never fails the comparison
+GATED = ('rps', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def change(old: float, new: float):
+    if not old:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(base: dict, new: dict, threshold: float) -> list:
+    """[(scenario, metric, old, new, change %, regressed)]"""
+    rows = []
+    for name, old in base['scenarios'].items():
+        cur = new['scenarios'].get(name)
+        if cur is None:
+            continue
+        for metric, higher_better in METRICS:
+            pct = change(old.get(metric, 0), cur.get(metric, 0))
+            worse = pct is not None and (-pct if higher_better else pct) > threshold
+            rows.append((name, metric, old.get(metric), cur.get(metric), pct, worse and metric in GATED))
+    return rows
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=10.0, help='allowed change in percent')
+    args = p.parse_args(argv)
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+
+    differs = [k for k in SETUP_KEYS if base['meta'].get(k) != new['meta'].get(k)]
+    if differs:
+        print('warning: runs differ in %s, numbers are not directly comparable' % ', '.join(differs))
+    print('base %s (%s)  ->  new %s (%s)' % (base['meta'].get('commit'), base['meta'].get('time'),
+                                             new['meta'].get('commit'), new['meta'].get('time')))
+    regressions = 0
+    for name, metric, old, cur, pct, regressed in compare(base, new, args.threshold):
+        mark = '  REGRESSION' if regressed else ''
+        pct_s = '%+7.1f%%' % pct if pct is not None else '     n/a'
+        print('%-8s %-11s %12s -> %-12s %s%s' % (name, metric, old, cur, pct_s, mark))
+        regressions += regressed
+    if regressions:
+        print('%d regression(s) beyond %.0f%%' % (regressions, args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
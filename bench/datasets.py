@@ -0,0 +1,71 @@
+"""Synthetic subscriber datasets for the load tests.
+
+The same ``size`` and ``seed`` always produce the same rows, so results of
+different runs are comparable. Expiries are spread from 60 days in the past
+to a year ahead (roughly 15% expired, a few percent expiring within a week).
+
+    python bench/datasets.py json 100000 /tmp/subs.json
+    python bench/datasets.py postgres 100000 "postgresql://localhost/abakus?sslmode=disable"
+"""
+import io
+import sys
+import json
+import random
+from datetime import datetime, timedelta
+
+FIRST_UID = 100000000
+NOTES = ('', '', '', 'click', 'payme', 'naqd', 'chegirma')
+
+
+def uids(size: int) -> list:
+    return [str(FIRST_UID + i) for i in range(size)]
+
+
+def rows(size: int, seed: int = 1):
+    """Yield (uid, expiry datetime, note)"""
+    rnd = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    for uid in uids(size):
+        yield uid, now + timedelta(seconds=rnd.randint(-60 * 86400, 365 * 86400)), rnd.choice(NOTES)
+
+
+def write_json(path: str, size: int, seed: int = 1):
+    """subscriptions.json in the store format: {uid: {expiry, note}}"""
+    data = {uid: {'expiry': expiry.isoformat(), 'note': note} for uid, expiry, note in rows(size, seed)}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_postgres(dsn: str, size: int, seed: int = 1):
+    """Replace the contents of the subscriptions table with the dataset (COPY)"""
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                  uid TEXT PRIMARY KEY,
+                  expiry TIMESTAMP WITH TIME ZONE,
+                  note TEXT
+                );
+                TRUNCATE subscriptions;
+                """
+            )
+            buf = io.StringIO()
+            for uid, expiry, note in rows(size, seed):
+                buf.write('%s\t%s+00\t%s\n' % (uid, expiry.isoformat(sep=' '), note))
+            buf.seek(0)
+            cur.copy_expert("COPY subscriptions (uid, expiry, note) FROM STDIN", buf)
+            cur.execute("ANALYZE subscriptions")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ('json', 'postgres'):
+        sys.exit(__doc__)
+    kind, n, target = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+    (write_json if kind == 'json' else load_postgres)(target, n)
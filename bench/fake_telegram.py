@@ -0,0 +1,90 @@
+"""Local stand-in for the Telegram Bot API.
+
+Answers every ``/bot<token>/<method>`` call with ``{"ok": true}`` and a
+minimal result after an optional delay, so the bot can be driven without
+network access. Point the service at it with TELEGRAM_API_BASE. getUpdates
+serves whatever ``add_updates`` queued, honouring offset, limit and timeout.
+
+    python bench/fake_telegram.py [port] [latency_ms]
+"""
+import sys
+import json
+import time
+import asyncio
+from collections import deque
+
+from aiohttp import web
+
+
+def _message(chat_id) -> dict:
+    return {
+        'message_id': 1,
+        'date': int(time.time()),
+        'chat': {'id': int(chat_id or 0), 'type': 'private'},
+    }
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {}
+        self.updates = deque()  # for getUpdates, update_id ascending
+        self.offset = 0  # highest offset a getUpdates call confirmed
+        self._more = None
+
+    def add_updates(self, updates: list):
+        """Queue updates for getUpdates (call on the server's loop)"""
+        self.updates.extend(updates)
+        if self._more is not None:
+            self._more.set()
+
+    async def get_updates(self, data) -> list:
+        offset = int(data.get('offset') or 0)
+        limit = int(data.get('limit') or 100)
+        self.offset = max(self.offset, offset)
+        while self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()  # confirmed
+        if not self.updates and data.get('timeout'):
+            self._more = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._more.wait(), float(data['timeout']))
+            except asyncio.TimeoutError:
+                pass
+        return [u for _, u in zip(range(limit), self.updates)]
+
+    async def handle(self, request: web.Request):
+        method = request.match_info['method'].lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        try:
+            data = await request.post()
+        except Exception:
+            data = {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.startswith('send') or method.startswith('edit'):
+            result = _message(data.get('chat_id'))
+        elif method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif method == 'getupdates':
+            result = await self.get_updates(data)
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result}, dumps=json.dumps)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+    async def start(self, port: int = 0) -> web.AppRunner:
+        """Serve on 127.0.0.1:port; returns the runner (runner.addresses has the port)"""
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        return runner
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    web.run_app(FakeTelegram(latency).app(), host='127.0.0.1', port=port)
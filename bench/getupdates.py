@@ -0,0 +1,155 @@
+"""Updates per second: polling.py's runner against the webhook path.
+
+Both feed the same generated updates (bench/load.py's samples spread over
+--chats chats, fresh update_ids) through bot.dp, with the Bot API answered
+by a local fake (bench/fake_telegram.py), all in this process:
+
+    webhook  POST /tg/webhook to the aiohttp app (aioserver.py) at --concurrency,
+             503s retried like Telegram would, until the update queue is drained
+    polling  polling.Poller fetching the same number from the fake getUpdates
+             until every update has been handled
+
+    python bench/getupdates.py [--updates 20000] [--chats 500] [--concurrency 64] [--api-latency 0]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram
+from load import SAMPLE_UPDATES
+
+FIRST_CHAT = 700000000
+
+
+def make_updates(count: int, chats: int, first_id: int) -> list:
+    now = int(time.time())
+    out = []
+    for i in range(count):
+        raw = json.dumps(SAMPLE_UPDATES[i % len(SAMPLE_UPDATES)])
+        chat = FIRST_CHAT + i % chats
+        # date 0 would make aiogram treat callback messages as inaccessible
+        raw = raw.replace('"id": 0', '"id": %d' % chat).replace('"date": 0', '"date": %d' % now)
+        update = json.loads(raw)
+        update['update_id'] = first_id + i
+        out.append(update)
+    return out
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def bench_webhook(aioserver, server, batch: list, concurrency: int) -> dict:
+    from aiohttp import web
+    runner = web.AppRunner(aioserver.create_app(), access_log=None)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    url = 'http://127.0.0.1:%d/tg/webhook' % port
+    todo = iter(batch)
+    retries = 0
+
+    async def post(http):
+        nonlocal retries
+        for update in todo:
+            body = json.dumps(update)
+            while True:
+                async with http.post(url, data=body, headers={'Content-Type': 'application/json'}) as r:
+                    await r.read()
+                    if r.status != 503:
+                        break
+                retries += 1
+                await asyncio.sleep(0.01)
+
+    try:
+        server.telegram()  # import outside the timing, as after /_ready
+        started = time.perf_counter()
+        async with aiohttp.ClientSession() as http:
+            await asyncio.gather(*(post(http) for _ in range(concurrency)))
+        while True:
+            stats = server.updates.stats()
+            if stats['depth'] == 0 and stats['in_flight'] == 0:
+                break
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+    return {'updates': len(batch), 'seconds': round(elapsed, 3), 'updates_per_s': round(len(batch) / elapsed, 1),
+            'retries_503': retries, 'handled': stats['processed'] + stats['failed']}
+
+
+async def bench_polling(polling, server, fake: FakeTelegram, batch: list, state_path: str, workers: int) -> dict:
+    tg = server.telegram()
+    poller = polling.Poller(tg.dp, tg.bot, state_path, workers=workers, timeout=1,
+                            allowed_updates=tg.prefilter.allowed_updates)
+    fake.add_updates(batch)
+    started = time.perf_counter()
+    task = asyncio.create_task(poller.run())
+    while poller.processed + poller.failed < len(batch):
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    poller.stop()
+    await task
+    await tg.bot.session.close()
+    stats = poller.stats()
+    return {'updates': len(batch), 'seconds': round(elapsed, 3), 'updates_per_s': round(len(batch) / elapsed, 1),
+            'fetches': stats['fetches'], 'saves': stats['saves'], 'workers': workers}
+
+
+async def main(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='abakus-poll-')
+    fake = FakeTelegram(args.api_latency / 1000)
+    runner = await fake.start()
+    os.environ.update(SWEEP_ENABLED='0', TOKEN_SECRET=os.urandom(16).hex(),
+                      SUBS_PATH=os.path.join(workdir, 'subscriptions.json'),
+                      TELEGRAM_API_BASE='http://127.0.0.1:%d' % runner.addresses[0][1])
+    os.environ.pop('RENDER', None)
+    import server
+    import aioserver
+    import polling
+    from config import UPDATE_WORKERS
+    try:
+        results = {
+            'webhook': await bench_webhook(aioserver, server, make_updates(args.updates, args.chats, 1),
+                                           args.concurrency),
+            'polling': await bench_polling(polling, server, fake, make_updates(args.updates, args.chats,
+                                                                               args.updates + 1),
+                                           os.path.join(workdir, 'polling.json'), args.workers),
+        }
+    finally:
+        await runner.cleanup()
+    results['meta'] = {'chats': args.chats, 'concurrency': args.concurrency, 'update_workers': UPDATE_WORKERS,
+                       'api_latency_ms': args.api_latency, 'cpus': os.cpu_count()}
+    return results
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--updates', type=int, default=20000)
+    p.add_argument('--chats', type=int, default=500)
+    p.add_argument('--concurrency', type=int, default=64, help='webhook: parallel POSTs (Telegram uses up to 100)')
+    p.add_argument('--workers', type=int, default=32, help='polling: chats handled at once')
+    p.add_argument('--api-latency', type=float, default=0.0, help='fake Bot API delay per call, ms')
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    out = asyncio.run(main(parse_args()))
+    for name in ('webhook', 'polling'):
+        r = out[name]
+        print('%-8s %7d updates  %7.3f s  %9.1f updates/s' % (name, r['updates'], r['seconds'], r['updates_per_s']))
+    print(json.dumps(out, indent=2))
@@ -0,0 +1,136 @@
+"""Per-update CPU time of the bot.py callback handlers.
+
+Feeds the same callback/message updates through two dispatchers: the
+current bot.dp (prebuilt keyboards.py screens) and a copy of the handlers as
+they were before, which built every keyboard and text on each click. The Bot
+uses a session that answers every API call locally, so only dispatch and
+handler work is measured.
+
+    python bench/handlers.py [updates_per_kind]
+"""
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, types, F
+from aiogram.enums import ParseMode
+from aiogram.filters import CommandStart
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.client.session.base import BaseSession
+
+import bot as bot_module
+from payments import PaymentIntake
+from config import CARD_NUMBER, CARD_NAME
+
+
+class LocalSession(BaseSession):
+    """Answers every Bot API call with True without touching the network"""
+
+    async def make_request(self, bot, method, timeout=None):
+        # Serialize the request like a real session would, so markup cost counts
+        self.build_request(bot, method)
+        return True
+
+    def build_request(self, bot, method):
+        return {key: self.prepare_value(value, bot=bot, files={})
+                for key, value in method.model_dump(warnings=False).items() if value is not None}
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def legacy_dispatcher() -> Dispatcher:
+    """The handlers as they were before keyboards.py"""
+    dp = Dispatcher()
+
+    @dp.message(CommandStart())
+    async def start_cmd(message: types.Message):
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📅 Obuna bo'lish", callback_data="subscribe")]
+        ])
+        await message.answer("Assalomu alaykum!\nObuna bo'lish uchun tugmani bosing 👇", reply_markup=kb)
+
+    @dp.callback_query(F.data == "subscribe")
+    async def show_subscription_options(callback: types.CallbackQuery):
+        buttons = []
+        for m in [1, 2, 3, 6, 9, 12]:
+            buttons.append(InlineKeyboardButton(text=f"{m} oy", callback_data=f"month_{m}"))
+        kb = InlineKeyboardMarkup(inline_keyboard=[buttons[i:i+3] for i in range(0, len(buttons), 3)])
+        await callback.answer()
+        await callback.message.edit_text("Nechi oylik obuna olmoqchisiz?", reply_markup=kb)
+
+    @dp.callback_query(F.data.startswith("month_"))
+    async def show_price(callback: types.CallbackQuery):
+        months = int(callback.data.split("_")[1])
+        price = months * 36000
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⬅ Orqaga", callback_data="subscribe")],
+            [InlineKeyboardButton(text="📋 Karta raqamini nusxalash", callback_data="copy_card")],
+            [InlineKeyboardButton(text="📤 To‘lov chekini yuborish", callback_data="send_receipt")]
+        ])
+        await callback.answer()
+        await callback.message.edit_text(
+            f"📅 {months} oylik obuna narxi: {price:,} so‘m\n\n"
+            f"Karta: `{CARD_NUMBER}`\nEgasi: {CARD_NAME}",
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=kb
+        )
+
+    @dp.callback_query(F.data == "copy_card")
+    async def copy_card(callback: types.CallbackQuery):
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📤 To‘lov chekini yuborish", callback_data="send_receipt")]
+        ])
+        await callback.message.answer(f"💳 Karta raqami: `{CARD_NUMBER}`\n\nEndi to'lov chekini yuboring.",
+                                      parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        await callback.answer("Karta raqamini xabardan oson nusxalashingiz mumkin", show_alert=True)
+
+    return dp
+
+
+_USER = {'id': 1001, 'is_bot': False, 'first_name': 'Test'}
+_CHAT = {'id': 1001, 'type': 'private'}
+_MESSAGE = {'message_id': 1, 'date': 0, 'chat': _CHAT, 'from': _USER, 'text': 'x'}
+
+
+def sample_updates() -> dict:
+    kinds = {'start': {'message': dict(_MESSAGE, text='/start', entities=[
+        {'type': 'bot_command', 'offset': 0, 'length': 6}])}}
+    for data in ('subscribe', 'month_3', 'copy_card'):
+        kinds[data] = {'callback_query': {'id': '1', 'from': _USER, 'chat_instance': '1',
+                                          'message': _MESSAGE, 'data': data}}
+    return {kind: types.Update.model_validate(dict(raw, update_id=1)) for kind, raw in kinds.items()}
+
+
+async def measure(dp: Dispatcher, bot: Bot, update, n: int) -> float:
+    """Average CPU microseconds per update"""
+    for _ in range(min(n, 100)):  # warm-up
+        await dp.feed_update(bot, update)
+    started = time.process_time()
+    for _ in range(n):
+        await dp.feed_update(bot, update)
+    return (time.process_time() - started) / n * 1e6
+
+
+async def main(n: int):
+    bot = Bot(token=bot_module.bot.token, session=LocalSession())
+    # The new handlers post the admin receipt through bot.sender; keep it local too
+    bot_module.sender.bot = bot
+    # show_price remembers the chosen plan in the intake (never started here)
+    bot_module.dp['payments'] = PaymentIntake(None, None, None)
+    before, after = legacy_dispatcher(), bot_module.dp
+    print(f"{'update':<12}{'before us':>12}{'after us':>12}{'speedup':>10}")
+    for kind, update in sample_updates().items():
+        old = await measure(before, bot, update, n)
+        new = await measure(after, bot, update, n)
+        print(f"{kind:<12}{old:>12.1f}{new:>12.1f}{old / new:>9.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,374 @@
+"""HTTP load test of the service against a synthetic dataset, fully local.
+
+Generates a dataset (bench/datasets.py), starts a fake Bot API
+(bench/fake_telegram.py) and the service itself as a subprocess, then drives
+each scenario at the given concurrency for a fixed time and reports
+p50/p95/p99 latency, throughput and the server's RSS. Results are written as
+JSON; compare two runs with bench/compare.py.
+
+    python bench/load.py --size 100000 --server gunicorn --concurrency 32 --duration 15
+    python bench/load.py --size 100000 --server gunicorn --workers 4 --scenarios status,mutate
+    python bench/load.py --backend postgres --database-url "postgresql://localhost/abakus?sslmode=disable"
+
+Scenarios:
+    status    GET  /api/subscription/status for random known (90%) and unknown uids
+    list      GET  /api/subscriptions pages (limit 100, random sort/state), following cursors
+    mutate    POST /api/subscription{,/add,/note} on random uids
+    webhook   POST /tg/webhook replaying update payloads (--updates FILE, one JSON per
+              line as Telegram posts them; built-in samples otherwise), fresh update_id each
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import signal
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import Counter
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datasets
+import tokens
+from fake_telegram import FakeTelegram
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+SERVERS = {
+    # the Procfile commands (worker count from WEB_CONCURRENCY via gunicorn.conf.py)
+    'gunicorn': ['gunicorn', 'server:create_app()', '--bind', '127.0.0.1:{port}',
+                 '--worker-class', 'gthread', '--timeout', '120', '--preload'],
+    'gunicorn-aio': ['gunicorn', 'aioserver:create_app()', '--bind', '127.0.0.1:{port}',
+                     '--worker-class', 'aiohttp.GunicornWebWorker', '--timeout', '120'],
+    # development servers, when gunicorn is not installed
+    'flask': [sys.executable, 'server.py'],
+    'aiohttp': [sys.executable, 'aioserver.py'],
+}
+
+_USER = {'id': 0, 'is_bot': False, 'first_name': 'Bench'}
+SAMPLE_UPDATES = [
+    {'message': {'message_id': 1, 'date': 0, 'chat': {'id': 0, 'type': 'private'}, 'from': _USER,
+                 'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}},
+    {'callback_query': {'id': '1', 'from': _USER, 'chat_instance': '1', 'data': 'subscribe',
+                        'message': {'message_id': 1, 'date': 0, 'chat': {'id': 0, 'type': 'private'}}}},
+    {'callback_query': {'id': '1', 'from': _USER, 'chat_instance': '1', 'data': 'month_3',
+                        'message': {'message_id': 1, 'date': 0, 'chat': {'id': 0, 'type': 'private'}}}},
+    {'message': {'message_id': 1, 'date': 0, 'chat': {'id': 0, 'type': 'private'}, 'from': _USER,
+                 'photo': [{'file_id': 'f', 'file_unique_id': 'u', 'width': 90, 'height': 90}]}},
+    {'message': {'message_id': 1, 'date': 0, 'chat': {'id': 0, 'type': 'private'}, 'from': _USER,
+                 'text': 'salom'}},
+]
+
+
+# -------------- scenarios --------------
+class Context:
+    def __init__(self, base: str, size: int, updates: list, seed: int, token: str = None):
+        self.base = base
+        self.headers = {'Authorization': 'Bearer ' + token} if token else {}
+        self.size = size
+        self.updates = updates
+        self.rnd = random.Random(seed)
+        self.update_id = 0
+
+    def uid(self, known: float = 1.0) -> str:
+        if self.rnd.random() < known:
+            return str(datasets.FIRST_UID + self.rnd.randrange(self.size))
+        return str(datasets.FIRST_UID + self.size + self.rnd.randrange(1000000))
+
+
+async def step_status(http, ctx: Context, local: dict) -> int:
+    async with http.get(ctx.base + '/api/subscription/status', params={'tg_id': ctx.uid(0.9)}) as r:
+        await r.read()
+        return r.status
+
+
+async def step_list(http, ctx: Context, local: dict) -> int:
+    params = local.get('next')
+    if params is None:
+        params = {'limit': '100', 'sort': ctx.rnd.choice(('uid', '-expiry')),
+                  'state': ctx.rnd.choice(('', 'active', 'expiring'))}
+    async with http.get(ctx.base + '/api/subscriptions', params=params) as r:
+        data = await r.json() if r.status == 200 else None
+        # follow the cursor for a few pages, then start over
+        cursor = data.get('next_cursor') if data else None
+        local['next'] = dict(params, cursor=cursor) if cursor and ctx.rnd.random() < 0.8 else None
+        return r.status
+
+
+async def step_mutate(http, ctx: Context, local: dict) -> int:
+    uid = ctx.uid()
+    op = ctx.rnd.random()
+    if op < 0.4:
+        path, body = '/api/subscription', {'uid': uid, 'days': ctx.rnd.choice((30, 90, 180))}
+    elif op < 0.8:
+        path, body = '/api/subscription/add', {'uid': uid, 'add': 30}
+    else:
+        path, body = '/api/subscription/note', {'uid': uid, 'note': 'bench'}
+    async with http.post(ctx.base + path, json=body) as r:
+        await r.read()
+        return r.status
+
+
+async def step_webhook(http, ctx: Context, local: dict) -> int:
+    ctx.update_id += 1
+    update = dict(ctx.rnd.choice(ctx.updates), update_id=ctx.update_id)
+    async with http.post(ctx.base + '/tg/webhook', data=json.dumps(update),
+                         headers={'Content-Type': 'application/json'}) as r:
+        await r.read()
+        return r.status
+
+
+SCENARIOS = {
+    'status': step_status,
+    'list': step_list,
+    'mutate': step_mutate,
+    'webhook': step_webhook,
+}
+
+
+# -------------- measurement --------------
+def rss_bytes(pid: int) -> int:
+    """Resident memory of pid and all its descendants (Linux /proc), 0 if unavailable"""
+    children = {}
+    try:
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open('/proc/%s/stat' % entry) as f:
+                        ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+                    children.setdefault(ppid, []).append(int(entry))
+                except (OSError, ValueError, IndexError):
+                    pass
+        total, todo = 0, [pid]
+        while todo:
+            p = todo.pop()
+            todo.extend(children.get(p, ()))
+            with open('/proc/%d/statm' % p) as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        return total
+    except (OSError, ValueError):
+        return 0
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+async def run_scenario(name: str, ctx: Context, pid: int, concurrency: int, duration: float,
+                       warmup: float) -> dict:
+    step = SCENARIOS[name]
+    latencies, statuses = [], Counter()
+    rss = []
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def worker(http):
+        local = {}
+        while True:
+            t = time.perf_counter()
+            if t >= stop_at:
+                return
+            try:
+                status = await step(http, ctx, local)
+            except Exception as e:
+                status = type(e).__name__
+            if t >= measure_from:
+                latencies.append(time.perf_counter() - t)
+                statuses[str(status)] += 1
+
+    async def sample_rss():
+        while True:
+            rss.append(rss_bytes(pid))
+            await asyncio.sleep(0.25)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60),
+                                     headers=ctx.headers) as http:
+        sampler = asyncio.create_task(sample_rss())
+        await asyncio.gather(*(worker(http) for _ in range(concurrency)))
+        sampler.cancel()
+    elapsed = max(time.perf_counter() - measure_from, 1e-9)
+    latencies.sort()
+    ok = sum(n for s, n in statuses.items() if s.startswith('2'))
+    return {
+        'requests': len(latencies),
+        'ok': ok,
+        'errors': len(latencies) - ok,
+        'statuses': dict(statuses),
+        'rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        'rss_max_mb': round(max(rss, default=0) / 2 ** 20, 1),
+    }
+
+
+# -------------- orchestration --------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+async def wait_ready(base: str, proc: subprocess.Popen, timeout: float = 60.0, path: str = '/_version'):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError('server exited with code %s' % proc.returncode)
+            try:
+                async with http.get(base + path) as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError('server did not become ready in %ss' % timeout)
+
+
+def load_updates(path: str) -> list:
+    if not path:
+        return SAMPLE_UPDATES
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def main(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='abakus-bench-')
+    env = dict(os.environ, SWEEP_ENABLED='0', WEB_CONCURRENCY=str(args.workers))
+    env.pop('RENDER', None)  # never touch the real webhook
+    # The API wants a signed token: sign an admin one with a throwaway secret
+    env['TOKEN_SECRET'] = os.urandom(16).hex()
+    token = tokens.TokenSigner(tokens.derive_key(env['TOKEN_SECRET'])).issue(0, tokens.ADMIN, 86400)
+    built = time.perf_counter()
+    if args.backend == 'json':
+        env.pop('DATABASE_URL', None)
+        env['SUBS_PATH'] = os.path.join(workdir, 'subscriptions.json')
+        datasets.write_json(env['SUBS_PATH'], args.size, args.seed)
+    else:
+        if not args.database_url:
+            raise SystemExit('--database-url is required for --backend postgres')
+        env['DATABASE_URL'] = args.database_url
+        datasets.load_postgres(args.database_url, args.size, args.seed)
+    dataset_s = time.perf_counter() - built
+
+    fake = await FakeTelegram(args.api_latency / 1000).start()
+    api_port = fake.addresses[0][1]
+    env['TELEGRAM_API_BASE'] = 'http://127.0.0.1:%d' % api_port
+
+    port = free_port()
+    env['PORT'] = str(port)
+    cmd = [part.format(port=port) for part in SERVERS[args.server]]
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = 'http://127.0.0.1:%d' % port
+    try:
+        boot = time.perf_counter()
+        await wait_ready(base, proc)
+        boot_s = time.perf_counter() - boot
+        await wait_ready(base, proc, path='/_ready')  # schema checked, bot imported
+        ready_s = time.perf_counter() - boot
+        rss_idle = rss_bytes(proc.pid)
+        ctx = Context(base, args.size, load_updates(args.updates), args.seed, token)
+        scenarios = {}
+        for name in args.scenarios.split(','):
+            scenarios[name] = await run_scenario(name, ctx, proc.pid, args.concurrency, args.duration, args.warmup)
+            print_row(name, scenarios[name])
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+        await fake.cleanup()
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'server': args.server,
+            'backend': args.backend,
+            'size': args.size,
+            'seed': args.seed,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'api_latency_ms': args.api_latency,
+            'workdir': workdir,
+        },
+        'startup': {
+            'dataset_s': round(dataset_s, 3),
+            'boot_s': round(boot_s, 3),
+            'ready_s': round(ready_s, 3),
+            'rss_idle_mb': round(rss_idle / 2 ** 20, 1),
+        },
+        'scenarios': scenarios,
+    }
+
+
+def print_row(name: str, r: dict):
+    print('%-8s %8d req %9.1f rps  p50 %8.2f  p95 %8.2f  p99 %8.2f ms  errors %d  rss %.1f MB' % (
+        name, r['requests'], r['rps'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['errors'], r['rss_max_mb']))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--size', type=int, default=10000, help='subscribers in the dataset (1k .. 1M)')
+    p.add_argument('--backend', choices=('json', 'postgres'), default='json')
+    p.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                   help='local Postgres for --backend postgres (add ?sslmode=disable)')
+    p.add_argument('--server', choices=sorted(SERVERS), default='gunicorn')
+    p.add_argument('--scenarios', default=','.join(SCENARIOS))
+    p.add_argument('--concurrency', type=int, default=16)
+    p.add_argument('--workers', type=int, default=1, help='gunicorn worker processes (WEB_CONCURRENCY)')
+    p.add_argument('--duration', type=float, default=10.0, help='measured seconds per scenario')
+    p.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each scenario')
+    p.add_argument('--api-latency', type=float, default=0.0, help='fake Bot API latency, ms')
+    p.add_argument('--updates', help='JSON-lines file of recorded webhook payloads')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--out', help='result file (default: bench/results/<time>-<server>-<backend>-<size>.json)')
+    args = p.parse_args(argv)
+    unknown = set(args.scenarios.split(',')) - set(SCENARIOS)
+    if unknown:
+        p.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = asyncio.run(main(args))
+    out = args.out or os.path.join(RESULTS_DIR, '%s-%s-%s-%d.json' % (
+        time.strftime('%Y%m%d-%H%M%S'), args.server, args.backend, args.size))
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    print('results:', out)
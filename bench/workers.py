@@ -0,0 +1,115 @@
+"""N processes hammering one shared JSON journal at once (SUBS_STORAGE=shared).
+
+Forks ``--workers`` processes with ``--threads`` threads each. Every thread
+does read-modify-write updates the way the storage dispatchers do (add days
+under ``store.lock``) on a small set of hot uids, so lost updates show up
+right away, plus puts/removes of its own uids. A tiny ``--log-bytes`` forces
+compactions in the middle of it. Afterwards every worker and a fresh load
+from disk must agree on the exact totals; exits 1 otherwise.
+
+    python bench/workers.py --workers 4 --threads 4 --ops 500
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import SharedJournalStore
+
+HOT = ['hot%d' % i for i in range(8)]
+
+
+def work(store, worker: int, thread: int, ops: int, seed: int):
+    rnd = random.Random(seed * 1000 + worker * 100 + thread)
+    own = 'w%d-t%d' % (worker, thread)
+    for i in range(ops):
+        uid = rnd.choice(HOT)
+        with store.lock:
+            v = store.get(uid) or {'days': 0}
+            store.put(uid, dict(v, days=v['days'] + 1))
+        if i % 10 == 0:
+            store.put('%s-%d' % (own, i), {'days': i})
+        if i % 20 == 0 and i:
+            store.remove('%s-%d' % (own, i - 10))
+
+
+def expected(args) -> tuple:
+    """(sum of hot days, number of records)"""
+    per_thread = len(range(0, args.ops, 10)) - len(range(20, args.ops, 20))
+    return args.workers * args.threads * args.ops, len(HOT) + args.workers * args.threads * per_thread
+
+
+def totals(store) -> tuple:
+    items = dict(store.items())
+    return sum(items.get(uid, {}).get('days', 0) for uid in HOT), len(items)
+
+
+def child(args, path: str, worker: int, report: str):
+    store = SharedJournalStore(path, max_log_bytes=args.log_bytes, fsync=args.fsync).load()
+    threads = [Thread(target=work, args=(store, worker, t, args.ops, args.seed)) for t in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with open(report, 'w') as f:
+        json.dump({'stats': store.stats()}, f)
+    store.close()
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--workers', type=int, default=4)
+    p.add_argument('--threads', type=int, default=4)
+    p.add_argument('--ops', type=int, default=500, help='updates per thread')
+    p.add_argument('--log-bytes', type=int, default=16384, help='compact past this journal size')
+    p.add_argument('--fsync', choices=('always', 'never'), default='never')
+    p.add_argument('--seed', type=int, default=1)
+    args = p.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='abakus-workers-')
+    path = os.path.join(workdir, 'subscriptions.json')
+    parent = SharedJournalStore(path, max_log_bytes=args.log_bytes, fsync=args.fsync).load()
+    started = time.perf_counter()
+    pids = []
+    for w in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                child(args, path, w, os.path.join(workdir, 'worker%d.json' % w))
+            except BaseException as e:
+                print('worker %d failed: %r' % (w, e), file=sys.stderr)
+                code = 1
+            os._exit(code)
+        pids.append(pid)
+    failed = sum(os.waitpid(pid, 0)[1] != 0 for pid in pids)
+    elapsed = time.perf_counter() - started
+
+    want = expected(args)
+    seen = {'parent (caught up)': totals(parent),
+            'fresh load': totals(SharedJournalStore(path, fsync=args.fsync).load())}
+    updates = args.workers * args.threads * args.ops
+    compactions = 0
+    for w in range(args.workers):
+        with open(os.path.join(workdir, 'worker%d.json' % w)) as f:
+            compactions += json.load(f)['stats']['compactions']
+    print('%d workers x %d threads: %d locked updates in %.2fs (%.0f/s), %d compactions' % (
+        args.workers, args.threads, updates, elapsed, updates / elapsed, compactions))
+    ok = not failed
+    for name, got in seen.items():
+        good = got == want
+        ok = ok and good
+        print('%-20s hot days %d (want %d), records %d (want %d)  %s' % (
+            name, got[0], want[0], got[1], want[1], 'ok' if good else 'MISMATCH'))
+    print('workdir', workdir)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
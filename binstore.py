@@ -0,0 +1,500 @@
+"""Compact binary snapshot of the subscriptions, memory-mapped instead of parsed.
+
+Layout (little-endian)::
+
+    header   magic b'ABKSUB1\\0', record count N, notes blob size
+    uids     N x int64, sorted - the index, binary-searched in place
+    records  N x (expiry, reminded_for, expired_for: int64 epoch seconds
+             or NONE; note offset, note length: uint32)
+    notes    UTF-8 blob, identical notes stored once
+
+Opening one is an mmap: nothing is read until a lookup touches its pages,
+so startup no longer grows with the subscriber count, and pages are shared
+between worker processes. A lookup is a bisect over the uid column plus one
+fixed-width record. Timestamps keep second precision (what the server
+writes anyway); uids must be integers, as Telegram ids are.
+
+Records are four int64 words wide, so each timestamp field is also a
+strided int64 column of the mapping (``columns()``): the expiry indexes are
+built from those at startup without decoding a record, and status lookups
+read one int64 (``expiry_seconds``) instead of building a dict.
+
+    python binstore.py import subscriptions.json subscriptions.bin
+    python binstore.py export subscriptions.bin subscriptions.json
+    python binstore.py compare subscriptions.json subscriptions.bin
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import atexit
+import random
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+from journal import JournalStore
+
+MAGIC = b'ABKSUB1\0'
+HEADER = struct.Struct('<8sQQ')
+RECORD = struct.Struct('<qqqII')
+NONE = -(1 << 63)
+FIELDS = ('expiry', 'reminded_for', 'expired_for')
+EPOCH = datetime(1970, 1, 1)
+
+_MISSING = object()
+
+
+def _int_uid(uid) -> int:
+    try:
+        value = int(uid)
+    except (TypeError, ValueError):
+        value = None
+    if value is None or str(value) != str(uid) or not NONE < value < (1 << 63):
+        raise ValueError('binary store needs integer uids, got %r' % (uid,))
+    return value
+
+
+def _check_record(uid, record: dict):
+    """ValueError unless the binary format can hold ``record`` as it is"""
+    extra = set(record) - set(FIELDS) - {'note'}
+    if extra:
+        raise ValueError('uid %s: fields %s have no place in the binary format' % (uid, sorted(extra)))
+    if not isinstance(record.get('note') or '', str):
+        raise ValueError('uid %s: note must be a string' % (uid,))
+
+
+def _seconds(iso) -> int:
+    if not iso:
+        return NONE
+    try:
+        dt = datetime.fromisoformat(iso)
+    except (TypeError, ValueError):
+        return NONE
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - EPOCH) // timedelta(seconds=1)
+
+
+_DATES = {}  # days since epoch -> 'YYYY-MM-DD'
+_TIMES = {}  # seconds into the day -> 'HH:MM:SS'
+
+
+def iso_seconds(seconds: int):
+    """ISO string of epoch seconds (None for NONE)"""
+    # Same string as datetime.isoformat(), several times faster: decoding a
+    # record is dominated by this, and a few hundred distinct days cover everyone
+    if seconds == NONE:
+        return None
+    days, rest = divmod(seconds, 86400)
+    date = _DATES.get(days)
+    if date is None:
+        date = _DATES[days] = (EPOCH + timedelta(days=days)).date().isoformat()
+    clock = _TIMES.get(rest)
+    if clock is None:
+        clock = _TIMES[rest] = '%02d:%02d:%02d' % (rest // 3600, rest // 60 % 60, rest % 60)
+    return date + 'T' + clock
+
+
+class BinarySnapshot:
+    """Read-only view of a snapshot file; a missing file (or None) is an empty snapshot"""
+
+    def __init__(self, path: str = None):
+        if sys.byteorder != 'little':
+            raise RuntimeError('binary snapshots are little-endian only')
+        self.path = path
+        self._mm = None
+        self._uids = ()
+        self._count = 0
+        if path is None:
+            return
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, notes_size = HEADER.unpack_from(self._mm, 0)
+        self._records = HEADER.size + 8 * count
+        self._notes = self._records + RECORD.size * count
+        if magic != MAGIC or self._notes + notes_size != size:
+            raise ValueError('%s is not a valid subscriptions snapshot' % path)
+        self._count = count
+        self._uids = memoryview(self._mm)[HEADER.size:self._records].cast('q')
+        # A record is 4 int64 words: the three timestamps, then the packed note offset/length
+        self._fields = memoryview(self._mm)[self._records:self._notes].cast('q')
+
+    def __len__(self):
+        return self._count
+
+    def _find(self, uid) -> int:
+        try:
+            key = int(uid)
+        except (TypeError, ValueError):
+            return -1
+        i = bisect_left(self._uids, key)
+        return i if i < self._count and self._uids[i] == key and str(key) == str(uid) else -1
+
+    def _decode(self, i: int) -> dict:
+        expiry, reminded, expired, note_off, note_len = RECORD.unpack_from(self._mm, self._records + RECORD.size * i)
+        start = self._notes + note_off
+        record = {'expiry': iso_seconds(expiry), 'note': self._mm[start:start + note_len].decode('utf-8')}
+        if reminded != NONE:
+            record['reminded_for'] = iso_seconds(reminded)
+        if expired != NONE:
+            record['expired_for'] = iso_seconds(expired)
+        return record
+
+    def __contains__(self, uid):
+        return self._find(uid) >= 0
+
+    def get(self, uid):
+        i = self._find(uid)
+        return self._decode(i) if i >= 0 else None
+
+    def expiry_seconds(self, uid):
+        """Expiry of ``uid`` in epoch seconds; None if it has none, _MISSING if there's no such uid"""
+        i = self._find(uid)
+        if i < 0:
+            return _MISSING
+        expiry = self._fields[4 * i]
+        return None if expiry == NONE else expiry
+
+    def columns(self) -> tuple:
+        """(uids, expiry, reminded_for, expired_for): int64 views over the mapping, NONE for no value"""
+        if self._mm is None:
+            return array('q'), array('q'), array('q'), array('q')
+        return (self._uids,) + tuple(self._fields[k::4] for k in range(len(FIELDS)))
+
+    def items(self):
+        for i in range(self._count):
+            yield str(self._uids[i]), self._decode(i)
+
+
+def write_snapshot(path: str, items, fsync: bool = True) -> int:
+    """Write (uid, record) pairs as a snapshot (temp file + os.replace); returns the count"""
+    rows = sorted((_int_uid(uid), record) for uid, record in items)
+    uids = array('q', (uid for uid, _ in rows))
+    records = bytearray(RECORD.size * len(rows))
+    notes = bytearray()
+    note_at = {}
+    for i, (uid, record) in enumerate(rows):
+        if i and uids[i - 1] == uid:
+            raise ValueError('duplicate uid %d' % uid)
+        _check_record(uid, record)
+        note = (record.get('note') or '').encode('utf-8')
+        if note not in note_at:
+            note_at[note] = len(notes)
+            notes += note
+        RECORD.pack_into(records, RECORD.size * i, *(_seconds(record.get(f)) for f in FIELDS),
+                         note_at[note], len(note))
+    directory = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(prefix='.subs-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(rows), len(notes)))
+            f.write(uids.tobytes())
+            f.write(records)
+            f.write(notes)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    if fsync:
+        JournalStore._fsync_dir(directory)
+    return len(rows)
+
+
+def import_json(json_path: str, bin_path: str) -> int:
+    """Convert a JSON store to a binary snapshot. The source is loaded as a
+    journal, so records still in ``<json_path>.log`` (SUBS_STORAGE=journal
+    or shared, not compacted yet) come along with the snapshot's."""
+    source = JournalStore(json_path).load()
+    try:
+        items = source.items()
+        if not items and source.truncated_bytes and not source.replayed:
+            raise ValueError('%s.log has no readable records; refusing to convert it to an empty store' % json_path)
+        return write_snapshot(bin_path, items)
+    finally:
+        source.close()
+
+
+def export_json(bin_path: str, json_path: str) -> int:
+    snap = BinarySnapshot(bin_path)
+    data = dict(snap.items())
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    return len(data)
+
+
+class BinaryJournalStore(JournalStore):
+    """JournalStore whose snapshot is a memory-mapped BinarySnapshot.
+
+    Only records changed since the last compaction live in memory: ``_data``
+    is an overlay over the snapshot (None marks a deletion), rebuilt at
+    startup from the log alone. Compaction merges the overlay into a new
+    snapshot file and swaps the mapping.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(path, **kwargs)
+        self._snap = BinarySnapshot()
+        self._count = 0
+
+    # -------------- replay --------------
+    def _apply(self, data: dict, rec: dict):
+        op = rec.get('op')
+        if op == 'put':
+            data[rec['uid']] = rec['v']
+        elif op == 'del':
+            data[rec['uid']] = None
+        else:
+            raise ValueError('unknown journal op %r' % (op,))
+
+    def _load_data(self) -> dict:
+        self._snap = BinarySnapshot(self.path)
+        data = {}
+        self._had_old_log = os.path.exists(self.old_log_path)
+        self.replayed = self._replay(self.old_log_path, data) + self._replay(self.log_path, data)
+        return data
+
+    def load(self):
+        data = self._load_data()
+        with self.lock:
+            self._data = data
+            self._count = len(self._snap) + sum(
+                (v is not None) - (uid in self._snap) for uid, v in data.items())
+            self._open_log()
+            if self._had_old_log:
+                # A previous compaction died after rotating; finish it now
+                self._rewrite(dict(self._data))
+                os.unlink(self.old_log_path)
+        atexit.register(self.close)
+        return self
+
+    # -------------- reads --------------
+    def get(self, uid: str):
+        v = self._data.get(uid, _MISSING)
+        return self._snap.get(uid) if v is _MISSING else v
+
+    def items(self) -> list:
+        with self.lock:
+            overlay, snap = dict(self._data), self._snap
+        out = [(uid, v) for uid, v in snap.items() if uid not in overlay]
+        out.extend((uid, v) for uid, v in overlay.items() if v is not None)
+        return out
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, uid):
+        v = self._data.get(uid, _MISSING)
+        return uid in self._snap if v is _MISSING else v is not None
+
+    def expiry_seconds(self, uid: str):
+        """Expiry of ``uid`` in epoch seconds, None if it has none (or no record)"""
+        v = self._data.get(uid, _MISSING)
+        if v is _MISSING:
+            v = self._snap.expiry_seconds(uid)
+            return None if v is _MISSING else v
+        if v is None or not v.get('expiry'):
+            return None  # overlay: only records changed since the last compaction
+        expiry = _seconds(v['expiry'])
+        return None if expiry == NONE else expiry
+
+    def subscribe(self, fn, replay: bool = True, columns=None):
+        """As JournalStore.subscribe; with ``columns``, the replay calls
+        ``columns(*snapshot.columns())`` once for the snapshot, then ``fn``
+        only for the overlay, as a change from the snapshot's record"""
+        with self.lock:
+            self._listeners.append(fn)
+            if not replay:
+                return
+            if columns is None:
+                for uid, record in self.items():
+                    fn(uid, None, record)
+                return
+            columns(*self._snap.columns())
+            for uid, v in self._data.items():
+                old = self._snap.get(uid)
+                if old is not None or v is not None:
+                    fn(uid, old, v)
+
+    # -------------- writes --------------
+    def put(self, uid: str, record: dict):
+        # Checked before journaling: compaction could never write it out
+        _int_uid(uid)
+        _check_record(uid, record)
+        with self.lock:
+            old = self.get(uid)
+            self._append({'op': 'put', 'uid': uid, 'v': record})
+            self._data[uid] = record
+            self._count += old is None
+            self._notify(uid, old, record)
+            self._changed()
+
+    def remove(self, uid: str) -> bool:
+        with self.lock:
+            old = self.get(uid)
+            if old is None:
+                return False
+            self._append({'op': 'del', 'uid': uid})
+            self._data[uid] = None
+            self._count -= 1
+            self._notify(uid, old, None)
+            self._changed()
+            return True
+
+    # -------------- compaction --------------
+    def _rewrite(self, overlay: dict):
+        """Write snapshot + overlay as the new snapshot, then drop what it now covers"""
+        snap = self._snap
+        merged = [(uid, v) for uid, v in snap.items() if uid not in overlay]
+        merged.extend((uid, v) for uid, v in overlay.items() if v is not None)
+        write_snapshot(self.path, merged, fsync=self.fsync == 'always')
+        fresh = BinarySnapshot(self.path)
+        with self.lock:
+            # Readers holding the old mapping keep it alive until they're done
+            self._snap = fresh
+            for uid, v in overlay.items():
+                if self._data.get(uid, _MISSING) is v:
+                    del self._data[uid]
+
+    def compact(self):
+        """Fold the log and the overlay into a fresh binary snapshot"""
+        with self._flush_lock:
+            with self.lock:
+                os.close(self._fd)
+                os.replace(self.log_path, self.old_log_path)
+                self._open_log()
+                overlay = dict(self._data)
+            self._rewrite(overlay)
+            os.unlink(self.old_log_path)
+            if self.fsync == 'always':
+                self._fsync_dir(os.path.dirname(self.path) or '.')
+            self.compactions += 1
+            self.flushes += 1
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out.update({
+            'mode': 'binary',
+            'records': self._count,
+            'snapshot_records': len(self._snap),
+            'overlay': len(self._data),
+        })
+        return out
+
+
+# -------------- comparison --------------
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def compare(json_path: str, bin_path: str, lookups: int = 10000):
+    """Print sizes, startup, scan and lookup times of the two formats.
+
+    Startup is what init_storage runs: the store's load() plus the expiry
+    heap and column indexes fed by subscribe() (from the columns, for the
+    binary store). The binary store is loaded from a copy, since load()
+    creates its log next to the snapshot.
+    """
+    from store import SubscriptionStore
+    from sweeper import ExpiryHeap
+    from analytics import ExpiryColumns
+
+    def start_json():
+        store = SubscriptionStore(json_path).load()
+        heap, columns = ExpiryHeap(3, 3), ExpiryColumns()
+        store.subscribe(heap.on_change)
+        store.subscribe(columns.on_change)
+        return store
+
+    workdir = tempfile.mkdtemp(prefix='abakus-compare-')
+    copy = os.path.join(workdir, os.path.basename(bin_path))
+    with open(bin_path, 'rb') as src, open(copy, 'wb') as dst:
+        dst.write(src.read())
+
+    def start_binary():
+        store = BinaryJournalStore(copy, fsync='never').load()
+        heap, columns = ExpiryHeap(3, 3), ExpiryColumns()
+        store.subscribe(heap.on_change, columns=heap.load_columns)
+        store.subscribe(columns.on_change, columns=columns.load_columns)
+        return store
+
+    try:
+        json_store, json_start = _timed(start_json)
+        bin_store, bin_start = _timed(start_binary)
+        uids = random.Random(1).choices([uid for uid, _ in json_store.items()], k=lookups) if len(json_store) else []
+
+        def record_get(get):
+            for uid in uids:
+                get(uid)
+
+        def status_json():
+            # file_status: the record, then its expiry parsed
+            for uid in uids:
+                v = json_store.get(uid)
+                if v and v.get('expiry'):
+                    datetime.fromisoformat(v['expiry'])
+
+        def status_binary():
+            for uid in uids:
+                bin_store.expiry_seconds(uid)
+
+        def scan(records):
+            return [datetime.fromisoformat(v['expiry']) for _, v in records if v.get('expiry')]
+
+        _, json_scan = _timed(lambda: scan(json_store.items()))
+        _, bin_scan = _timed(lambda: scan(bin_store.items()))
+        _, json_get = _timed(lambda: record_get(json_store.get))
+        _, bin_get = _timed(lambda: record_get(bin_store.get))
+        _, json_status = _timed(status_json)
+        _, bin_status = _timed(status_binary)
+        records = (len(json_store), len(bin_store))
+        bin_store.close()
+    finally:
+        for name in os.listdir(workdir):
+            os.unlink(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    n = max(len(uids), 1)
+    rows = [
+        ('startup (load + indexes)', json_start * 1000, bin_start * 1000, 'ms'),
+        ('full scan (parse expiry)', json_scan * 1000, bin_scan * 1000, 'ms'),
+        ('record get', json_get / n * 1e6, bin_get / n * 1e6, 'us'),
+        ('status lookup', json_status / n * 1e6, bin_status / n * 1e6, 'us'),
+    ]
+    print('%-26s %14s %14s %8s' % ('', 'json', 'binary', 'bin/json'))
+    print('%-26s %14d %14d' % ('records', records[0], records[1]))
+    print('%-26s %12.1f MB %12.1f MB' % ('file size', os.path.getsize(json_path) / 2 ** 20,
+                                         os.path.getsize(bin_path) / 2 ** 20))
+    for label, json_value, bin_value, unit in rows:
+        print('%-26s %11.2f %s %11.2f %s %7.2fx' % (label, json_value, unit, bin_value, unit,
+                                                     bin_value / json_value if json_value else 0.0))
+    slower = [label for label, json_value, bin_value, _ in rows if bin_value > json_value * 1.2]
+    if slower:
+        print('binary is slower for: %s' % ', '.join(slower))
+
+
+if __name__ == "__main__":
+    commands = {'import': import_json, 'export': export_json, 'compare': compare}
+    if len(sys.argv) != 4 or sys.argv[1] not in commands:
+        sys.exit(__doc__)
+    result = commands[sys.argv[1]](sys.argv[2], sys.argv[3])
+    if result is not None:
+        print('%d records' % result)
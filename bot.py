@@ -1,11 +1,24 @@
 import asyncio
 import logging
 import sys
+import time
+from datetime import datetime, timezone
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from config import BOT_TOKEN, ADMIN_ID, CARD_NUMBER, CARD_NAME, BASE_URL
+from aiogram.methods import SendMessage, SendPhoto, SendMediaGroup
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from config import BOT_TOKEN, ADMIN_ID, BASE_URL, TELEGRAM_API_BASE
+from config import UPDATE_SEEN_MAX
+from config import SEND_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_CONCURRENCY, SEND_MAX_RETRIES, SEND_QUEUE_MAX
+from config import WEB_CONCURRENCY
+from sender import Sender, BULK
+from prefilter import Prefilter
+from metrics import Counter, Histogram
+import profiling
+import keyboards
 
 # Configure logging
 logging.basicConfig(
@@ -16,84 +29,167 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize bot and dispatcher with lower timeout
-bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.MARKDOWN, timeout=10)
+# (the timeout belongs to the session: aiogram 3's Bot takes no timeout argument)
+if TELEGRAM_API_BASE:
+    api_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE), timeout=10)
+else:
+    api_session = AiohttpSession(timeout=10)
+bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.MARKDOWN, session=api_session)
 dp = Dispatcher()
+TG_API_SECONDS = Histogram('tg_api_request_duration_seconds', 'Telegram Bot API call latency', ('method',))
+TG_API_ERRORS = Counter('tg_api_errors_total', 'Failed Telegram Bot API calls', ('method', 'error'))
+TG_UPDATE_SECONDS = Histogram('tg_update_duration_seconds', 'Dispatcher time per update', ('type',))
+TG_UPDATE_ERRORS = Counter('tg_update_errors_total', 'Updates whose handler raised', ('type',))
+
+
+class ApiMetrics(BaseRequestMiddleware):
+    """Times every Bot API call made through bot (handlers, sender, webhook setup)"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TG_API_ERRORS.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            TG_API_SECONDS.labels(name).observe(elapsed)
+            profiling.record('telegram.' + name, elapsed)
+
+
+bot.session.middleware(ApiMetrics())
+
+
+@dp.update.outer_middleware()
+async def update_metrics(handler, event: types.Update, data: dict):
+    kind = event.event_type
+    started = time.perf_counter()
+    # Its own trace: the update is handled after the webhook request has been answered
+    tracer = data.get('tracer')
+    trace = tracer.begin('update ' + kind) if tracer is not None else None
+    try:
+        return await handler(event, data)
+    except Exception:
+        TG_UPDATE_ERRORS.labels(kind).inc()
+        raise
+    finally:
+        TG_UPDATE_SECONDS.labels(kind).observe(time.perf_counter() - started)
+        if trace is not None:
+            tracer.finish(trace)
+
+# Outgoing notifications go through the rate-limited sender, off the update path
+# Every worker process has its own sender: split the global budget between them
+sender = Sender(bot, rate=SEND_RATE / WEB_CONCURRENCY, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                concurrency=SEND_CONCURRENCY, max_retries=SEND_MAX_RETRIES, maxsize=SEND_QUEUE_MAX)
 
 
 @dp.message(CommandStart())
 async def start_cmd(message: types.Message):
     """Start command handler"""
     try:
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📅 Obuna bo'lish", callback_data="subscribe")]
-        ])
-        await message.answer(
-            "Assalomu alaykum!\nObuna bo'lish uchun tugmani bosing 👇", 
-            reply_markup=kb
-        )
+        await message.answer(keyboards.START.text, reply_markup=keyboards.START.kb)
     except Exception as e:
         logger.error(f"Start handler error: {e}", exc_info=True)
 
 
 @dp.callback_query(F.data == "subscribe")
 async def show_subscription_options(callback: types.CallbackQuery):
-    buttons = []
-    for m in [1, 2, 3, 6, 9, 12]:
-        buttons.append(InlineKeyboardButton(text=f"{m} oy", callback_data=f"month_{m}"))
-
-    kb = InlineKeyboardMarkup(inline_keyboard=[buttons[i:i+3] for i in range(0, len(buttons), 3)])
     await callback.answer()
-    await callback.message.edit_text("Nechi oylik obuna olmoqchisiz?", reply_markup=kb)
+    await callback.message.edit_text(keyboards.PLAN_MENU.text, reply_markup=keyboards.PLAN_MENU.kb)
 
 @dp.callback_query(F.data.startswith("month_"))
-async def show_price(callback: types.CallbackQuery):
-    months = int(callback.data.split("_")[1])
-    price = months * 36000
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅ Orqaga", callback_data="subscribe")],
-        [InlineKeyboardButton(text="📋 Karta raqamini nusxalash", callback_data="copy_card")],
-        [InlineKeyboardButton(text="📤 To‘lov chekini yuborish", callback_data="send_receipt")]
-    ])
+async def show_price(callback: types.CallbackQuery, payments):
+    screen = keyboards.PRICES.get(callback.data)
+    if screen is None:
+        # Eski menyudagi, konfiguratsiyadan olib tashlangan tarif
+        await callback.answer(keyboards.UNKNOWN_PLAN, show_alert=True)
+        return
+    # The receipt comes later, as a photo: remember which plan it pays for
+    payments.choose(callback.from_user.id, int(callback.data.removeprefix("month_")))
     await callback.answer()
-    await callback.message.edit_text(
-        f"📅 {months} oylik obuna narxi: {price:,} so‘m\n\n"
-        f"Karta: `{CARD_NUMBER}`\nEgasi: {CARD_NAME}",
-        parse_mode=ParseMode.MARKDOWN,
-        reply_markup=kb
-    )
+    await callback.message.edit_text(screen.text, parse_mode=ParseMode.MARKDOWN, reply_markup=screen.kb)
 
 @dp.callback_query(F.data == "copy_card")
 async def copy_card(callback: types.CallbackQuery):
     # Karta raqami va "To'lov chekini yuborish" tugmasi birga chiqadi
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📤 To‘lov chekini yuborish", callback_data="send_receipt")]
-    ])
-    await callback.message.answer(f"💳 Karta raqami: `{CARD_NUMBER}`\n\nEndi to'lov chekini yuboring.", parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
-    await callback.answer("Karta raqamini xabardan oson nusxalashingiz mumkin", show_alert=True)
+    screen = keyboards.COPY_CARD
+    await callback.message.answer(screen.text, parse_mode=ParseMode.MARKDOWN, reply_markup=screen.kb)
+    await callback.answer(keyboards.COPY_CARD_ALERT, show_alert=True)
 
 @dp.callback_query(F.data == "send_receipt")
 async def ask_receipt(callback: types.CallbackQuery):
     await callback.answer()
-    await callback.message.answer("📤 To‘lov chekingizni shu yerga rasm sifatida yuboring")
+    await callback.message.answer(keyboards.ASK_RECEIPT.text)
 
 @dp.message(F.photo)
-async def receive_receipt(message: types.Message):
-    caption = f"💳 Yangi to‘lov!\n👤 {message.from_user.full_name}"
-    await bot.send_photo(ADMIN_ID, message.photo[-1].file_id, caption=caption)
-    # Foydalanuvchi ID raqamini admin uchun alohida xabar sifatida yuborish
-    await bot.send_message(ADMIN_ID, f"🆔 Foydalanuvchi ID: `{message.from_user.id}`", parse_mode=ParseMode.MARKDOWN)
+async def receive_receipt(message: types.Message, payments):
+    # Chek navbatga yoziladi; admin ularni jamlangan holda oladi (send_digest)
+    photo = message.photo[-1]
+    payments.submit(message.from_user.id, message.from_user.full_name, photo.file_id, photo.file_unique_id)
     # Foydalanuvchiga "Yana to'lov qilish" tugmasi
-    user_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔄 Yana to‘lov qilish", callback_data="subscribe")]
-    ])
-    await message.answer("✅ Chekingiz adminga yuborildi.", reply_markup=user_kb)
+    await message.answer(keyboards.RECEIPT_SENT.text, reply_markup=keyboards.RECEIPT_SENT.kb)
+
+
+def markdown_escape(text: str) -> str:
+    """User text (e.g. a Telegram name) safe inside a Markdown (legacy) message"""
+    for ch in ('_', '*', '`', '['):
+        text = text.replace(ch, '\\' + ch)
+    return text
+
+
+async def send_digest(receipts: list):
+    """Pending receipts to the admin, up to 10 photos per album"""
+    for i in range(0, len(receipts), 10):
+        media = [
+            types.InputMediaPhoto(
+                media=r['file_id'], parse_mode=ParseMode.MARKDOWN,
+                caption=keyboards.RECEIPT_CAPTION.format(
+                    id=r['id'], name=markdown_escape(r.get('name') or ''), uid=r['uid'],
+                    plan='%d oy' % r['months'] if r.get('months') else keyboards.RECEIPT_NO_PLAN))
+            for r in receipts[i:i + 10]
+        ]
+        if len(media) == 1:
+            # An album needs at least two items
+            await sender.send(SendPhoto(chat_id=ADMIN_ID, photo=media[0].media, caption=media[0].caption,
+                                        parse_mode=ParseMode.MARKDOWN))
+        else:
+            await sender.send(SendMediaGroup(chat_id=ADMIN_ID, media=media))
+
+async def notify_expiry(uid: str, stage: str, expiry: str):
+    """Reminder before / notice after a subscription ends (sent by sweeper.Sweeper)"""
+    if stage == 'remind':
+        end = datetime.fromisoformat(expiry)
+        now = datetime.now(timezone.utc) if end.tzinfo else datetime.utcnow()
+        days = max(1, (end - now).days + 1)
+        text = keyboards.REMIND_TEXT.format(days=days)
+    else:
+        text = keyboards.EXPIRED.text
+    await sender.send(SendMessage(chat_id=int(uid), text=text, reply_markup=keyboards.EXTEND_KB), BULK)
+
+
+async def broadcast(uids: list, text: str) -> dict:
+    """Queue ``text`` to every uid as one tracked broadcast; returns its progress"""
+    return sender.broadcast([SendMessage(chat_id=int(uid), text=text)
+                             for uid in uids if str(uid).lstrip('-').isdigit()])
+
+# What the handlers above react to. Webhook bodies matching none of it are
+# dropped by the prefilter before an Update is even built: keep it in sync.
+prefilter = Prefilter(
+    commands=('start',),
+    callbacks=('subscribe', 'copy_card', 'send_receipt'),
+    callback_prefixes=('month_',),
+    message_fields=('photo',),
+    seen_max=UPDATE_SEEN_MAX,
+)
 
 async def setup_webhook():
     """Setup webhook with error handling"""
     try:
         webhook_url = f"{BASE_URL}/tg/webhook"
         await bot.delete_webhook(drop_pending_updates=True)
-        await bot.set_webhook(url=webhook_url)
+        await bot.set_webhook(url=webhook_url, allowed_updates=prefilter.allowed_updates)
         logger.info(f"Webhook set successfully: {webhook_url}")
         return True
     except Exception as e:
@@ -0,0 +1,81 @@
+OPS = ('set', 'add', 'reset', 'note', 'delete')
+
+
+def parse_items(payload, max_items: int) -> list:
+    """Normalize a /api/subscriptions/bulk payload.
+
+    Returns a list of dicts {idx, uid, op, days, note, error}; items that fail
+    validation keep their ``error`` and are reported back without being applied.
+    Raises ValueError if the payload as a whole is unusable.
+    """
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        raise ValueError("items ro‘yxati bo‘sh yoki noto‘g‘ri")
+    if len(items) > max_items:
+        raise ValueError('Bir so‘rovda ko‘pi bilan %d ta element' % max_items)
+    out = []
+    for idx, raw in enumerate(items):
+        item = {'idx': idx, 'uid': None, 'op': None, 'days': None, 'note': None, 'error': None}
+        out.append(item)
+        if not isinstance(raw, dict):
+            item['error'] = "Element obyekt bo‘lishi kerak"
+            continue
+        uid = raw.get('uid')
+        item['uid'] = str(uid) if uid not in (None, '') else None
+        item['op'] = raw.get('op', 'set')
+        item['note'] = raw.get('note')
+        if item['uid'] is None:
+            item['error'] = "UID kiritilmadi"
+        elif item['op'] not in OPS:
+            item['error'] = 'op: ' + ', '.join(OPS)
+        elif item['op'] in ('set', 'add'):
+            try:
+                item['days'] = int(raw.get('days', 0))
+            except (TypeError, ValueError):
+                item['days'] = 0
+            if item['days'] < 1:
+                item['error'] = "Kun to‘g‘ri kiritilsin"
+        elif item['op'] == 'note' and item['note'] is None:
+            item['note'] = ''
+    return out
+
+
+def waves(items: list) -> list:
+    """Split valid items into consecutive groups where every uid appears at most once.
+
+    Set-based statements apply a group at once, so repeated uids (e.g. set
+    then add for the same user) must land in later groups to keep item order.
+    """
+    groups = []
+    current, seen = [], set()
+    for item in items:
+        if item['error'] is not None:
+            continue
+        if item['uid'] in seen:
+            groups.append(current)
+            current, seen = [], set()
+        current.append(item)
+        seen.add(item['uid'])
+    if current:
+        groups.append(current)
+    return groups
+
+
+def result(item: dict, expiry=None, error: str = None) -> dict:
+    out = {'uid': item['uid'], 'op': item['op'], 'ok': error is None}
+    if error is None:
+        out['expiry'] = expiry
+    else:
+        out['error'] = error
+    return out
+
+
+def summary(results: list, elapsed: float) -> dict:
+    ok = sum(1 for r in results if r['ok'])
+    return {
+        'results': results,
+        'ok': ok,
+        'failed': len(results) - ok,
+        'elapsed_ms': round(elapsed * 1000, 3),
+        'items_per_sec': round(len(results) / elapsed, 1) if elapsed > 0 else None,
+    }
@@ -0,0 +1,95 @@
+"""Change feed for the JSON store: which uids changed or went away since a version.
+
+A version is a point in time in microseconds since the epoch, bumped so
+that a process never hands out the same one twice. Being clock based
+rather than a plain counter, a version means the same thing in every
+worker process sharing a journal and lines up with Postgres' updated_at,
+so a client may carry it from one worker (or backend) to the next.
+
+A read takes its version with ``token()`` *before* catching up with the
+store: anything written after that point is stamped later by whichever
+process applies it, so the next read starting from that version can
+repeat a change but never miss one.
+"""
+import time
+from threading import Lock
+from collections import OrderedDict
+
+
+def clock() -> int:
+    return time.time_ns() // 1000
+
+
+class ChangeFeed:
+    """Last change version per uid, oldest first, fed through ``SubscriptionStore.subscribe``.
+
+    At most ``max_entries`` uids are remembered; dropping older ones raises
+    ``floor``, and a reader asking for changes from before the floor (or
+    from before this process started) has to reload everything.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._versions = OrderedDict()  # uid -> version of its last change
+        self._deleted = set()
+        self._last = 0
+        self._lock = Lock()
+        self.floor = clock()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._versions)
+
+    def token(self) -> int:
+        """Version a reader continues from next time; take it before reading"""
+        # Changes stamped after this compare greater (see _stamp)
+        return max(self._last, clock() - 1)
+
+    def _stamp(self) -> int:
+        self._last = max(self._last + 1, clock())
+        return self._last
+
+    def on_change(self, uid: str, old, new):
+        if (old is not None and new is not None and old.get('expiry') == new.get('expiry')
+                and old.get('note') == new.get('note')):
+            return  # sweeper marks: nothing the admin page shows
+        with self._lock:
+            self._versions.pop(uid, None)
+            self._versions[uid] = self._stamp()
+            if new is None:
+                self._deleted.add(uid)
+            else:
+                self._deleted.discard(uid)
+            while len(self._versions) > self.max_entries:
+                gone, version = self._versions.popitem(last=False)
+                self._deleted.discard(gone)
+                self.floor = version
+                self.dropped += 1
+
+    def latest(self) -> int:
+        """Version of the newest change this process knows of (an ETag for the full list)"""
+        return max(self._last, self.floor)
+
+    def since(self, version: int, limit: int):
+        """(changed uids, deleted uids) after ``version``, oldest first; None when
+        the feed can't tell (too old, or more than ``limit`` changes)"""
+        with self._lock:
+            if version < self.floor:
+                return None
+            changed, deleted = [], []
+            for uid in reversed(self._versions):
+                if self._versions[uid] <= version:
+                    break
+                if len(changed) + len(deleted) >= limit:
+                    return None
+                (deleted if uid in self._deleted else changed).append(uid)
+        return changed[::-1], deleted[::-1]
+
+    def stats(self) -> dict:
+        return {
+            'tracked': len(self._versions),
+            'deleted': len(self._deleted),
+            'floor': self.floor,
+            'latest': self.latest(),
+            'dropped': self.dropped,
+        }
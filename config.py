@@ -13,11 +13,104 @@ except ValueError:
 CARD_NUMBER = os.getenv("CARD_NUMBER") or "4067070006008515"
 CARD_NAME = os.getenv("CARD_NAME") or "SHOXRUX XOJIBAYEV"
 
+# Subscription plans as "months:price" pairs (so‘m), in menu order
+_plans = os.getenv("PLANS") or "1:36000,2:72000,3:108000,6:216000,9:324000,12:432000"
+PLANS = {}
+for _item in _plans.split(','):
+    _months, _, _price = _item.strip().partition(':')
+    if _months.isdigit() and _price.isdigit():
+        PLANS[int(_months)] = int(_price)
+
+# Bot API server; set to a local stub (bench/fake_telegram.py) for load tests
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE")
+
 # Flask / Web configuration
 FLASK_SECRET = os.getenv("FLASK_SECRET", "change-me")
+
+# Signed API tokens (tokens.py), issued by /auth after the Telegram Login Widget check
+API_AUTH = os.getenv("API_AUTH", "1") == "1"  # 0: /api routes need no token (local development only)
+# Required with API_AUTH (never the "change-me" default); changing it signs everyone out
+TOKEN_SECRET = os.getenv("TOKEN_SECRET") or os.getenv("FLASK_SECRET")
+ADMIN_TOKEN_TTL = int(os.getenv("ADMIN_TOKEN_TTL", str(12 * 3600)))  # seconds
+SUBSCRIBER_TOKEN_TTL = int(os.getenv("SUBSCRIBER_TOKEN_TTL", str(30 * 86400)))  # seconds
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))  # recently verified tokens kept per process
+LOGIN_MAX_AGE = int(os.getenv("LOGIN_MAX_AGE", "86400"))  # seconds a Login Widget auth_date stays valid
 # This should be your public bot server URL provided by render.com
 BASE_URL = os.getenv("BASE_URL")  # Must be set in environment variables
 
 # Fallback for local development
 if not BASE_URL:
     BASE_URL = "https://abakusuz.onrender.com"  # Change this to your actual Render.com URL
+
+# Postgres connection pool (used when DATABASE_URL is set)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))  # connections each worker opens at startup (the db_pool step)
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))  # ping connections idle longer than this
+
+# JSON fallback storage (used when DATABASE_URL is not set)
+SUBS_PATH = os.getenv("SUBS_PATH")  # defaults to subscriptions.json next to server.py
+SUBS_FLUSH_DELAY = float(os.getenv("SUBS_FLUSH_DELAY", "0.05"))  # seconds to coalesce writes before a flush
+SUBS_FSYNC = os.getenv("SUBS_FSYNC", "always")  # always | never
+SUBS_STORAGE = os.getenv("SUBS_STORAGE", "memory")  # memory (full rewrites) | journal (append-only log + snapshots) | shared (journal shared by several processes) | binary (journal over a memory-mapped binstore snapshot)
+SUBS_LOG_MAX_BYTES = int(os.getenv("SUBS_LOG_MAX_BYTES", str(1 << 20)))  # compact the journal past this size
+
+# Web server processes (gunicorn.conf.py reads these too)
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))  # worker processes
+WEB_THREADS = int(os.getenv("WEB_THREADS", "4"))  # threads per gthread worker
+
+# Read-through cache in front of /api/subscription/status
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "60"))  # seconds; bounds how stale days_left can get
+STATUS_CACHE_MAX = int(os.getenv("STATUS_CACHE_MAX", "10000"))  # 0 disables the cache
+
+# Telegram update processing (webhook -> background event loop)
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))  # concurrent dp.feed_update tasks
+UPDATE_QUEUE_FULL = os.getenv("UPDATE_QUEUE_FULL", "reject")  # reject (503, Telegram retries) | drop
+UPDATE_SEEN_MAX = int(os.getenv("UPDATE_SEEN_MAX", "10000"))  # update_ids remembered to drop redeliveries
+
+# getUpdates long polling instead of the webhook (polling.py, the Procfile "worker")
+TG_UPDATES = os.getenv("TG_UPDATES", "webhook")  # webhook | polling (web processes then never register the webhook)
+POLL_STATE = os.getenv("POLL_STATE")  # offset + unfinished updates; defaults to polling.json next to the subscriptions file
+POLL_LIMIT = int(os.getenv("POLL_LIMIT", "100"))  # updates per getUpdates call (Telegram allows 1-100)
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "25"))  # seconds Telegram holds an empty getUpdates
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", "32"))  # updates handled at once, one per chat at a time
+POLL_MAX_PENDING = int(os.getenv("POLL_MAX_PENDING", "1000"))  # stop fetching while this many are unfinished
+
+# /api/subscriptions/bulk
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+
+# Response layer (responses.py): static pages and JSON compression
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))  # seconds browsers reuse admin.html/login.html before revalidating
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # JSON bodies smaller than this go out as is
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "5"))  # 1-9 (gzip scale) for per-request JSON compression
+
+# Request tracing and profiling (profiling.py)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))  # requests/updates slower than this are logged by phase; 0 turns tracing off
+SLOW_LOG_SIZE = int(os.getenv("SLOW_LOG_SIZE", "200"))  # slow requests kept for /api/profile/slow
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))  # longest /api/profile sampling run
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))  # default sampling interval
+
+# /api/subscriptions/changes (admin page delta sync)
+CHANGES_LIMIT = int(os.getenv("CHANGES_LIMIT", "5000"))  # more changes than this: the client reloads the list
+CHANGES_FEED_SIZE = int(os.getenv("CHANGES_FEED_SIZE", "100000"))  # changed uids each JSON-store process remembers
+CHANGES_RETENTION_DAYS = int(os.getenv("CHANGES_RETENTION_DAYS", "7"))  # Postgres tombstones kept this long
+
+# Expiry sweeper: reminder before and notice after a subscription ends
+SWEEP_ENABLED = os.getenv("SWEEP_ENABLED", "1") == "1"
+SWEEP_INTERVAL = float(os.getenv("SWEEP_INTERVAL", "60"))  # seconds between sweeps
+SWEEP_BATCH = int(os.getenv("SWEEP_BATCH", "500"))  # notices claimed per round trip
+REMIND_DAYS = int(os.getenv("REMIND_DAYS", "3"))  # remind this many days before expiry
+SWEEP_LOOKBACK_DAYS = int(os.getenv("SWEEP_LOOKBACK_DAYS", "3"))  # don't notify expiries older than this
+
+# Payment receipts (payments.PaymentIntake)
+PAYMENT_DIGEST_INTERVAL = float(os.getenv("PAYMENT_DIGEST_INTERVAL", "60"))  # seconds between admin digests
+PAYMENT_BATCH = int(os.getenv("PAYMENT_BATCH", "50"))  # receipts per storage write / per digest round
+
+# Outbound Telegram sender (sender.Sender): Bot API allows ~30 msg/s overall and ~1 msg/s per chat
+SEND_RATE = float(os.getenv("SEND_RATE", "25"))  # messages per second, all chats together
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))  # messages per second to one chat
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))  # short bursts allowed per chat
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))  # requests in flight
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))  # network/5xx retries (429s always retry)
+SEND_QUEUE_MAX = int(os.getenv("SEND_QUEUE_MAX", "100000"))
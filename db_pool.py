@@ -0,0 +1,194 @@
+import os
+import time
+import logging
+from threading import Condition
+from contextlib import contextmanager
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no connection becomes free within the acquire timeout"""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of long-lived psycopg2 connections.
+
+    Connections are validated on checkout (closed sockets are dropped and an
+    idle connection is pinged before reuse), so a Postgres restart or an idle
+    disconnect on Neon/Supabase costs one reconnect instead of a failed request.
+    """
+
+    def __init__(self, dsn: str, minconn: int = 1, maxconn: int = 8,
+                 timeout: float = 10.0, check_idle: float = 30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('Pool sizes noto‘g‘ri: min=%s max=%s' % (minconn, maxconn))
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._cond = Condition()
+        self._idle = []  # [(conn, returned_at)]
+        self._in_use = 0
+        self._pid = os.getpid()
+        # stats
+        self._acquired = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._created = 0
+
+    # -------------- internals --------------
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        self._created += 1
+        return conn
+
+    def _reset_after_fork(self):
+        # Sockets inherited from the parent (gunicorn --preload) must not be
+        # shared with it; forget them without closing and start over.
+        self._idle = []
+        self._in_use = 0
+        self._pid = os.getpid()
+
+    def _healthy(self, conn, idle_for: float) -> bool:
+        if conn.closed:
+            return False
+        if conn.status != psycopg2.extensions.STATUS_READY:
+            try:
+                conn.rollback()
+            except Exception:
+                return False
+        if idle_for < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # -------------- public API --------------
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset_after_fork()
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        'DB ulanish kutish vaqti tugadi (%.1fs, max=%d)' % (self.timeout, self.maxconn))
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            item = self._idle.pop() if self._idle else None
+            wait = time.monotonic() - started
+            self._acquired += 1
+            if waited:
+                self._waits += 1
+            self._wait_total += wait
+            if wait > self._wait_max:
+                self._wait_max = wait
+
+        # Connect / ping outside the lock so a slow server doesn't stall other threads
+        try:
+            if item is not None:
+                conn, returned_at = item
+                if self._healthy(conn, time.monotonic() - returned_at):
+                    return conn
+                self._close(conn)
+                self._reconnects += 1
+                logger.warning('Stale DB connection dropped, reconnecting')
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, close: bool = False):
+        if not close and not conn.closed:
+            try:
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+            except Exception:
+                close = True
+        with self._cond:
+            if self._pid != os.getpid():
+                # Connection belongs to the pre-fork generation; just drop it
+                return
+            self._in_use -= 1
+            if close or conn.closed or len(self._idle) >= self.maxconn:
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commit on success, roll back on error"""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def warmup(self):
+        """Open minconn connections up front"""
+        conns = []
+        try:
+            for _ in range(self.minconn):
+                conns.append(self.getconn())
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'acquired': self._acquired,
+                'waited': self._waits,
+                'wait_avg_ms': round(self._wait_total / self._acquired * 1000, 3) if self._acquired else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+                'timeouts': self._timeouts,
+                'reconnects': self._reconnects,
+                'created': self._created,
+            }
@@ -0,0 +1,23 @@
+# gunicorn picks this file up from the working directory.
+# Worker processes each run their own update loop, sender and caches; they
+# share subscriptions through Postgres or the flock'ed journal (SUBS_STORAGE=shared).
+import os
+import sys
+
+from config import WEB_CONCURRENCY, WEB_THREADS, TG_UPDATES
+
+workers = WEB_CONCURRENCY
+threads = WEB_THREADS
+
+
+def post_worker_init(worker):
+    # Boot work (schema check, bot import, webhook) starts as soon as the
+    # worker is up, in the background; /_ready reports when it's done
+    import server
+    # Once per deploy, not per worker: each registration drops pending updates
+    # TG_UPDATES=polling: polling.py fetches the updates, a webhook would take them away
+    if os.environ.get('RENDER') and worker.age == 1 and TG_UPDATES == 'webhook':
+        server.startup.add('webhook', server.register_webhook)
+    if 'aioserver' not in sys.modules:
+        # aiohttp workers start it from on_startup, on their own loop
+        server.start_background()
@@ -0,0 +1,94 @@
+import os
+import select
+import logging
+from threading import Thread, Event
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+
+class PgListener:
+    """Background LISTEN on a Postgres channel, for cross-process cache invalidation.
+
+    Every worker process runs one listener thread on its own autocommit
+    connection and calls ``on_message(payload)`` for each NOTIFY. While the
+    connection is down notifications are lost, so after every (re)connect
+    ``on_reset()`` is called to drop whatever the caches may have missed.
+    """
+
+    def __init__(self, dsn: str, channel: str, on_message, on_reset=None,
+                 poll_interval: float = 5.0, max_backoff: float = 30.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.on_message = on_message
+        self.on_reset = on_reset
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self._stop = Event()
+        self._thread = None
+        self._pid = None
+        self.received = 0
+        self.reconnects = 0
+
+    def start(self):
+        """Start the listener thread (once per process: threads don't survive fork)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='pg-listen', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                # keepalives: an idle LISTEN socket would never notice a silent drop
+                conn = psycopg2.connect(self.dsn, keepalives=1, keepalives_idle=30,
+                                        keepalives_interval=10, keepalives_count=3)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute('LISTEN %s' % self.channel)
+                backoff = 1.0
+                if self.on_reset is not None:
+                    self.on_reset()
+                self._listen(conn)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                self.reconnects += 1
+                logger.warning('LISTEN %s failed: %s; retrying in %.0fs', self.channel, e, backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _listen(self, conn):
+        while not self._stop.is_set():
+            # poll() on timeout as well, so a dead socket surfaces as an error
+            select.select([conn], [], [], self.poll_interval)
+            conn.poll()
+            while conn.notifies:
+                note = conn.notifies.pop(0)
+                self.received += 1
+                try:
+                    self.on_message(note.payload)
+                except Exception as e:
+                    logger.error('Invalidation handler failed for %r: %s', note.payload, e)
+
+    def stats(self) -> dict:
+        return {
+            'channel': self.channel,
+            'running': self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+            'received': self.received,
+            'reconnects': self.reconnects,
+        }
@@ -0,0 +1,432 @@
+import os
+import json
+import fcntl
+import atexit
+import logging
+from contextlib import contextmanager
+from threading import Thread, RLock, get_ident
+
+from store import SubscriptionStore
+
+logger = logging.getLogger(__name__)
+
+
+class JournalStore(SubscriptionStore):
+    """Subscription store persisted as a snapshot plus an append-only log.
+
+    Every put/remove appends one compact JSON line to ``<path>.log`` instead
+    of rewriting the whole file, so write cost tracks the size of the change.
+    Records hold the full new value of a uid, which makes replay idempotent:
+    startup loads the snapshot (same layout as subscriptions.json) and
+    replays ``<path>.log.1`` (a rotated log whose compaction didn't finish)
+    and ``<path>.log`` on top. A torn last line left by a crash is cut off.
+
+    Once the log grows past ``max_log_bytes`` a background compaction rotates
+    it, writes a fresh snapshot and drops the rotated log.
+    """
+
+    def __init__(self, path: str, max_log_bytes: int = 1 << 20, fsync: str = 'always', **kwargs):
+        super().__init__(path, fsync=fsync, **kwargs)
+        self.log_path = path + '.log'
+        self.old_log_path = path + '.log.1'
+        self.max_log_bytes = max_log_bytes
+        self._fd = None
+        self._log_size = 0
+        self._compacting = False
+        self._had_old_log = False
+        self._batch = None  # encoded records held back by batch()
+        self.appends = 0
+        self.compactions = 0
+        self.replayed = 0
+        self.truncated_bytes = 0
+
+    # -------------- replay --------------
+    def _apply(self, data: dict, rec: dict):
+        op = rec.get('op')
+        if op == 'put':
+            data[rec['uid']] = rec['v']
+        elif op == 'del':
+            data.pop(rec['uid'], None)
+        else:
+            raise ValueError('unknown journal op %r' % (op,))
+
+    def _replay(self, path: str, data: dict) -> int:
+        """Apply every intact record of ``path``; cut the file at the first bad one"""
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return 0
+        good = 0
+        count = 0
+        while good < len(raw):
+            end = raw.find(b'\n', good)
+            if end == -1:
+                break  # torn tail: the last append never completed
+            try:
+                self._apply(data, json.loads(raw[good:end]))
+            except Exception:
+                break
+            good = end + 1
+            count += 1
+        if good < len(raw):
+            self.truncated_bytes += len(raw) - good
+            logger.warning('Journal %s: dropping %d bytes of torn/corrupt tail', path, len(raw) - good)
+            with open(path, 'r+b') as f:
+                f.truncate(good)
+                if self.fsync == 'always':
+                    os.fsync(f.fileno())
+        return count
+
+    def _load_data(self) -> dict:
+        data = self._read_file(self.path)
+        self._had_old_log = os.path.exists(self.old_log_path)
+        self.replayed = self._replay(self.old_log_path, data) + self._replay(self.log_path, data)
+        return data
+
+    def load(self):
+        super().load()
+        with self.lock:
+            self._open_log()
+            if self._had_old_log:
+                # A previous compaction died after rotating; finish it now
+                self._write_atomic(self.path, dict(self._data))
+                os.unlink(self.old_log_path)
+        return self
+
+    # -------------- appends --------------
+    def _open_log(self):
+        self._fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._log_size = os.fstat(self._fd).st_size
+
+    def _append(self, rec: dict):
+        line = (json.dumps(rec, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        self.appends += 1
+        if self._batch is not None:
+            self._batch.append(line)
+        else:
+            self._write(line)
+
+    def _write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            n = os.write(self._fd, view)
+            view = view[n:]
+        if self.fsync == 'always':
+            os.fsync(self._fd)
+        self._log_size += len(data)
+
+    @contextmanager
+    def batch(self):
+        """Hold ``lock`` across a run of mutations and append their records
+        with one write and one fsync when it ends. Until then they are
+        visible in memory but not yet durable."""
+        with self.lock:
+            if self._batch is not None:  # nested: the outermost batch writes
+                yield self
+                return
+            self._batch = []
+            try:
+                yield self
+            finally:
+                lines, self._batch = self._batch, None
+                if lines:
+                    self._write(b''.join(lines))
+                    self._maybe_compact()
+
+    def put(self, uid: str, record: dict):
+        with self.lock:
+            self._append({'op': 'put', 'uid': uid, 'v': record})
+            super().put(uid, record)
+
+    def remove(self, uid: str) -> bool:
+        with self.lock:
+            if uid not in self._data:
+                return False
+            self._append({'op': 'del', 'uid': uid})
+            return super().remove(uid)
+
+    def _changed(self):
+        self.writes += 1
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._log_size > self.max_log_bytes and not self._compacting:
+            self._compacting = True
+            Thread(target=self._compact_safely, name='subs-compact', daemon=True).start()
+
+    # -------------- compaction --------------
+    def _compact_safely(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error('Journal compaction failed: %s', e)
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """Fold the log into a fresh snapshot"""
+        with self._flush_lock:
+            with self.lock:
+                os.close(self._fd)
+                os.replace(self.log_path, self.old_log_path)
+                self._open_log()
+                data = dict(self._data)
+            # The rotated log stays on disk until the snapshot that covers it is durable
+            self._write_atomic(self.path, data)
+            os.unlink(self.old_log_path)
+            if self.fsync == 'always':
+                self._fsync_dir(os.path.dirname(self.path) or '.')
+            self.compactions += 1
+            self.flushes += 1
+
+    def flush(self):
+        with self.lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+
+    def close(self):
+        with self.lock:
+            self._closed = True
+            if self._fd is not None:
+                try:
+                    os.fsync(self._fd)
+                    os.close(self._fd)
+                except OSError:
+                    pass
+                self._fd = None
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out.update({
+            'mode': 'journal',
+            'log_bytes': self._log_size,
+            'appends': self.appends,
+            'compactions': self.compactions,
+            'replayed': self.replayed,
+            'truncated_bytes': self.truncated_bytes,
+        })
+        return out
+
+
+class _ProcessLock:
+    """Re-entrant lock that is exclusive across threads *and* processes.
+
+    The outermost acquire takes an exclusive flock on the store's lock file
+    and replays whatever other processes appended meanwhile, so code holding
+    the lock always works on (and extends) the latest state.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._rlock = RLock()
+        self._depth = 0
+        self._owner = None
+
+    def owned(self) -> bool:
+        return self._owner == get_ident()
+
+    def acquire(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self._store._lock_file(fcntl.LOCK_EX)
+                try:
+                    self._store._catch_up(exclusive=True)
+                except BaseException:
+                    fcntl.flock(self._store._lock_fd, fcntl.LOCK_UN)
+                    raise
+            except BaseException:
+                self._rlock.release()
+                raise
+            self._owner = get_ident()
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            fcntl.flock(self._store._lock_fd, fcntl.LOCK_UN)
+        self._rlock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SharedJournalStore(JournalStore):
+    """JournalStore that several processes (gunicorn workers) share safely.
+
+    Every process keeps its own in-memory copy. Writers hold an exclusive
+    flock on ``<path>.lock`` (``lock``), replay what other processes appended
+    to the log since they last looked, then append their own record, so
+    read-modify-write sequences are serialized host-wide. Reads compare the
+    log's inode and size with what was already replayed - one stat - and
+    catch up under a shared flock only when it moved. Compaction runs under
+    the exclusive lock; the others see a new log inode and reload the
+    snapshot. Listeners are told about remote changes as well, so
+    per-process indexes and caches follow them.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(path, **kwargs)
+        self.lock_path = path + '.lock'
+        self.lock = _ProcessLock(self)
+        self._lock_fd = None
+        self._lock_pid = None
+        self._fd_pid = None
+        self._log_ino = None
+        self._read_pos = 0
+        self.remote_records = 0
+        self.reloads = 0
+
+    # -------------- cross-process locking --------------
+    def _lock_file(self, mode: int):
+        # flock belongs to the open file description: a descriptor inherited
+        # through fork would be shared with the parent, so reopen per process
+        if self._lock_pid != os.getpid():
+            self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_fd, mode)
+
+    def _open_log(self):
+        super()._open_log()
+        self._fd_pid = os.getpid()
+
+    def _catch_up(self, exclusive: bool):
+        """Replay other processes' appends; caller holds the flock and ``lock._rlock``"""
+        if self._fd is None or self._fd_pid != os.getpid():
+            self._open_log()
+        st = os.stat(self.log_path)
+        if st.st_ino != self._log_ino:
+            self._reload(exclusive)
+        elif st.st_size > self._read_pos:
+            self._read_tail(st.st_size, exclusive)
+        self._log_size = self._read_pos
+
+    def _reload(self, exclusive: bool):
+        """Snapshot + logs from scratch (first load, or another process compacted)"""
+        data = self._read_file(self.path)
+        had_old_log = os.path.exists(self.old_log_path)
+        self.replayed = self._replay(self.old_log_path, data) + self._replay(self.log_path, data)
+        if self._fd is not None:
+            os.close(self._fd)
+        self._open_log()
+        st = os.fstat(self._fd)
+        self._log_ino, self._read_pos = st.st_ino, st.st_size
+        old, self._data = self._data, data
+        for uid in set(old) | set(data):
+            if old.get(uid) != data.get(uid):
+                self._notify(uid, old.get(uid), data.get(uid))
+        self.reloads += 1
+        if had_old_log and exclusive:
+            # A compaction died after rotating; finish it now
+            self._write_atomic(self.path, dict(self._data))
+            os.unlink(self.old_log_path)
+
+    def _read_tail(self, size: int, exclusive: bool):
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._read_pos)
+            raw = f.read(size - self._read_pos)
+        pos = 0
+        while True:
+            end = raw.find(b'\n', pos)
+            if end == -1:
+                break
+            try:
+                rec = json.loads(raw[pos:end])
+                self._apply_remote(rec)
+            except Exception:
+                break
+            pos = end + 1
+        self._read_pos += pos
+        if pos < len(raw) and exclusive:
+            # Writers only append under the exclusive lock we now hold, so
+            # this is the torn tail of one that died mid-append
+            os.ftruncate(self._fd, self._read_pos)
+            self.truncated_bytes += len(raw) - pos
+            logger.warning('Journal %s: dropping %d bytes of torn/corrupt tail', self.log_path, len(raw) - pos)
+
+    def _apply_remote(self, rec: dict):
+        uid = rec['uid']
+        old = self._data.get(uid)
+        if rec['op'] == 'put':
+            new = self._data[uid] = rec['v']
+        elif rec['op'] == 'del':
+            new = None
+            if self._data.pop(uid, None) is None:
+                return
+        else:
+            raise ValueError('unknown journal op %r' % (rec['op'],))
+        self.remote_records += 1
+        self._notify(uid, old, new)
+
+    def _write(self, data: bytes):
+        super()._write(data)
+        self._read_pos += len(data)
+
+    def load(self):
+        with self.lock:
+            pass  # the first catch-up loads everything
+        atexit.register(self.close)
+        return self
+
+    # -------------- reads --------------
+    def sync(self):
+        if self.lock.owned():
+            return  # caught up when the lock was taken
+        try:
+            st = os.stat(self.log_path)
+        except OSError:
+            return
+        if st.st_ino == self._log_ino and st.st_size == self._read_pos:
+            return
+        with self.lock._rlock:
+            self._lock_file(fcntl.LOCK_SH)
+            try:
+                self._catch_up(exclusive=False)
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def get(self, uid: str):
+        self.sync()
+        return self._data.get(uid)
+
+    def items(self) -> list:
+        self.sync()
+        with self.lock._rlock:
+            return list(self._data.items())
+
+    def __len__(self):
+        self.sync()
+        return len(self._data)
+
+    def __contains__(self, uid):
+        self.sync()
+        return uid in self._data
+
+    # -------------- compaction --------------
+    def compact(self):
+        with self._flush_lock:
+            with self.lock:
+                os.close(self._fd)
+                os.replace(self.log_path, self.old_log_path)
+                self._open_log()
+                self._write_atomic(self.path, dict(self._data))
+                os.unlink(self.old_log_path)
+                if self.fsync == 'always':
+                    self._fsync_dir(os.path.dirname(self.path) or '.')
+                self._log_ino, self._read_pos = os.fstat(self._fd).st_ino, 0
+                self.compactions += 1
+                self.flushes += 1
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out.update({
+            'mode': 'shared',
+            'remote_records': self.remote_records,
+            'reloads': self.reloads,
+        })
+        return out
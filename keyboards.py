@@ -0,0 +1,85 @@
+"""Keyboards and message texts for bot.py, built once at import.
+
+Handlers only look prebuilt screens up, so a click costs a dict lookup
+instead of building pydantic models and formatting strings. The markups are
+frozen so a handler cannot modify a shared instance by accident.
+"""
+from dataclasses import dataclass
+
+from pydantic import ConfigDict
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import PLANS, CARD_NUMBER, CARD_NAME
+
+
+class Button(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class Keyboard(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+
+def keyboard(*rows) -> Keyboard:
+    """Keyboard from rows of (text, callback_data) pairs"""
+    return Keyboard(inline_keyboard=tuple(
+        tuple(Button(text=text, callback_data=data) for text, data in row) for row in rows
+    ))
+
+
+@dataclass(frozen=True)
+class Screen:
+    text: str
+    kb: Keyboard = None
+
+
+def _chunks(items: list, size: int) -> list:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+START = Screen(
+    "Assalomu alaykum!\nObuna bo'lish uchun tugmani bosing 👇",
+    keyboard([("📅 Obuna bo'lish", "subscribe")]),
+)
+
+PLAN_MENU = Screen(
+    "Nechi oylik obuna olmoqchisiz?",
+    keyboard(*_chunks([(f"{m} oy", f"month_{m}") for m in PLANS], 3)),
+)
+
+_price_kb = keyboard(
+    [("⬅ Orqaga", "subscribe")],
+    [("📋 Karta raqamini nusxalash", "copy_card")],
+    [("📤 To‘lov chekini yuborish", "send_receipt")],
+)
+
+# callback_data ("month_3") -> price screen, one per configured plan
+PRICES = {
+    f"month_{months}": Screen(
+        f"📅 {months} oylik obuna narxi: {price:,} so‘m\n\n"
+        f"Karta: `{CARD_NUMBER}`\nEgasi: {CARD_NAME}",
+        _price_kb,
+    )
+    for months, price in PLANS.items()
+}
+
+COPY_CARD = Screen(
+    f"💳 Karta raqami: `{CARD_NUMBER}`\n\nEndi to'lov chekini yuboring.",
+    keyboard([("📤 To‘lov chekini yuborish", "send_receipt")]),
+)
+COPY_CARD_ALERT = "Karta raqamini xabardan oson nusxalashingiz mumkin"
+
+ASK_RECEIPT = Screen("📤 To‘lov chekingizni shu yerga rasm sifatida yuboring")
+RECEIPT_SENT = Screen(
+    "✅ Chekingiz adminga yuborildi.",
+    keyboard([("🔄 Yana to‘lov qilish", "subscribe")]),
+)
+UNKNOWN_PLAN = "Bu tarif endi mavjud emas"
+
+# One admin digest item: a receipt photo's caption
+RECEIPT_CAPTION = "💳 To‘lov `{id}`\n👤 {name}\n🆔 Foydalanuvchi ID: `{uid}`\n📅 Tarif: {plan}"
+RECEIPT_NO_PLAN = "tanlanmagan"
+
+EXTEND_KB = keyboard([("🔄 Obunani uzaytirish", "subscribe")])
+REMIND_TEXT = "⏳ Obunangiz {days} kundan so‘ng tugaydi.\nUzaytirish uchun tugmani bosing 👇"
+EXPIRED = Screen("⌛ Obunangiz muddati tugadi.\nQayta obuna bo‘lish uchun tugmani bosing 👇", EXTEND_KB)
@@ -0,0 +1,137 @@
+import io
+import csv
+import json
+import base64
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+SORTS = ('uid', '-uid', 'expiry', '-expiry')
+STATES = ('active', 'expired', 'expiring')
+MAX_LIMIT = 1000
+EXPORT_CHUNK = 500  # rows per streamed chunk
+CSV_FIELDS = ('uid', 'expiry', 'note')
+
+
+@dataclass
+class ListQuery:
+    """Filters, ordering and keyset position for /api/subscriptions"""
+    limit: int = 100
+    sort: str = 'uid'
+    state: str = None   # active | expired | expiring
+    within: int = 7     # days, for state=expiring
+    q: str = None       # note substring, case-insensitive
+    after: tuple = None  # (sort key, uid) of the last row already returned
+
+    @property
+    def key(self) -> str:
+        return self.sort.lstrip('-')
+
+    @property
+    def desc(self) -> bool:
+        return self.sort.startswith('-')
+
+    def bounds(self, now: datetime):
+        """(lower, upper) expiry bounds of the state filter: lower < expiry <= upper"""
+        if self.state == 'active':
+            return now, None
+        if self.state == 'expired':
+            return None, now
+        if self.state == 'expiring':
+            return now, now + timedelta(days=self.within)
+        return None, None
+
+
+PAGE_ARGS = ('limit', 'cursor', 'sort', 'state', 'within', 'q')
+
+
+def wants_page(args) -> bool:
+    return any(name in args for name in PAGE_ARGS)
+
+
+def parse_query(args) -> ListQuery:
+    """Build a ListQuery from request args; ValueError on bad input"""
+    query = ListQuery()
+    try:
+        query.limit = int(args.get('limit', query.limit))
+        query.within = int(args.get('within', query.within))
+    except (TypeError, ValueError):
+        raise ValueError("limit/within butun son bo‘lishi kerak")
+    if not 1 <= query.limit <= MAX_LIMIT:
+        raise ValueError('limit 1..%d oralig‘ida bo‘lishi kerak' % MAX_LIMIT)
+    if query.within < 0:
+        raise ValueError('within manfiy bo‘lmasin')
+    query.sort = args.get('sort', query.sort)
+    if query.sort not in SORTS:
+        raise ValueError('sort: %s' % ', '.join(SORTS))
+    query.state = args.get('state') or None
+    if query.state is not None and query.state not in STATES:
+        raise ValueError('state: %s' % ', '.join(STATES))
+    query.q = args.get('q') or None
+    cursor = args.get('cursor')
+    if cursor:
+        query.after = decode_cursor(cursor)
+    return query
+
+
+def encode_cursor(key, uid: str) -> str:
+    raw = json.dumps([key, uid], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key, uid = json.loads(raw)
+        return key, str(uid)
+    except Exception:
+        raise ValueError('cursor noto‘g‘ri')
+
+
+def page_result(rows: list, query: ListQuery, keys: list = None) -> dict:
+    """rows holds up to limit + 1 items; the extra one only signals another page.
+
+    ``keys`` optionally gives the exact sort key per row when the displayed
+    value is rounded (Postgres timestamps are shown without microseconds).
+    """
+    items = rows[:query.limit]
+    next_cursor = None
+    if len(rows) > query.limit:
+        last = query.limit - 1
+        key = keys[last] if keys is not None else items[last][query.key]
+        next_cursor = encode_cursor(key, items[last]['uid'])
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+# -------------- export formats --------------
+def ndjson_chunks(rows):
+    buf = []
+    for row in rows:
+        buf.append(json.dumps(row, ensure_ascii=False))
+        if len(buf) >= EXPORT_CHUNK:
+            yield '\n'.join(buf) + '\n'
+            buf = []
+    if buf:
+        yield '\n'.join(buf) + '\n'
+
+
+def csv_chunks(rows):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    n = 0
+    for row in rows:
+        writer.writerow(row)
+        n += 1
+        if n >= EXPORT_CHUNK:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+            n = 0
+    if out.tell():
+        yield out.getvalue()
+
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_chunks),
+    'csv': ('text/csv; charset=utf-8', csv_chunks),
+}
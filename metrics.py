@@ -0,0 +1,201 @@
+"""Minimal in-process metrics rendered in the Prometheus text format.
+
+Counters and histograms keep one child per label combination; each child
+has its own small lock, so observing a value costs a bisect and a few
+additions and threads only contend when they touch the same series. Values
+are per process: with several gunicorn workers, scrape each one (or sum
+them) as usual for multi-process Prometheus setups.
+"""
+import time
+import functools
+from bisect import bisect_left
+from threading import Lock
+
+# Seconds: 1 ms .. 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+_registry_lock = Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = '') -> str:
+    parts = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{%s}' % ','.join(parts) if parts else ''
+
+
+def _num(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = ['# HELP %s %s' % (self.name, self.doc), '# TYPE %s %s' % (self.name, self.kind)]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return ['%s%s %s' % (self.name, _labels(self.label_names, values), _num(child.value))]
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, doc: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = 'le="%s"' % _num(bound)
+            lines.append('%s_bucket%s %d' % (self.name, _labels(self.label_names, values, le), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, _labels(self.label_names, values), _num(total)))
+        lines.append('%s_count%s %d' % (self.name, _labels(self.label_names, values), cumulative))
+        return lines
+
+
+class Gauge(_Metric):
+    """Value read from ``fn()`` at scrape time (queue depths, pool usage...)"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, doc: str, fn):
+        self.fn = fn
+        super().__init__(name, doc)
+
+    def render(self) -> list:
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return ['# HELP %s %s' % (self.name, self.doc), '# TYPE %s gauge' % self.name,
+                '%s %s' % (self.name, _num(value))]
+
+
+class _Timer:
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+def timed(histogram: Histogram, errors: Counter, name: str, backend):
+    """Decorator timing calls into ``histogram{op=name, backend=backend()}``;
+    exceptions also count in ``errors`` with the same labels.
+    """
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            labels = (name, backend())
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                errors.labels(*labels).inc()
+                raise
+            finally:
+                histogram.labels(*labels).observe(time.perf_counter() - started)
+        return inner
+    return wrap
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
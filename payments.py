@@ -0,0 +1,166 @@
+"""Receipt intake: photo handler -> payments storage -> periodic admin digests.
+
+The bot's photo handler only calls ``PaymentIntake.submit()`` (no I/O) and
+answers the user. A task on the bot loop drains the queue in batches into
+``record``, a blocking callable run in the executor that inserts receipts
+keyed by Telegram's file_unique_id and returns the ids actually inserted:
+re-sent photos and retried updates stop there. Every ``interval`` seconds
+``claim`` hands over pending receipts the admin hasn't seen yet and
+``digest`` (a coroutine) sends them in one go, so a payment rush costs the
+admin a few albums instead of one message per photo. If ``digest`` fails,
+``release`` hands the claimed receipts back for the next round (an album
+that did go out before the failure is sent again).
+"""
+import os
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+DAYS_PER_MONTH = 30
+PENDING = 'pending'
+APPROVING = 'approving'  # JSON stores: expiry written ahead, subscription not yet (see server.py)
+APPROVED = 'approved'
+REJECTED = 'rejected'
+
+
+class PaymentIntake:
+
+    def __init__(self, record, claim, digest, release=None, interval: float = 60.0, batch: int = 50,
+                 choice_ttl: float = 86400.0):
+        self.record = record
+        self.claim = claim
+        self.digest = digest
+        self.release = release
+        self.interval = interval
+        self.batch = batch
+        # uid -> months picked in the price menu; the receipt arrives later
+        self._choices = TTLCache(maxsize=100000, ttl=choice_ttl)
+        # file_unique_ids submitted lately, to drop repeats before any I/O
+        self._recent = TTLCache(maxsize=10000, ttl=3600.0)
+        self._queue = deque()
+        self._wake = None
+        self._tasks = []
+        self._pid = None
+        self.submitted = 0
+        self.recorded = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.digests = 0
+        self.digested = 0
+        self.released = 0
+        self.last_digest = None
+
+    def choose(self, uid, months: int):
+        self._choices.set(str(uid), months)
+
+    def submit(self, uid, name: str, file_id: str, file_unique_id: str) -> bool:
+        """Queue a receipt (call on the bot loop); False if it was just submitted"""
+        if self._recent.get(file_unique_id) is not None:
+            self.duplicates += 1
+            return False
+        self._recent.set(file_unique_id, True)
+        self._queue.append({
+            'id': file_unique_id,
+            'uid': str(uid),
+            'name': name,
+            'file_id': file_id,
+            'months': self._choices.get(str(uid)),
+            'received_at': datetime.utcnow().replace(microsecond=0).isoformat(),
+        })
+        self.submitted += 1
+        if self._wake is not None:
+            self._wake.set()
+        return True
+
+    # -------------- tasks --------------
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Start the intake and digest tasks on ``loop`` (thread-safe, once per process)"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        loop.call_soon_threadsafe(self._create_tasks)
+
+    def _create_tasks(self):
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        if self._queue:
+            self._wake.set()
+        self._tasks = [loop.create_task(self._run_intake(), name='payment-intake'),
+                       loop.create_task(self._run_digest(), name='payment-digest')]
+
+    def stop(self):
+        if self._pid != os.getpid():
+            return
+        for task in self._tasks:
+            if not task.done() and not task.get_loop().is_closed():
+                task.get_loop().call_soon_threadsafe(task.cancel)
+
+    async def _run_intake(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._queue:
+                await self.flush()
+
+    async def flush(self):
+        """Record up to ``batch`` queued receipts"""
+        batch = [self._queue.popleft() for _ in range(min(self.batch, len(self._queue)))]
+        if not batch:
+            return
+        try:
+            inserted = await asyncio.get_running_loop().run_in_executor(None, self.record, batch)
+        except Exception as e:
+            # Storage is down: keep them for the next wake-up rather than lose them
+            self.failed += 1
+            logger.error('Recording %d receipts failed: %s', len(batch), e)
+            self._queue.extendleft(reversed(batch))
+            await asyncio.sleep(min(self.interval, 5.0))
+            return
+        self.recorded += len(inserted)
+        self.duplicates += len(batch) - len(inserted)
+
+    async def _run_digest(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.send_digest()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error('Payment digest failed: %s', e)
+
+    async def send_digest(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await loop.run_in_executor(None, self.claim, self.batch)
+            if not pending:
+                break
+            try:
+                await self.digest(pending)
+            except Exception:
+                if self.release is not None:
+                    await loop.run_in_executor(None, self.release, [p['id'] for p in pending])
+                    self.released += len(pending)
+                raise
+            self.digests += 1
+            self.digested += len(pending)
+        self.last_digest = datetime.utcnow().replace(microsecond=0).isoformat()
+
+    def stats(self) -> dict:
+        return {
+            'running': bool(self._tasks) and not any(t.done() for t in self._tasks),
+            'queued': len(self._queue),
+            'submitted': self.submitted,
+            'recorded': self.recorded,
+            'duplicates': self.duplicates,
+            'failed': self.failed,
+            'digests': self.digests,
+            'digested': self.digested,
+            'released': self.released,
+            'last_digest': self.last_digest,
+        }
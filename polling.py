@@ -0,0 +1,296 @@
+"""getUpdates long polling: the bot without a public webhook URL.
+
+    python polling.py        (Procfile "worker"; set TG_UPDATES=polling for the web processes)
+
+Batches of up to POLL_LIMIT updates are fetched while earlier ones are still
+being handled. A chat's updates are handled one at a time, in the order they
+arrived, with up to POLL_WORKERS chats served at once; fetching pauses while
+POLL_MAX_PENDING updates are unfinished (it resumes once a whole batch fits).
+
+Telegram forgets an update once getUpdates is called with a later offset,
+which can happen before the update has been handled. So before every call
+the state file (POLL_STATE) records that offset together with the updates
+not finished yet. A restart replays those and continues from the offset:
+nothing is lost, and an update that finished after the last save is handled
+twice (at least once, like webhook redeliveries).
+
+Storage, the sweeper, payment digests and the sender run in this process as
+in a web worker, on the polling loop. Without DATABASE_URL that means two
+processes on the same JSON files, so TG_UPDATES=polling switches both to
+SUBS_STORAGE=shared (one journal under a file lock); in "memory" mode each
+would rewrite subscriptions.json and payments.json over the other's updates.
+"""
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import tempfile
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update) -> int:
+    """Updates with the same key are handled in order: the chat, else the user"""
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+    chat = getattr(event, 'chat', None)
+    if chat is None:
+        chat = getattr(getattr(event, 'message', None), 'chat', None)  # callback_query
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    return user.id if user is not None else update.update_id
+
+
+class Poller:
+
+    def __init__(self, dp, bot, state_path: str, limit: int = 100, timeout: int = 25, workers: int = 32,
+                 max_pending: int = 1000, allowed_updates: list = None, shutdown_timeout: float = 10.0,
+                 retry_max: float = 30.0):
+        self.dp = dp
+        self.bot = bot
+        self.state_path = state_path
+        self.limit = limit
+        self.timeout = timeout
+        self.workers = workers
+        self.max_pending = max_pending
+        self._resume_at = max(0, max_pending - limit)  # fetch again at or below this many unfinished
+        self.allowed_updates = allowed_updates
+        self.shutdown_timeout = shutdown_timeout
+        self.retry_max = retry_max
+        self.offset = 0
+        self._pending = {}  # update_id -> Update, fetched and not finished, oldest first
+        self._dumped = {}  # update_id -> JSON-ready dict, made once for the state file
+        self._chains = {}  # chat key -> deque of its unfinished updates, head being handled
+        self._ready = None  # chat keys with an update to handle
+        self._room = None  # set while a full batch fits under max_pending
+        self._idle = None  # set while nothing is unfinished
+        self._stop = None
+        self._fetch = None
+        self._tasks = []
+        self._dirty = True  # state changed since the last save
+        self.fetches = 0
+        self.fetched = 0
+        self.processed = 0
+        self.failed = 0
+        self.errors = 0
+        self.replayed = 0
+        self.saves = 0
+        self._proc_total = 0.0
+
+    # -------------- state file --------------
+    def _load_state(self) -> list:
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return []
+        except ValueError as e:
+            logger.error('Polling state %s is unreadable (%s); continuing from Telegram\'s offset',
+                         self.state_path, e)
+            return []
+        self.offset = int(state.get('offset') or 0)
+        return state.get('pending') or []
+
+    def _save_state(self):
+        pending = []
+        for update_id, update in self._pending.items():
+            raw = self._dumped.get(update_id)
+            if raw is None:
+                raw = self._dumped[update_id] = update.model_dump(mode='json', exclude_unset=True)
+            pending.append(raw)
+        directory = os.path.dirname(self.state_path) or '.'
+        fd, tmp = tempfile.mkstemp(prefix='.polling-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                # dumps, not dump: json.dump streams through the pure-Python encoder
+                f.write(json.dumps({'offset': self.offset, 'pending': pending}, ensure_ascii=False,
+                                   separators=(',', ':')))
+            os.replace(tmp, self.state_path)
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self._dirty = False
+        self.saves += 1
+
+    # -------------- per-chat ordering --------------
+    def _enqueue(self, update):
+        self._pending[update.update_id] = update
+        key = chat_key(update)
+        chain = self._chains.get(key)
+        if chain is None:
+            self._chains[key] = deque((update,))
+            self._ready.put_nowait(key)
+        else:
+            chain.append(update)  # picked up when the chat's current update is done
+        self._idle.clear()
+        self._dirty = True
+        if len(self._pending) > self._resume_at:
+            self._room.clear()
+
+    async def _work(self):
+        while True:
+            key = await self._ready.get()
+            chain = self._chains[key]
+            update = chain[0]
+            started = time.perf_counter()
+            try:
+                await self.dp.feed_update(bot=self.bot, update=update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Update qayta ishlashda xatolik: {e}")
+            self._proc_total += time.perf_counter() - started
+            chain.popleft()
+            del self._pending[update.update_id]
+            self._dumped.pop(update.update_id, None)
+            self._dirty = True
+            if chain:
+                self._ready.put_nowait(key)  # behind the chats already waiting
+            else:
+                del self._chains[key]
+            if len(self._pending) <= self._resume_at:
+                self._room.set()
+            if not self._pending:
+                self._idle.set()
+
+    # -------------- fetch loop --------------
+    async def run(self):
+        """Poll until stop(), then let unfinished updates finish (up to shutdown_timeout)"""
+        from aiogram import types
+        self._ready = asyncio.Queue()
+        self._room = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._room.set()
+        self._idle.set()
+        for raw in self._load_state():
+            self._enqueue(types.Update.model_validate(raw, context={'bot': self.bot}))
+            self.replayed += 1
+        if self.replayed:
+            logger.info('Replaying %d updates left unfinished by the last run', self.replayed)
+        self._tasks = [asyncio.create_task(self._work(), name='tg-poll-worker-%d' % i)
+                       for i in range(self.workers)]
+        try:
+            # getUpdates is refused while a webhook is set; keep what it had queued
+            await self.bot.delete_webhook(drop_pending_updates=False)
+            await self._poll()
+        finally:
+            await self._drain()
+
+    async def _poll(self):
+        delay = 1.0
+        while not self._stop.is_set():
+            await self._room.wait()
+            if self._stop.is_set():
+                break
+            # The call below confirms everything before self.offset
+            if self._dirty:
+                self._save_state()
+            self._fetch = asyncio.ensure_future(self.bot.get_updates(
+                offset=self.offset, limit=self.limit,
+                timeout=self.timeout, allowed_updates=self.allowed_updates,
+                request_timeout=self.timeout + 10))
+            try:
+                batch = await self._fetch
+            except asyncio.CancelledError:
+                if self._stop.is_set():
+                    break
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error('getUpdates failed (retry in %.0fs): %s', delay, e)
+                try:
+                    await asyncio.wait_for(self._stop.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, self.retry_max)
+                continue
+            finally:
+                self._fetch = None
+            delay = 1.0
+            self.fetches += 1
+            self.fetched += len(batch)
+            for update in batch:
+                self._enqueue(update)
+            if batch:
+                self.offset = batch[-1].update_id + 1
+
+    async def _drain(self):
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Polling stopped with %d unfinished updates; the next start replays them',
+                           len(self._pending))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._save_state()
+
+    def stop(self):
+        """Stop fetching (call on the polling loop, e.g. from a signal handler)"""
+        if self._stop is None or self._stop.is_set():
+            return
+        self._stop.set()
+        self._room.set()
+        if self._fetch is not None:
+            self._fetch.cancel()
+
+    def stats(self) -> dict:
+        done = self.processed + self.failed
+        return {
+            'offset': self.offset,
+            'pending': len(self._pending),
+            'chats': len(self._chains),
+            'workers': self.workers,
+            'fetches': self.fetches,
+            'fetched': self.fetched,
+            'processed': self.processed,
+            'failed': self.failed,
+            'errors': self.errors,
+            'replayed': self.replayed,
+            'saves': self.saves,
+            'process_avg_ms': round(self._proc_total / done * 1000, 3) if done else 0.0,
+        }
+
+
+async def main():
+    import server
+    from server import updates
+    from config import TG_UPDATES, POLL_STATE, POLL_LIMIT, POLL_TIMEOUT, POLL_WORKERS, POLL_MAX_PENDING
+    if TG_UPDATES != 'polling':
+        logger.warning('TG_UPDATES is %r: a web process may set the webhook again and stop this poller',
+                       TG_UPDATES)
+        if not server.USE_DB and server.SUBS_STORAGE != 'shared':
+            raise SystemExit('SUBS_STORAGE=%s is not safe next to a web process; set TG_UPDATES=polling '
+                             '(or SUBS_STORAGE=shared) for both' % server.SUBS_STORAGE)
+    tg = server.telegram()
+    # Background work (sweeper, payment digests, sender) runs on this loop
+    updates.attach()
+    server.start_background()
+    poller = Poller(tg.dp, tg.bot, POLL_STATE or os.path.join(os.path.dirname(server.SUBS_JSON), 'polling.json'),
+                    limit=POLL_LIMIT, timeout=POLL_TIMEOUT, workers=POLL_WORKERS, max_pending=POLL_MAX_PENDING,
+                    allowed_updates=tg.prefilter.allowed_updates)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, poller.stop)
+    try:
+        await poller.run()
+    finally:
+        logger.info('Polling stopped: %s', poller.stats())
+        server.sweeper.stop()
+        server.payment_intake.stop()
+        server.stop_sender()
+        await updates.detach()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
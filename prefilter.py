@@ -0,0 +1,95 @@
+import json
+from threading import Lock
+from collections import OrderedDict
+
+# Verdicts of Prefilter.check
+DISPATCH = 'dispatch'
+DROP = 'drop'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+
+class Prefilter:
+    """Cheap triage of raw webhook bodies before the pydantic Update is built.
+
+    The body is parsed with the C json module and matched against what the
+    bot's handlers react to (``commands``, exact ``callbacks``,
+    ``callback_prefixes`` and message fields such as ``photo``). Updates no
+    handler would match are answered without ever building the model or
+    touching the dispatcher. Update ids are remembered in a bounded set, so
+    Telegram redeliveries of an update we already accepted are dropped too;
+    ``forget`` releases an id again when the update could not be queued.
+    """
+
+    def __init__(self, commands=(), callbacks=(), callback_prefixes=(), message_fields=(),
+                 seen_max: int = 10000):
+        self.commands = tuple('/' + c for c in commands)
+        self.callbacks = frozenset(callbacks)
+        self.callback_prefixes = tuple(callback_prefixes)
+        self.message_fields = tuple(message_fields)
+        self.seen_max = seen_max
+        self._seen = OrderedDict()
+        self._lock = Lock()
+        self.counts = {DISPATCH: 0, DROP: 0, DUPLICATE: 0, INVALID: 0}
+
+    @property
+    def allowed_updates(self) -> list:
+        """Update types to request from Telegram in setWebhook/getUpdates"""
+        types = []
+        if self.commands or self.message_fields:
+            types.append('message')
+        if self.callbacks or self.callback_prefixes:
+            types.append('callback_query')
+        return types
+
+    def _wanted(self, data: dict) -> bool:
+        message = data.get('message')
+        if isinstance(message, dict):
+            if any(field in message for field in self.message_fields):
+                return True
+            text = message.get('text')
+            if isinstance(text, str) and text.startswith(self.commands):
+                # "/start", "/start payload", "/start@bot" - not "/startx"
+                for command in self.commands:
+                    if text.startswith(command) and text[len(command):len(command) + 1] in ('', ' ', '@'):
+                        return True
+            return False
+        query = data.get('callback_query')
+        if isinstance(query, dict):
+            cb = query.get('data')
+            return isinstance(cb, str) and (cb in self.callbacks or cb.startswith(self.callback_prefixes))
+        return False
+
+    def check(self, body) -> tuple:
+        """(verdict, parsed dict or None) for a raw webhook body"""
+        try:
+            data = json.loads(body)
+            update_id = data['update_id']
+        except (ValueError, TypeError, KeyError):
+            return self._count(INVALID), None
+        if not self._wanted(data):
+            return self._count(DROP), None
+        with self._lock:
+            if update_id in self._seen:
+                self.counts[DUPLICATE] += 1
+                return DUPLICATE, None
+            self._seen[update_id] = True
+            if len(self._seen) > self.seen_max:
+                self._seen.popitem(last=False)
+            self.counts[DISPATCH] += 1
+        return DISPATCH, data
+
+    def forget(self, update_id):
+        """Let a redelivery of ``update_id`` through (e.g. it was rejected with 503)"""
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+    def _count(self, verdict: str) -> str:
+        with self._lock:
+            self.counts[verdict] += 1
+        return verdict
+
+    def stats(self) -> dict:
+        total = sum(self.counts.values())
+        return dict(self.counts, received=total, seen=len(self._seen),
+                    drop_ratio=round((total - self.counts[DISPATCH]) / total, 4) if total else 0.0)
@@ -0,0 +1,204 @@
+"""Per-request phase timing, the slow-request log and an on-demand sampling profiler.
+
+``Tracer.begin()``/``finish()`` bracket a request or a Telegram update;
+``span(phase)`` blocks inside it (JSON decoding, storage calls, Bot API
+calls) add their time to that trace's phase breakdown. The current trace
+lives in a context variable, so it follows the request through its thread
+or task (and into executor calls made with a copied context). Outside a
+trace a span is one ContextVar lookup returning a shared no-op object.
+Traces slower than ``slow_ms`` are logged with their breakdown and kept
+in a short ring for ``/api/profile/slow``.
+
+``sample()`` is a wall-clock sampler over ``sys._current_frames()``, run
+on the calling thread for a bounded time; nothing runs until it is asked
+for. ``collapsed()`` renders the samples as collapsed stacks
+("thread;outer;...;inner count" lines) for flamegraph.pl or speedscope.
+"""
+import re
+import sys
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('profiling_trace', default=None)
+
+
+class Trace:
+    __slots__ = ('name', 'started', 'phases', 'slow_ok', '_token')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.phases = {}  # phase -> [seconds, calls]
+        self.slow_ok = False  # slow on purpose: not logged
+        self._token = None
+
+    def add(self, phase: str, seconds: float):
+        entry = self.phases.get(phase)
+        if entry is None:
+            self.phases[phase] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+class _Span:
+    __slots__ = ('trace', 'phase', 'started')
+
+    def __init__(self, trace: Trace, phase: str):
+        self.trace = trace
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.phase, time.perf_counter() - self.started)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(phase: str):
+    """Context manager adding the block's time to ``phase`` of the current trace, if any"""
+    trace = _current.get()
+    return _NO_SPAN if trace is None else _Span(trace, phase)
+
+
+def record(phase: str, seconds: float):
+    """Add time measured elsewhere (e.g. by a metrics middleware) to the current trace"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(phase, seconds)
+
+
+def expect_slow():
+    """Keep the current trace out of the slow log (a request that is long by design)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.slow_ok = True
+
+
+class Tracer:
+
+    def __init__(self, slow_ms: float = 500.0, log_size: int = 200):
+        self.slow = slow_ms / 1000.0  # 0: tracing off, begin() returns None
+        self._slowest = deque(maxlen=log_size)
+        self.traced = 0
+        self.slow_count = 0
+
+    def begin(self, name: str):
+        """Start a trace as the current one; pass it to finish()"""
+        if self.slow <= 0:
+            return None
+        trace = Trace(name)
+        trace._token = _current.set(trace)
+        return trace
+
+    def finish(self, trace, status=None):
+        """End a trace from begin(); log and keep it if it was slow"""
+        if trace is None:
+            return
+        elapsed = time.perf_counter() - trace.started
+        try:
+            _current.reset(trace._token)
+        except ValueError:  # finished from another context; it stays set there, harmlessly
+            pass
+        self.traced += 1
+        if elapsed < self.slow or trace.slow_ok:
+            return
+        self.slow_count += 1
+        name = trace.name
+        phases = sorted(trace.phases.items(), key=lambda item: -item[1][0])
+        other = elapsed - sum(seconds for seconds, _ in trace.phases.values())
+        entry = {
+            'name': name,
+            'status': status,
+            'ms': round(elapsed * 1000, 1),
+            'at': datetime.utcnow().replace(microsecond=0).isoformat(),
+            'phases': {phase: {'ms': round(seconds * 1000, 1), 'calls': calls}
+                       for phase, (seconds, calls) in phases},
+            'other_ms': round(max(other, 0.0) * 1000, 1),
+        }
+        self._slowest.append(entry)
+        breakdown = ', '.join('%s %.1f ms%s' % (phase, seconds * 1000, ' x%d' % calls if calls > 1 else '')
+                              for phase, (seconds, calls) in phases)
+        logger.warning('Slow %s%s: %.1f ms (%s%sother %.1f ms)', name, ' %s' % status if status is not None else '',
+                       elapsed * 1000, breakdown, ', ' if breakdown else '', entry['other_ms'])
+
+    def recent(self) -> list:
+        """Slow traces kept, newest first"""
+        return list(reversed(self._slowest))
+
+    def stats(self) -> dict:
+        return {'slow_ms': self.slow * 1000, 'traced': self.traced, 'slow': self.slow_count,
+                'kept': len(self._slowest)}
+
+
+# -------------- sampling profiler --------------
+_sampling = threading.Lock()  # one profile at a time per process
+_THREAD_NUMBER = re.compile(r'\d+')
+
+
+def _label(code, labels: dict) -> str:
+    label = labels.get(code)
+    if label is None:
+        filename = code.co_filename.rsplit('/', 1)[-1]
+        label = labels[code] = '%s (%s:%d)' % (code.co_name, filename, code.co_firstlineno)
+    return label
+
+
+def sample(seconds: float, interval: float = 0.005):
+    """Stack counts {(thread, frame, ...): samples} of all other threads, taken every
+    ``interval`` seconds for ``seconds``; None if another profile is running"""
+    if not _sampling.acquire(blocking=False):
+        return None
+    try:
+        me = threading.get_ident()
+        labels = {}  # code object -> label, each formatted once
+        counts = {}
+        deadline = time.perf_counter() + seconds
+        while True:
+            tick = time.perf_counter()
+            # Worker threads of one pool merge into one root: "ThreadPoolExecutor-N_N"
+            names = {t.ident: _THREAD_NUMBER.sub('N', t.name) for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame.f_code, labels))
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                key = tuple(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            if tick + interval >= deadline:
+                break
+            time.sleep(max(0.0, tick + interval - time.perf_counter()))
+        return counts
+    finally:
+        _sampling.release()
+
+
+def collapsed(counts: dict) -> str:
+    """Collapsed-stack text, busiest stacks first"""
+    lines = ['%s %d' % (';'.join(frame.replace(';', ',') for frame in stack), n)
+             for stack, n in sorted(counts.items(), key=lambda item: -item[1])]
+    return '\n'.join(lines) + '\n' if lines else ''
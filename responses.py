@@ -0,0 +1,119 @@
+"""Compression and conditional requests, shared by server.py and aioserver.py.
+
+Static pages (admin.html, login.html) are read and compressed once, at
+their best levels, when the app is created; a hit is then a dict lookup
+on the negotiated encoding, and a revalidation with a matching
+If-None-Match is a bodyless 304. JSON responses are compressed per
+request, at a cheaper level, once they are big enough to gain from it.
+brotli is used when the module is installed, gzip always.
+"""
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # optional: gzip alone still does most of the work
+    brotli = None
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)  # preference order
+
+
+def accepted_encodings(header: str) -> set:
+    """Codings an Accept-Encoding header allows (q=0 excluded)"""
+    out = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            out.add(coding)
+    if '*' in out:
+        out.update(ENCODINGS)
+    return out
+
+
+def pick_encoding(header: str):
+    """Best encoding we can produce that the client takes, or None"""
+    allowed = accepted_encodings(header)
+    for coding in ENCODINGS:
+        if coding in allowed:
+            return coding
+    return None
+
+
+def compress(data: bytes, coding: str, level: int = 6) -> bytes:
+    """``level`` on gzip's 1-9 scale; 9 means best, whatever it costs"""
+    if coding == 'br':
+        # brotli quality level-1 is about as fast as gzip at ``level`` and smaller
+        return brotli.compress(data, quality=11 if level >= 9 else max(0, level - 1))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def etag_matches(header: str, tag: str) -> bool:
+    """If-None-Match against an ETag value (weak comparison, as for GET)"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    want = '"%s"' % tag
+    return any(t.strip().removeprefix('W/') == want for t in header.split(','))
+
+
+class StaticPage:
+    """A file held in memory in every encoding, with a content-hash ETag"""
+
+    def __init__(self, path: str, content_type: str = 'text/html; charset=utf-8', max_age: int = 3600):
+        self.path = path
+        self.content_type = content_type
+        self.max_age = max_age
+        self.etag = None
+        self._bodies = {}  # coding (None: identity) -> bytes
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        bodies = {None: raw}
+        for coding in ENCODINGS:
+            packed = compress(raw, coding, 9)
+            if len(packed) < len(raw):
+                bodies[coding] = packed
+        self._bodies = bodies
+        self.etag = hashlib.sha256(raw).hexdigest()[:20]
+        return self
+
+    def sizes(self) -> dict:
+        return {coding or 'identity': len(body) for coding, body in self._bodies.items()}
+
+    def respond(self, accept_encoding: str, if_none_match: str) -> tuple:
+        """(status, headers, body) for a GET"""
+        if self.etag is None:
+            self.load()
+        coding = pick_encoding(accept_encoding)
+        if coding not in self._bodies:
+            coding = None
+        headers = {
+            # Each representation gets its own validator
+            'ETag': '"%s%s"' % (self.etag, '-' + coding if coding else ''),
+            'Cache-Control': 'public, max-age=%d' % self.max_age,
+            'Vary': 'Accept-Encoding',
+        }
+        if etag_matches(if_none_match, headers['ETag'].strip('"')):
+            return 304, headers, b''
+        headers['Content-Type'] = self.content_type
+        if coding:
+            headers['Content-Encoding'] = coding
+        return 200, headers, self._bodies[coding]
+
+
+def json_encoding(size: int, accept_encoding: str, min_size: int):
+    """Encoding to compress a JSON body of ``size`` bytes with, or None to send it as is"""
+    if size < min_size:
+        return None
+    return pick_encoding(accept_encoding)
@@ -0,0 +1,342 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+from collections import deque, OrderedDict
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+
+logger = logging.getLogger(__name__)
+
+# Job priorities: lower goes first once a chat is allowed to send
+URGENT = 0  # admin notifications, replies
+BULK = 1    # broadcasts, expiry notices
+
+MAX_BROADCASTS = 20  # finished broadcasts kept for /api/broadcast/<id>
+CHAT_STATES_MAX = 10000  # per-chat buckets remembered after their queue drains
+
+
+class SenderFull(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float, now: float):
+        """Empty the bucket so the next token appears ``seconds`` from now"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class _Job:
+    __slots__ = ('method', 'priority', 'future', 'broadcast', 'enqueued_at', 'attempts')
+
+    def __init__(self, method, priority, future=None, broadcast=None):
+        self.method = method
+        self.priority = priority
+        self.future = future
+        self.broadcast = broadcast
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class Broadcast:
+    def __init__(self, bid: str, total: int):
+        self.id = bid
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.started = time.time()
+        self.finished = None
+
+    def done(self, ok: bool):
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+        if self.sent + self.failed == self.total:
+            self.finished = time.time()
+
+    def stats(self) -> dict:
+        return {
+            'id': self.id,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'pending': self.total - self.sent - self.failed,
+            'elapsed_s': round((self.finished or time.time()) - self.started, 3),
+        }
+
+
+class Sender:
+    """Outbound Telegram scheduler honouring the Bot API flood limits.
+
+    Every outgoing API call (an aiogram method object such as ``SendMessage``)
+    is queued per chat. A chat is handed to the send loop only when both its
+    own bucket (``chat_rate``/s, ``chat_burst`` deep) and the global bucket
+    (``rate``/s) have a token, and a chat never has more than one request in
+    flight, so messages to one chat keep their order. URGENT jobs overtake
+    queued BULK jobs of other chats, so a broadcast never delays an admin
+    notification by more than one send slot.
+
+    429 responses park the chat for ``retry_after`` seconds and retry the same
+    job; network and 5xx errors retry with backoff up to ``max_retries``.
+    Everything runs on one event loop (the update loop): ``send``/``post`` and
+    ``broadcast`` must be called from it.
+    """
+
+    def __init__(self, bot, rate: float = 25.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 concurrency: int = 8, max_retries: int = 3, maxsize: int = 100000):
+        self.bot = bot
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.maxsize = maxsize
+        self._reset()
+        # metrics
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._calls = 0
+        self._send_total = 0.0
+        self._send_max = 0.0
+        self._recent = deque()  # completion times of the last 10s, for sends/s
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._task = None
+        self._wake = None
+        self._bucket = TokenBucket(self.rate, max(1.0, self.rate / 5))
+        self._queues = {}  # chat_id -> deque of jobs
+        self._buckets = OrderedDict()  # chat_id -> TokenBucket, LRU-bounded
+        self._waiting = []  # (ready_at, seq, chat_id): chats with queued jobs, rate limited
+        self._ready = (deque(), deque())  # chats allowed to send now, by head job priority
+        self._busy = set()  # chats with a request in flight
+        self._seq = 0
+        self._depth = 0
+        self._in_flight = 0
+        self._broadcasts = OrderedDict()
+
+    # -------------- producer side (on the loop) --------------
+    def post(self, method, priority: int = URGENT, broadcast: Broadcast = None):
+        """Queue a call without waiting for it; SenderFull if the queue is full"""
+        self._push(_Job(method, priority, broadcast=broadcast))
+
+    async def send(self, method, priority: int = URGENT):
+        """Queue a call and wait for its result (exceptions are re-raised)"""
+        future = asyncio.get_running_loop().create_future()
+        self._push(_Job(method, priority, future=future))
+        return await future
+
+    def broadcast(self, methods: list) -> dict:
+        """Queue BULK calls as one tracked broadcast; returns its stats"""
+        if self._depth + len(methods) > self.maxsize:
+            raise SenderFull('Navbat to‘la')
+        item = Broadcast('%x' % time.time_ns(), len(methods))
+        self._broadcasts[item.id] = item
+        while len(self._broadcasts) > MAX_BROADCASTS:
+            self._broadcasts.popitem(last=False)
+        for method in methods:
+            self.post(method, BULK, broadcast=item)
+        return item.stats()
+
+    def broadcast_stats(self, bid: str):
+        item = self._broadcasts.get(bid)
+        return item.stats() if item is not None else None
+
+    def _push(self, job: _Job):
+        if self._pid != os.getpid():
+            self._reset()
+        if self._depth >= self.maxsize:
+            raise SenderFull('Navbat to‘la')
+        self._ensure_running()
+        chat_id = job.method.chat_id
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.append(job)
+        self._depth += 1
+        if len(queue) == 1 and chat_id not in self._busy:
+            self._schedule(chat_id, time.monotonic())
+        elif job.priority == URGENT:
+            # Promote the chat if it is sitting in the BULK ready lane
+            try:
+                self._ready[BULK].remove(chat_id)
+                self._ready[URGENT].append(chat_id)
+            except ValueError:
+                pass
+        self._wake.set()
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self._run(), name='tg-sender')
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            while len(self._buckets) > CHAT_STATES_MAX:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        return bucket
+
+    def _schedule(self, chat_id, now: float):
+        """Put a chat with queued jobs into the waiting heap or a ready lane"""
+        delay = self._chat_bucket(chat_id).delay(now)
+        if delay > 0:
+            self._seq += 1
+            heapq.heappush(self._waiting, (now + delay, self._seq, chat_id))
+        else:
+            self._ready[self._queues[chat_id][0].priority].append(chat_id)
+
+    # -------------- send loop --------------
+    async def _run(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._waiting)
+                self._ready[self._queues[chat_id][0].priority].append(chat_id)
+            lane = self._ready[URGENT] or self._ready[BULK]
+            if not lane:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            delay = self._bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await slots.acquire()
+            lane = self._ready[URGENT] or self._ready[BULK]  # may have changed meanwhile
+            if not lane:
+                slots.release()
+                continue
+            chat_id = lane.popleft()
+            job = self._queues[chat_id].popleft()
+            now = time.monotonic()
+            self._bucket.take(now)
+            self._chat_bucket(chat_id).take(now)
+            self._busy.add(chat_id)
+            self._in_flight += 1
+            asyncio.get_running_loop().create_task(self._deliver(chat_id, job, slots))
+
+    async def _deliver(self, chat_id, job: _Job, slots: asyncio.Semaphore):
+        started = time.monotonic()
+        if job.attempts == 0:
+            wait = started - job.enqueued_at
+            self._waited += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        job.attempts += 1
+        retry_in = None
+        result = error = None
+        try:
+            result = await self.bot(job.method)
+        except TelegramRetryAfter as e:
+            self.rate_limited += 1
+            retry_in = float(e.retry_after)
+            error = e
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if job.attempts <= self.max_retries:
+                retry_in = 2 ** (job.attempts - 1)
+            error = e
+        except Exception as e:
+            error = e
+        finally:
+            slots.release()
+            self._in_flight -= 1
+            self._busy.discard(chat_id)
+        elapsed = time.monotonic() - started
+        self._calls += 1
+        self._send_total += elapsed
+        self._send_max = max(self._send_max, elapsed)
+
+        queue = self._queues[chat_id]
+        now = time.monotonic()
+        if retry_in is not None:
+            self.retried += 1
+            logger.warning('Telegram send to %s retried in %.1fs: %s', chat_id, retry_in, error)
+            queue.appendleft(job)
+            self._chat_bucket(chat_id).block(retry_in, now)
+        else:
+            self._depth -= 1
+            self._finish(job, result, error)
+        if queue:
+            self._schedule(chat_id, now)
+            self._wake.set()
+        else:
+            del self._queues[chat_id]
+
+    def _finish(self, job: _Job, result, error):
+        now = time.monotonic()
+        if error is None:
+            self.sent += 1
+            self._recent.append(now)
+        else:
+            self.failed += 1
+            if job.future is None:
+                logger.warning('Telegram send to %s failed: %s', job.method.chat_id, error)
+        while self._recent and self._recent[0] < now - 10:
+            self._recent.popleft()
+        if job.broadcast is not None:
+            job.broadcast.done(error is None)
+        if job.future is not None and not job.future.done():
+            if error is None:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(error)
+
+    def stop(self):
+        if self._task is not None and self._pid == os.getpid() and not self._task.done():
+            self._task.get_loop().call_soon_threadsafe(self._task.cancel)
+
+    def stats(self) -> dict:
+        return {
+            'depth': self._depth,
+            'in_flight': self._in_flight,
+            'chats': len(self._queues),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'rate_limited': self.rate_limited,
+            'sends_per_sec': round(len(self._recent) / 10, 1),
+            'queue_wait_avg_ms': round(self._wait_total / self._waited * 1000, 3) if self._waited else 0.0,
+            'queue_wait_max_ms': round(self._wait_max * 1000, 3),
+            'send_avg_ms': round(self._send_total / self._calls * 1000, 3) if self._calls else 0.0,
+            'send_max_ms': round(self._send_max * 1000, 3),
+            'broadcasts': [b.stats() for b in self._broadcasts.values() if b.finished is None],
+        }
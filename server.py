@@ -1,25 +1,58 @@
 import os
-import asyncio
+import sys
+import time
+import atexit
 import logging
+import importlib.util
 from threading import Lock
 from datetime import datetime, timedelta
-import hmac
 import hashlib
-import json
-import psycopg2
-import psycopg2.extras
+import heapq
+import functools
+from operator import itemgetter
 
-from flask import Flask, request, jsonify, send_file, session, redirect
+from flask import Flask, Response, g, request, jsonify, session, redirect, make_response, stream_with_context
 from flask_cors import CORS
-from aiogram import Bot, types, Dispatcher
 
-from config import BOT_TOKEN, FLASK_SECRET, BASE_URL
-from bot import bot, dp
+from config import BOT_TOKEN, FLASK_SECRET, PLANS, ADMIN_ID
+from config import API_AUTH, TOKEN_SECRET, ADMIN_TOKEN_TTL, SUBSCRIBER_TOKEN_TTL, TOKEN_CACHE_SIZE, LOGIN_MAX_AGE
+from config import DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_CHECK_IDLE
+from config import SUBS_PATH, SUBS_FLUSH_DELAY, SUBS_FSYNC, SUBS_STORAGE, SUBS_LOG_MAX_BYTES
+from config import WEB_CONCURRENCY
+from config import STATUS_CACHE_TTL, STATUS_CACHE_MAX
+from config import UPDATE_QUEUE_SIZE, UPDATE_WORKERS, UPDATE_QUEUE_FULL, TG_UPDATES
+from config import BULK_MAX_ITEMS
+from config import STATIC_MAX_AGE, COMPRESS_MIN_SIZE, COMPRESS_LEVEL
+from config import SLOW_REQUEST_MS, SLOW_LOG_SIZE, PROFILE_MAX_SECONDS, PROFILE_INTERVAL_MS
+from config import CHANGES_LIMIT, CHANGES_FEED_SIZE, CHANGES_RETENTION_DAYS
+from config import SWEEP_ENABLED, SWEEP_INTERVAL, SWEEP_BATCH, REMIND_DAYS, SWEEP_LOOKBACK_DAYS
+from config import PAYMENT_DIGEST_INTERVAL, PAYMENT_BATCH
+from store import SubscriptionStore
+from journal import JournalStore, SharedJournalStore
+from binstore import BinaryJournalStore, import_json
+from cache import TTLCache
+from updates import UpdateQueue
+import listing
+import bulk
+import responses
+import tokens
+import analytics
+import profiling
+from analytics import ExpiryColumns
+from changes import ChangeFeed
+from sweeper import ExpiryHeap, Sweeper, MARK_FIELDS, REMIND, EXPIRED
+from payments import PaymentIntake, DAYS_PER_MONTH, PENDING, APPROVING, APPROVED, REJECTED
+from prefilter import DISPATCH, INVALID
+from startup import Startup
+import metrics
+from metrics import Counter, Histogram, Gauge
 
 # Constants
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, 'static')
-SUBS_JSON = os.path.join(BASE_DIR, 'subscriptions.json')
+SUBS_JSON = SUBS_PATH or os.path.join(BASE_DIR, 'subscriptions.json')
+SUBS_BIN = os.path.splitext(SUBS_JSON)[0] + '.bin'  # SUBS_STORAGE=binary
+PAYMENTS_JSON = os.path.join(os.path.dirname(SUBS_JSON), 'payments.json')
 VERSION = 'srv-json-fallback-3'
 
 # Flask app setup - eng yuqorida yaratilishi kerak
@@ -27,63 +60,154 @@ app = Flask(__name__, static_folder=STATIC_DIR)
 app.secret_key = FLASK_SECRET
 CORS(app)
 
-# Bot instance va webhook setup
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route, method and status',
+                        ('route', 'method', 'status'))
+HTTP_SECONDS = Histogram('http_request_duration_seconds', 'HTTP request latency by route',
+                         ('route', 'method'))
+# Phase breakdown of requests and updates slower than SLOW_REQUEST_MS
+tracer = profiling.Tracer(SLOW_REQUEST_MS, SLOW_LOG_SIZE)
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.trace = tracer.begin(request.method + ' ' + route)
+
+
+@app.after_request
+def _record_request(response):
+    # Also runs for 500s produced from unhandled exceptions
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUESTS.labels(route, request.method, response.status_code).inc()
+        HTTP_SECONDS.labels(route, request.method).observe(time.perf_counter() - started)
+    tracer.finish(g.pop('trace', None), response.status_code)
+    return response
+
+
+@app.after_request
+def _compress(response):
+    # Registered after _record_request, so it runs before it (Flask runs them in reverse)
+    if (response.status_code != 200 or response.mimetype != 'application/json' or response.is_streamed
+            or response.direct_passthrough or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    coding = responses.json_encoding(len(body), request.headers.get('Accept-Encoding', ''), COMPRESS_MIN_SIZE)
+    if coding is not None:
+        with profiling.span('compress'):
+            response.set_data(responses.compress(body, coding, COMPRESS_LEVEL))
+        response.headers['Content-Encoding'] = coding
+    return response
+
+
+# Updates are processed on a dedicated event loop thread, off the request threads
+updates = UpdateQueue(None, None, maxsize=UPDATE_QUEUE_SIZE, workers=UPDATE_WORKERS,
+                      full_policy=UPDATE_QUEUE_FULL)
+atexit.register(updates.stop)
+
+
+def telegram():
+    """bot.py (aiogram, handlers, sender, prefilter), imported on first use.
+
+    aiogram alone takes longer to import than the rest of the app together;
+    the startup thread warms it right after boot, so requests rarely wait.
+    """
+    import bot
+    if updates.dp is None:
+        bot.dp['payments'] = payment_intake  # handler argument (aiogram workflow data)
+        bot.dp['tracer'] = tracer  # read by bot.update_metrics
+        updates.bind(bot.dp, bot.bot)
+    return bot
+
+
+def loaded_telegram():
+    """bot.py if telegram() finished importing it, else None (stats, shutdown)"""
+    # sys.modules has it as soon as an import starts, possibly on another thread
+    return sys.modules.get('bot') if updates.dp is not None else None
+
+
+def stop_sender():
+    tg = loaded_telegram()
+    if tg is not None:
+        tg.sender.stop()
 
-async def process_update(update: types.Update):
-    """Update ni qayta ishlash"""
-    try:
-        await dp.feed_update(bot=bot, update=update)
-    except Exception as e:
-        logging.error(f"Update qayta ishlashda xatolik: {e}")
 
 @app.route('/tg/webhook', methods=['POST'])
 def tg_webhook():
-    """Webhook handler"""
+    """Webhook handler: triage, validate, enqueue and answer right away"""
+    prefilter = telegram().prefilter
+    with profiling.span('prefilter'):
+        verdict, data = prefilter.check(request.get_data())
+    if verdict == INVALID:
+        logging.error('Webhook qayta ishlashda xatolik: invalid JSON')
+        return 'Error', 400
+    if verdict != DISPATCH:
+        return 'OK'  # no handler would match it, or already accepted once
     try:
-        update = types.Update.model_validate_json(request.get_data().decode('utf-8'))
-        loop.run_until_complete(process_update(update))
-        return 'OK'
+        from aiogram import types
+        with profiling.span('decode'):
+            update = types.Update.model_validate(data)
     except Exception as e:
+        prefilter.forget(data['update_id'])
         logging.error(f'Webhook qayta ishlashda xatolik: {e}')
-        return 'Error', 500
+        return 'Error', 400
+    if not updates.submit(update):
+        if updates.full_policy == 'reject':
+            # Telegram will redeliver the update later
+            prefilter.forget(update.update_id)
+            return 'Busy', 503
+        logging.warning('Update queue full, update %s dropped', update.update_id)
+    return 'OK'
 
-async def setup_webhook():
-    """Bot va webhook ni sozlash"""
-    try:
-        webhook_url = f"{BASE_URL}/tg/webhook"
-        await bot.delete_webhook(drop_pending_updates=True)  # Eski updatelarni o'chiramiz
-        await bot.set_webhook(url=webhook_url)
-        logging.info(f"Webhook muvaffaqiyatli o'rnatildi: {webhook_url}")
-    except Exception as e:
-        logging.error(f'Webhook o\'rnatishda xatolik: {e}')
 
-def init_webhook():
-    """Webhook ni sinxron ravishda o'rnatish"""
-    loop.run_until_complete(setup_webhook())
+def register_webhook():
+    """Webhook ni o'rnatish, on this process' update loop (a startup step)"""
+    if not updates.run(telegram().setup_webhook(), 60):
+        raise RuntimeError("Webhook o'rnatilmadi")
 
-# Server ishga tushganda webhook ni o'rnatish
-if os.environ.get('RENDER'):
-    init_webhook()
 
 PORT = os.environ.get('PORT', 5000)
 
 DATABASE_URL = os.getenv("DATABASE_URL", "")
-USE_DB = bool(DATABASE_URL) and (psycopg2 is not None)
+# find_spec only locates the package; psycopg2 itself is imported with the pool
+USE_DB = bool(DATABASE_URL) and importlib.util.find_spec('psycopg2') is not None
 
 
-def get_conn():
-    if not DATABASE_URL:
-        raise RuntimeError("DATABASE_URL is not set. Use a free Postgres like Neon and set DATABASE_URL env var.")
-    if psycopg2 is None:
-        raise RuntimeError("psycopg2 is not installed. Install psycopg2-binary or unset DATABASE_URL to use JSON storage.")
+_pool = None
+_pool_lock = Lock()
+
+
+def database_dsn() -> str:
     # Ensure SSL in hosted environments (Neon/Supabase typically require it)
     if 'sslmode' not in DATABASE_URL:
-        dsn = DATABASE_URL + ("?sslmode=require" if '?' not in DATABASE_URL else "&sslmode=require")
-    else:
-        dsn = DATABASE_URL
-    return psycopg2.connect(dsn)
+        return DATABASE_URL + ("?sslmode=require" if '?' not in DATABASE_URL else "&sslmode=require")
+    return DATABASE_URL
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        if not DATABASE_URL:
+            raise RuntimeError("DATABASE_URL is not set. Use a free Postgres like Neon and set DATABASE_URL env var.")
+        if not USE_DB:
+            raise RuntimeError("psycopg2 is not installed. Install psycopg2-binary or unset DATABASE_URL to use JSON storage.")
+        from db_pool import ConnectionPool
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(database_dsn(), DB_POOL_MIN, DB_POOL_MAX,
+                                       timeout=DB_POOL_TIMEOUT, check_idle=DB_POOL_CHECK_IDLE)
+    return _pool
+
+
+def get_conn():
+    """Pooled connection: commits on success, rolls back on error, then returns it to the pool"""
+    return get_pool().connection()
+
+
+SUBS_CHANNEL = 'subscriptions_changed'  # NOTIFY channel, payload is the uid
 
 
 def init_db():
@@ -96,53 +220,130 @@ def init_db():
                   expiry TIMESTAMP WITH TIME ZONE,
                   note TEXT
                 );
+                CREATE INDEX IF NOT EXISTS subscriptions_expiry_idx ON subscriptions (expiry, uid);
+                -- expiry the reminder / expired notice was already sent for
+                ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS reminded_for TIMESTAMP WITH TIME ZONE;
+                ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS expired_for TIMESTAMP WITH TIME ZONE;
+                -- change feed: last expiry/note change, and deleted uids (tombstones)
+                ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+                CREATE INDEX IF NOT EXISTS subscriptions_updated_idx ON subscriptions (updated_at);
+                CREATE TABLE IF NOT EXISTS subscriptions_deleted (
+                  uid TEXT PRIMARY KEY,
+                  deleted_at TIMESTAMP WITH TIME ZONE NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS subscriptions_deleted_at_idx ON subscriptions_deleted (deleted_at);
+                -- payment receipts, one per photo (file_unique_id is the same for every re-send)
+                CREATE TABLE IF NOT EXISTS payments (
+                  id TEXT PRIMARY KEY,
+                  uid TEXT NOT NULL,
+                  name TEXT,
+                  file_id TEXT NOT NULL,
+                  months INTEGER,
+                  received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                  status TEXT NOT NULL DEFAULT 'pending',
+                  digested_at TIMESTAMP WITH TIME ZONE,
+                  decided_at TIMESTAMP WITH TIME ZONE
+                );
+                CREATE INDEX IF NOT EXISTS payments_pending_idx ON payments (received_at) WHERE status = 'pending';
+                """
+            )
+            # Row changes are announced to every worker's status cache (see PgListener).
+            # Workers run this concurrently at boot; the lock keeps the DDL from racing.
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('subscriptions_notify'))")
+            cur.execute(
+                """
+                CREATE OR REPLACE FUNCTION subscriptions_notify() RETURNS trigger AS $$
+                BEGIN
+                  PERFORM pg_notify('%s', COALESCE(NEW.uid, OLD.uid));
+                  RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+                DROP TRIGGER IF EXISTS subscriptions_notify ON subscriptions;
+                CREATE TRIGGER subscriptions_notify AFTER INSERT OR DELETE OR UPDATE OF expiry ON subscriptions
+                  FOR EACH ROW EXECUTE FUNCTION subscriptions_notify();
+                """ % SUBS_CHANNEL
+            )
+            cur.execute(
+                """
+                CREATE OR REPLACE FUNCTION subscriptions_touch() RETURNS trigger AS $$
+                BEGIN
+                  NEW.updated_at := clock_timestamp();
+                  IF TG_OP = 'INSERT' THEN
+                    DELETE FROM subscriptions_deleted WHERE uid = NEW.uid;
+                  END IF;
+                  RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+                DROP TRIGGER IF EXISTS subscriptions_touch ON subscriptions;
+                CREATE TRIGGER subscriptions_touch BEFORE INSERT OR UPDATE OF expiry, note ON subscriptions
+                  FOR EACH ROW EXECUTE FUNCTION subscriptions_touch();
+
+                CREATE OR REPLACE FUNCTION subscriptions_tombstone() RETURNS trigger AS $$
+                BEGIN
+                  INSERT INTO subscriptions_deleted (uid, deleted_at) VALUES (OLD.uid, clock_timestamp())
+                    ON CONFLICT (uid) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+                  RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+                DROP TRIGGER IF EXISTS subscriptions_tombstone ON subscriptions;
+                CREATE TRIGGER subscriptions_tombstone AFTER DELETE ON subscriptions
+                  FOR EACH ROW EXECUTE FUNCTION subscriptions_tombstone();
                 """
             )
             conn.commit()
 
-if DATABASE_URL and psycopg2 is not None:
-    init_db()
+# JSON fallback storage: loaded once, mutated in memory, persisted either by
+# background full rewrites ("memory") or by an append-only log ("journal").
+# Several processes must share one journal under a file lock ("shared"): web
+# workers, and the polling.py worker next to the web process (TG_UPDATES=polling).
+if not USE_DB and SUBS_STORAGE != 'shared' and (WEB_CONCURRENCY > 1 or TG_UPDATES == 'polling'):
+    logging.warning('%s: using SUBS_STORAGE=shared instead of %s',
+                    'WEB_CONCURRENCY=%d' % WEB_CONCURRENCY if WEB_CONCURRENCY > 1 else 'TG_UPDATES=polling',
+                    SUBS_STORAGE)
+    SUBS_STORAGE = 'shared'
+if SUBS_STORAGE == 'shared':
+    store = SharedJournalStore(SUBS_JSON, max_log_bytes=SUBS_LOG_MAX_BYTES, fsync=SUBS_FSYNC)
+elif SUBS_STORAGE == 'binary':
+    store = BinaryJournalStore(SUBS_BIN, max_log_bytes=SUBS_LOG_MAX_BYTES, fsync=SUBS_FSYNC)
+elif SUBS_STORAGE == 'journal':
+    store = JournalStore(SUBS_JSON, max_log_bytes=SUBS_LOG_MAX_BYTES, fsync=SUBS_FSYNC)
 else:
-    print("DATABASE_URL not set or psycopg2 missing; skipping DB init")
-
-# JSON fallback storage
-
-def load_json():
-    try:
-        with open(SUBS_JSON, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-    except Exception as e:
-        print('Failed to load subscriptions.json:', e)
-        return {}
+    store = SubscriptionStore(SUBS_JSON, flush_delay=SUBS_FLUSH_DELAY, fsync=SUBS_FSYNC)
+
+# Payment receipts keyed by file_unique_id, persisted the same way (the binary
+# format only fits subscriptions, so that mode journals them as JSON)
+if SUBS_STORAGE == 'shared':
+    payments_store = SharedJournalStore(PAYMENTS_JSON, max_log_bytes=SUBS_LOG_MAX_BYTES, fsync=SUBS_FSYNC)
+elif SUBS_STORAGE in ('journal', 'binary'):
+    payments_store = JournalStore(PAYMENTS_JSON, max_log_bytes=SUBS_LOG_MAX_BYTES, fsync=SUBS_FSYNC)
+else:
+    payments_store = SubscriptionStore(PAYMENTS_JSON, flush_delay=SUBS_FLUSH_DELAY, fsync=SUBS_FSYNC)
+# status() can wait on I/O or another process: Postgres, the journal's flock
+# and log catch-up (shared), mapped snapshot pages (binary). Only the plain
+# in-memory store answers without a thread in aioserver.py.
+STATUS_BLOCKS = USE_DB or isinstance(store, JournalStore)
 
+# id -> received_at of receipts still waiting for a decision
+pending_payments = {}
 
-def save_json(data: dict):
-    try:
-        with open(SUBS_JSON, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print('Failed to save subscriptions.json:', e)
 
+def _track_pending(pid: str, old, new):
+    if new is not None and new.get('status') == PENDING:
+        pending_payments[pid] = new.get('received_at') or ''
+    else:
+        pending_payments.pop(pid, None)
 
-def file_list_subs():
-    data = load_json()
-    out = []
-    for uid, v in data.items():
-        out.append({
-            'uid': uid,
-            'expiry': v.get('expiry'),
-            'note': v.get('note', '')
-        })
-    return out
+# Upcoming reminder/expiry events, kept in step with the store
+expiry_heap = ExpiryHeap(REMIND_DAYS, SWEEP_LOOKBACK_DAYS)
+# Expiry dates as an int64 column for /api/stats
+expiry_columns = ExpiryColumns()
+# Which uids changed when, for /api/subscriptions/changes
+change_feed = ChangeFeed(CHANGES_FEED_SIZE)
 
 
-def file_set_days(uid: str, new_days: int, note: str = None):
-    data = load_json()
+def _extended_expiry(expiry_str, days: int) -> str:
+    # New expiry counts from the old one if it is still in the future
     now = datetime.utcnow()
-    v = data.get(uid) or {}
-    expiry_str = v.get('expiry')
     base = now
     if expiry_str:
         try:
@@ -150,61 +351,158 @@ def file_set_days(uid: str, new_days: int, note: str = None):
             base = old if old > now else now
         except Exception:
             base = now
-    new_expiry = base + timedelta(days=new_days)
-    v['expiry'] = new_expiry.replace(microsecond=0).isoformat()
-    if note is not None:
-        v['note'] = note
-    elif 'note' not in v:
-        v['note'] = ''
-    data[uid] = v
-    save_json(data)
+    return (base + timedelta(days=days)).replace(microsecond=0).isoformat()
+
+
+def file_list_subs():
+    return [
+        {
+            'uid': uid,
+            'expiry': v.get('expiry'),
+            'note': v.get('note', '')
+        }
+        for uid, v in store.items()
+    ]
+
+
+def _file_matches(query: listing.ListQuery, after=None):
+    """(sort key, uid, record) for each record matching the query filters, in
+    store order; with ``after``, only those past that sort key in query order"""
+    now = datetime.utcnow().replace(microsecond=0)
+    lower, upper = query.bounds(now)
+    lo = lower.isoformat() if lower else None
+    hi = upper.isoformat() if upper else None
+    needle = query.q.lower() if query.q else None
+    # ISO strings written by this module sort chronologically as plain strings
+    by_uid = query.key == 'uid'
+    for uid, v in store.items():
+        expiry = v.get('expiry')
+        if lo is not None and not (expiry and expiry > lo):
+            continue
+        if hi is not None and expiry and expiry > hi:
+            continue
+        if needle is not None and needle not in (v.get('note') or '').lower():
+            continue
+        key = ('', uid) if by_uid else (expiry or '', uid)
+        if after is not None and (key >= after if query.desc else key <= after):
+            continue
+        yield key, uid, v
+
+
+def _file_row(uid: str, v: dict) -> dict:
+    return {'uid': uid, 'expiry': v.get('expiry'), 'note': v.get('note', '')}
+
+
+def file_list_page(query: listing.ListQuery) -> dict:
+    after = None
+    if query.after is not None:
+        key, uid = query.after
+        after = ('', uid) if query.key == 'uid' else (key or '', uid)
+    # One pass keeping the limit + 1 next rows, instead of sorting them all
+    pick = heapq.nlargest if query.desc else heapq.nsmallest
+    top = pick(query.limit + 1, _file_matches(query, after), key=itemgetter(0))
+    return listing.page_result([_file_row(uid, v) for _, uid, v in top], query)
+
+
+def file_iter_subs(query: listing.ListQuery):
+    matches = sorted(_file_matches(query), key=itemgetter(0), reverse=query.desc)
+    for _, uid, v in matches:
+        yield _file_row(uid, v)
+
+
+def file_set_days(uid: str, new_days: int, note: str = None):
+    with store.lock:
+        v = dict(store.get(uid) or {})
+        v['expiry'] = _extended_expiry(v.get('expiry'), new_days)
+        if note is not None:
+            v['note'] = note
+        elif 'note' not in v:
+            v['note'] = ''
+        store.put(uid, v)
+    return v['expiry']
 
 
 def file_add_days(uid: str, add_days: int):
-    data = load_json()
-    if uid not in data:
-        raise ValueError('Foydalanuvchi topilmadi')
-    now = datetime.utcnow()
-    expiry_str = data[uid].get('expiry')
-    base = now
-    if expiry_str:
-        try:
-            old = datetime.fromisoformat(expiry_str)
-            base = old if old > now else now
-        except Exception:
-            base = now
-    new_expiry = base + timedelta(days=add_days)
-    data[uid]['expiry'] = new_expiry.replace(microsecond=0).isoformat()
-    save_json(data)
+    with store.lock:
+        v = store.get(uid)
+        if v is None:
+            raise ValueError('Foydalanuvchi topilmadi')
+        expiry = _extended_expiry(v.get('expiry'), add_days)
+        store.put(uid, dict(v, expiry=expiry))
+    return expiry
 
 
 def file_reset(uid: str):
-    data = load_json()
-    if uid not in data:
-        raise ValueError('Foydalanuvchi topilmadi')
-    data[uid]['expiry'] = datetime.utcnow().replace(microsecond=0).isoformat()
-    save_json(data)
+    with store.lock:
+        v = store.get(uid)
+        if v is None:
+            raise ValueError('Foydalanuvchi topilmadi')
+        expiry = datetime.utcnow().replace(microsecond=0).isoformat()
+        store.put(uid, dict(v, expiry=expiry))
+    return expiry
 
 
 def file_set_note(uid: str, note: str):
-    data = load_json()
-    if uid not in data:
-        raise ValueError('Foydalanuvchi topilmadi')
-    data[uid]['note'] = note
-    save_json(data)
+    with store.lock:
+        v = store.get(uid)
+        if v is None:
+            raise ValueError('Foydalanuvchi topilmadi')
+        store.put(uid, dict(v, note=note))
+    return v.get('expiry')
 
 
 def file_delete(uid: str):
-    data = load_json()
-    if uid not in data:
+    if not store.remove(uid):
         raise ValueError('Foydalanuvchi topilmadi')
-    del data[uid]
-    save_json(data)
+
+
+def file_bulk(items: list) -> list:
+    """Apply bulk items in order under one lock, as one store batch: a single
+    rewrite in memory mode, one log write and fsync in the journal modes"""
+    results = [None] * len(items)
+    ops = {
+        'set': lambda it: file_set_days(it['uid'], it['days'], it['note']),
+        'add': lambda it: file_add_days(it['uid'], it['days']),
+        'reset': lambda it: file_reset(it['uid']),
+        'note': lambda it: file_set_note(it['uid'], it['note']),
+        'delete': lambda it: file_delete(it['uid']),
+    }
+    with store.batch():
+        for item in items:
+            if item['error'] is not None:
+                results[item['idx']] = bulk.result(item, error=item['error'])
+                continue
+            try:
+                ops[item['op']](item)
+            except ValueError as e:
+                results[item['idx']] = bulk.result(item, error=str(e))
+                continue
+            v = store.get(item['uid'])
+            results[item['idx']] = bulk.result(item, expiry=v.get('expiry') if v else None)
+    return results
+
+
+def file_claim_due(limit: int) -> list:
+    """Pop due expiry events and mark them as notified in the records"""
+    with store.lock:
+        due = expiry_heap.pop_due(datetime.utcnow(), limit)
+        claimed = []
+        for uid, expiry, stage in due:
+            v = store.get(uid)
+            if v is None or v.get(MARK_FIELDS[stage]) == expiry:
+                continue  # deleted meanwhile, or another worker sent it already
+            store.put(uid, dict(v, **{MARK_FIELDS[stage]: expiry}))
+            claimed.append((uid, expiry, stage))
+    return claimed
 
 
 def file_status(uid: str):
-    data = load_json()
-    v = data.get(uid)
+    if isinstance(store, BinaryJournalStore):
+        # One int64 off the mapping: no record dict, no ISO parsing
+        expiry = store.expiry_seconds(uid)
+        days_left = max(0, int((expiry - time.time()) // 86400)) if expiry is not None else 0
+        return {'subscribed': days_left > 0, 'days_left': days_left}
+    v = store.get(uid)
     if not v or not v.get('expiry'):
         return {'subscribed': False, 'days_left': 0}
     try:
@@ -216,62 +514,534 @@ def file_status(uid: str):
     return {'subscribed': days_left > 0, 'days_left': days_left}
 
 
+def file_changes(since: int) -> dict:
+    version = change_feed.token()
+    store.sync()
+    found = change_feed.since(since, CHANGES_LIMIT)
+    if found is None:
+        return {'version': version, 'reset': True, 'changed': [], 'deleted': []}
+    uids, deleted = found
+    changed = []
+    for uid in uids:
+        v = store.get(uid)
+        if v is None:
+            deleted.append(uid)  # removed since; its own change is newer than version
+        else:
+            changed.append({'uid': uid, 'expiry': v.get('expiry'), 'note': v.get('note', '')})
+    return {'version': version, 'reset': False, 'changed': changed, 'deleted': deleted}
+
+
+def file_list_etag() -> str:
+    store.sync()
+    return 'json-%d-%d' % (change_feed.floor, change_feed.latest())
+
+
+def file_record_payments(receipts: list) -> list:
+    inserted = []
+    with payments_store.lock:
+        for r in receipts:
+            if payments_store.get(r['id']) is None:
+                payments_store.put(r['id'], dict(r, status=PENDING))
+                inserted.append(r['id'])
+    return inserted
+
+
+def _file_pending(limit: int = None, undigested: bool = False) -> list:
+    out = []
+    payments_store.sync()
+    for pid, _ in sorted(pending_payments.items(), key=lambda item: item[1]):
+        p = payments_store.get(pid)
+        if p is None or p.get('status') != PENDING or (undigested and p.get('digested_at')):
+            continue
+        out.append(p)
+        if limit is not None and len(out) >= limit:
+            break
+    return out
+
+
+def file_claim_digest(limit: int) -> list:
+    now = datetime.utcnow().replace(microsecond=0).isoformat()
+    with payments_store.lock:
+        claimed = _file_pending(limit, undigested=True)
+        for p in claimed:
+            payments_store.put(p['id'], dict(p, digested_at=now))
+    return claimed
+
+
+def file_release_digest(ids: list):
+    with payments_store.lock:
+        for pid in ids:
+            p = payments_store.get(pid)
+            if p is not None and p.get('status') == PENDING and p.get('digested_at'):
+                payments_store.put(pid, dict(p, digested_at=None))
+
+
+def file_list_payments(status: str) -> list:
+    if status == PENDING:
+        return _file_pending()
+    rows = [p for _, p in payments_store.items() if p.get('status') == status]
+    rows.sort(key=lambda p: p.get('received_at') or '', reverse=True)
+    return rows
+
+
+def _file_apply_payment(p: dict):
+    """Write the expiry an approval settled on (idempotent), then mark it approved"""
+    with store.lock:
+        v = dict(store.get(p['uid']) or {'note': ''})
+        if v.get('expiry') != p['expiry']:
+            store.put(p['uid'], dict(v, expiry=p['expiry']))
+    payments_store.put(p['id'], dict(p, status=APPROVED,
+                                     decided_at=datetime.utcnow().replace(microsecond=0).isoformat()))
+
+
+def file_approve_payment(pid: str, months: int = None) -> dict:
+    # No transactions here: the new expiry is journaled with the payment first
+    # (APPROVING), so an approval cut short is finished on the next load
+    with payments_store.lock:
+        p = payments_store.get(pid)
+        if p is None:
+            raise LookupError('To‘lov topilmadi')
+        if p.get('status') != PENDING:
+            raise ValueError('To‘lov allaqachon ko‘rib chiqilgan')
+        months = months or p.get('months')
+        if not months:
+            raise ValueError('Tarif (oylar soni) ko‘rsatilsin')
+        with store.lock:
+            expiry = _extended_expiry((store.get(p['uid']) or {}).get('expiry'), months * DAYS_PER_MONTH)
+            p = dict(p, status=APPROVING, months=months, expiry=expiry)
+            payments_store.put(pid, p)
+            _file_apply_payment(p)
+    return {'id': pid, 'uid': p['uid'], 'months': months, 'expiry': expiry}
+
+
+def file_reject_payment(pid: str) -> dict:
+    with payments_store.lock:
+        p = payments_store.get(pid)
+        if p is None:
+            raise LookupError('To‘lov topilmadi')
+        if p.get('status') != PENDING:
+            raise ValueError('To‘lov allaqachon ko‘rib chiqilgan')
+        payments_store.put(pid, dict(p, status=REJECTED,
+                                     decided_at=datetime.utcnow().replace(microsecond=0).isoformat()))
+    return {'id': pid, 'uid': p['uid']}
+
+
+def file_stats(months: int) -> dict:
+    counts = expiry_columns.counts(datetime.utcnow().replace(microsecond=0), months)
+    return analytics.report(plans=PLANS, **counts)
+
+
 # Generic dispatchers
 
+# Read-through cache for status(); every mutating dispatcher invalidates its uid
+status_cache = TTLCache(maxsize=STATUS_CACHE_MAX, ttl=STATUS_CACHE_TTL)
+
+
+def _on_subs_notify(payload: str):
+    if payload == '*':
+        status_cache.clear()
+    else:
+        status_cache.invalidate(payload)
+
+
+# Other workers' writes: Postgres NOTIFY (started with the background work),
+# or the shared journal's listeners (attached when the store is loaded)
+subs_listener = None
+
+_storage_lock = Lock()
+_storage_loaded = False
+
+
+def _subscribe_index(on_change, load_columns):
+    if isinstance(store, BinaryJournalStore):
+        # Built straight from the snapshot's int64 columns, not a decoded dict per record
+        store.subscribe(on_change, columns=load_columns)
+    else:
+        store.subscribe(on_change)
+
+
+def init_storage():
+    """Load the JSON store and attach its indexes, once (no-op with Postgres).
+
+    Local and needed by the very first request, so it runs in the foreground:
+    in the gunicorn master under --preload, so workers share the pages.
+    """
+    global _storage_loaded
+    if USE_DB or _storage_loaded:
+        return
+    with _storage_lock:
+        if _storage_loaded:
+            return
+        print("DATABASE_URL not set or psycopg2 missing; using JSON storage")
+        if SUBS_STORAGE == 'binary' and not os.path.exists(SUBS_BIN) and any(
+                os.path.exists(p) for p in (SUBS_JSON, SUBS_JSON + '.log', SUBS_JSON + '.log.1')):
+            # A journal that was never compacted is all log: convert that too
+            logging.info('Converting %s (snapshot + log) to %s', SUBS_JSON, SUBS_BIN)
+            import_json(SUBS_JSON, SUBS_BIN)
+        store.load()
+        _subscribe_index(expiry_heap.on_change, expiry_heap.load_columns)
+        _subscribe_index(expiry_columns.on_change, expiry_columns.load_columns)
+        store.subscribe(change_feed.on_change, replay=False)
+        payments_store.load()
+        payments_store.subscribe(_track_pending)
+        for _, p in payments_store.items():
+            if p.get('status') == APPROVING:
+                logging.warning('Finishing interrupted approval of payment %s', p['id'])
+                _file_apply_payment(p)
+        store.subscribe(lambda uid, old, new: status_cache.invalidate(uid), replay=False)
+        _storage_loaded = True
+
+STORAGE_SECONDS = Histogram('storage_call_duration_seconds', 'Storage dispatcher latency by operation and backend',
+                            ('op', 'backend'))
+STORAGE_ERRORS = Counter('storage_call_errors_total', 'Storage dispatcher calls that raised',
+                         ('op', 'backend'))
+
+
+def _storage_backend() -> str:
+    return 'postgres' if USE_DB else 'json'
+
+
+def storage_op(name: str):
+    """Storage dispatcher: timed by op and backend, and a "<backend>.<op>" phase of the current trace"""
+    timed = metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, name, _storage_backend)
+    phases = {backend: '%s.%s' % (backend, name) for backend in ('postgres', 'json')}
+
+    def wrap(fn):
+        fn = timed(fn)
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with profiling.span(phases[_storage_backend()]):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+@storage_op('list_subs')
 def list_subs():
     return db_list_subs() if USE_DB else file_list_subs()
 
+
+@storage_op('list_page')
+def list_page(query: listing.ListQuery) -> dict:
+    return db_list_page(query) if USE_DB else file_list_page(query)
+
+
+def iter_subs(query: listing.ListQuery):
+    """All rows matching the query, streamed in order (server-side cursor in Postgres)"""
+    return db_iter_subs(query) if USE_DB else file_iter_subs(query)
+
+
+@storage_op('bulk_apply')
+def bulk_apply(items: list) -> list:
+    """Apply parsed bulk items (see bulk.parse_items); returns per-item results"""
+    try:
+        return db_bulk(items) if USE_DB else file_bulk(items)
+    finally:
+        for item in items:
+            if item['uid'] is not None:
+                status_cache.invalidate(item['uid'])
+
+
+@storage_op('claim_due')
+def claim_due(limit: int = SWEEP_BATCH) -> list:
+    """Due expiry notices [(uid, expiry, stage)], each claimed exactly once"""
+    return db_claim_due(limit) if USE_DB else file_claim_due(limit)
+
+
+@storage_op('set_days')
 def set_days(uid: str, days: int, note: str = None):
-    return db_set_days(uid, days, note) if USE_DB else file_set_days(uid, days, note)
+    try:
+        return db_set_days(uid, days, note) if USE_DB else file_set_days(uid, days, note)
+    finally:
+        status_cache.invalidate(uid)
 
 
+@storage_op('add_days')
 def add_days(uid: str, add: int):
-    return db_add_days(uid, add) if USE_DB else file_add_days(uid, add)
+    try:
+        return db_add_days(uid, add) if USE_DB else file_add_days(uid, add)
+    finally:
+        status_cache.invalidate(uid)
 
 
+@storage_op('reset')
 def reset(uid: str):
-    return db_reset(uid) if USE_DB else file_reset(uid)
+    try:
+        return db_reset(uid) if USE_DB else file_reset(uid)
+    finally:
+        status_cache.invalidate(uid)
 
 
+@storage_op('set_note')
 def set_note(uid: str, note: str):
-    return db_set_note(uid, note) if USE_DB else file_set_note(uid, note)
+    try:
+        return db_set_note(uid, note) if USE_DB else file_set_note(uid, note)
+    finally:
+        status_cache.invalidate(uid)
 
 
+@storage_op('delete')
 def delete(uid: str):
-    return db_delete(uid) if USE_DB else file_delete(uid)
+    try:
+        return db_delete(uid) if USE_DB else file_delete(uid)
+    finally:
+        status_cache.invalidate(uid)
 
 
+@storage_op('status')
 def status(uid: str):
-    return db_status(uid) if USE_DB else file_status(uid)
+    if not USE_DB:
+        store.sync()  # one stat(); replays other workers' writes into the cache listener
+    return status_cache.get_or_load(uid, db_status if USE_DB else file_status)
+
+
+@storage_op('changes')
+def changes(since: int) -> dict:
+    """Rows changed and uids deleted after version ``since``, plus the version
+    to ask from next time; ``reset`` means reload the whole list instead"""
+    return db_changes(since) if USE_DB else file_changes(since)
+
+
+def list_etag():
+    """ETag of the full list without building it; None: hash the response instead"""
+    # Postgres: a later commit can carry an older updated_at, so max(updated_at) can't tell
+    return None if USE_DB else file_list_etag()
+
+
+def page_etag(query: listing.ListQuery, query_string: bytes):
+    """ETag of a list page without building it; None: hash the response instead"""
+    tag = list_etag()
+    # State filters compare against the clock: the same data gives another page later
+    if tag is None or query.state is not None:
+        return None
+    return '%s-%s' % (tag, hashlib.sha1(query_string).hexdigest()[:16])
+
+
+def status_etag(st: dict) -> str:
+    """Two users with the same status get the same body, so the ETag is the status itself"""
+    return 's%d-%d' % (st['subscribed'], st['days_left'])
+
+
+@storage_op('record_payments')
+def record_payments(receipts: list) -> list:
+    """Store new receipts; returns the ids inserted (the rest were duplicates)"""
+    return db_record_payments(receipts) if USE_DB else file_record_payments(receipts)
+
+
+@storage_op('claim_digest')
+def claim_digest(limit: int = PAYMENT_BATCH) -> list:
+    """Pending receipts the admin hasn't been sent yet, each handed out once"""
+    return db_claim_digest(limit) if USE_DB else file_claim_digest(limit)
+
+
+@storage_op('release_digest')
+def release_digest(ids: list):
+    """Undo claim_digest for receipts whose digest wasn't sent, so the next round retries them"""
+    return db_release_digest(ids) if USE_DB else file_release_digest(ids)
+
+
+@storage_op('list_payments')
+def list_payments(status: str = PENDING) -> list:
+    return db_list_payments(status) if USE_DB else file_list_payments(status)
+
+
+@storage_op('approve_payment')
+def approve_payment(pid: str, months: int = None) -> dict:
+    """Mark a pending receipt approved and add its months to the payer, atomically"""
+    result = db_approve_payment(pid, months) if USE_DB else file_approve_payment(pid, months)
+    status_cache.invalidate(result['uid'])
+    return result
+
+
+@storage_op('reject_payment')
+def reject_payment(pid: str) -> dict:
+    return db_reject_payment(pid) if USE_DB else file_reject_payment(pid)
+
+
+@storage_op('stats')
+def stats(months: int = 12) -> dict:
+    """Dashboard numbers, see analytics.report"""
+    if not USE_DB:
+        store.sync()
+    return db_stats(months) if USE_DB else file_stats(months)
+
+# -------------- Background tasks --------------
+async def notify_expiry(uid: str, stage: str, expiry: str) -> bool:
+    return await telegram().notify_expiry(uid, stage, expiry)
+
+
+async def send_digest(receipts: list):
+    await telegram().send_digest(receipts)
+
+
+sweeper = Sweeper(claim_due, notify_expiry, interval=SWEEP_INTERVAL)
+payment_intake = PaymentIntake(record_payments, claim_digest, send_digest, release=release_digest,
+                               interval=PAYMENT_DIGEST_INTERVAL, batch=PAYMENT_BATCH)
+# atexit is LIFO: these run before updates.stop closes the loop
+atexit.register(sweeper.stop)
+atexit.register(payment_intake.stop)
+atexit.register(stop_sender)
+
+# Schema checks and the bot import run after the port is bound; /_ready tells when they're done
+startup = Startup()
+if USE_DB:
+    startup.add('schema', init_db)
+    # DB_POOL_MIN connections opened in each worker after fork, not by its first requests
+    startup.add('db_pool', lambda: get_pool().warmup())
+startup.add('bot', telegram)
+
+
+BROADCAST_MAX_TEXT = 4096  # Telegram message length limit
+
+
+def parse_broadcast(data) -> tuple:
+    """(text, ListQuery selecting the recipients) from a /api/broadcast body"""
+    data = data if isinstance(data, dict) else {}
+    text = (data.get('text') or '').strip()
+    if not text:
+        raise ValueError("Matn kiritilmadi")
+    if len(text) > BROADCAST_MAX_TEXT:
+        raise ValueError('Matn %d belgidan oshmasin' % BROADCAST_MAX_TEXT)
+    query = listing.parse_query({'state': data.get('state') or '', 'within': data.get('within', 7)})
+    return text, query
+
+
+def start_broadcast(text: str, query: listing.ListQuery) -> dict:
+    """Queue text to every subscriber matching query on the outbound sender"""
+    uids = [row['uid'] for row in iter_subs(query)]
+    return updates.run(telegram().broadcast(uids, text), 30)
+
+
+def start_background(setup_webhook: bool = False):
+    """Start per-process background work (after fork, never at import).
+
+    setup_webhook: also register the Telegram webhook - in one process only
+    (``python server.py``, or the first gunicorn worker, see gunicorn.conf.py).
+    """
+    global subs_listener
+    init_storage()
+    if setup_webhook:
+        startup.add('webhook', register_webhook)
+    startup.start()
+    if SWEEP_ENABLED:
+        sweeper.start(updates.loop)
+    payment_intake.start(updates.loop)
+    if USE_DB:
+        if subs_listener is None:
+            from invalidation import PgListener
+            subs_listener = PgListener(database_dsn(), SUBS_CHANNEL, _on_subs_notify, on_reset=status_cache.clear)
+        subs_listener.start()
+
+
+# Read and compressed once per process, in create_app()
+admin_page = responses.StaticPage(os.path.join(STATIC_DIR, 'admin.html'), max_age=STATIC_MAX_AGE)
+login_page = responses.StaticPage(os.path.join(BASE_DIR, 'login.html'), max_age=STATIC_MAX_AGE)
+
+
+def create_app() -> Flask:
+    """WSGI app factory: ``gunicorn 'server:create_app()'``. Importing this
+    module does no I/O; the JSON store and static pages are loaded here, the rest in the background."""
+    init_storage()
+    admin_page.load()
+    login_page.load()
+    return app
+
+
+@app.before_request
+def _ensure_background():
+    start_background()
+
 
 # -------------- Static pages --------------
+def _static(page: responses.StaticPage):
+    code, headers, body = page.respond(request.headers.get('Accept-Encoding', ''),
+                                       request.headers.get('If-None-Match', ''))
+    return Response(body, status=code, headers=headers)
+
+
 @app.route('/admin.html')
 def serve_admin():
-    return send_file(os.path.join(STATIC_DIR, 'admin.html'))
+    return _static(admin_page)
 
 
 @app.route('/login.html')
 def serve_login():
-    return send_file(os.path.join(BASE_DIR, 'login.html'))
+    return _static(login_page)
+
+
+# -------------- Auth (Telegram Login Widget, API tokens) --------------
+if API_AUTH and not TOKEN_SECRET:
+    # A key anyone can read in the source would let them sign admin tokens
+    raise RuntimeError("TOKEN_SECRET (yoki FLASK_SECRET) o‘rnatilmagan: API_AUTH uchun maxfiy kalit kerak "
+                       "(faqat lokal ishlab chiqishda API_AUTH=0)")
+# Both keys are derived once per process, not per request; without API_AUTH tokens aren't checked
+_LOGIN_KEY = tokens.login_key(BOT_TOKEN)
+token_signer = tokens.TokenSigner(tokens.derive_key(TOKEN_SECRET or os.urandom(32).hex()),
+                                  cache_size=TOKEN_CACHE_SIZE)
+TOKEN_COOKIE = 'api_token'
+# A subscriber token may call these (for its own uid); the rest of /api needs an admin token
+SUBSCRIBER_ROUTES = ('/api/subscription/status',)
 
 
-# -------------- Auth (Telegram Login Widget) --------------
 def check_auth(data):
-    auth_data = dict(data)
-    hash_to_check = auth_data.pop('hash', None)
-    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(auth_data.items()))
-    secret_key = hashlib.sha256(BOT_TOKEN.encode()).digest()
-    hmac_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
-    return hmac_hash == hash_to_check
+    return tokens.check_login(data, _LOGIN_KEY, LOGIN_MAX_AGE)
+
+
+def login_token(data) -> tuple:
+    """(token, role, ttl) for a user who passed check_auth"""
+    uid = str(data['id'])
+    role = tokens.ADMIN if ADMIN_ID is not None and uid == str(ADMIN_ID) else tokens.SUBSCRIBER
+    ttl = ADMIN_TOKEN_TTL if role == tokens.ADMIN else SUBSCRIBER_TOKEN_TTL
+    return token_signer.issue(uid, role, ttl), role, ttl
+
+
+def authorize(route: str, header: str, cookie: str) -> tuple:
+    """(claims, None), or (None, (error, HTTP status)) for an /api route"""
+    claims = token_signer.verify(tokens.bearer(header) or cookie or '')
+    if claims is None:
+        return None, ('Avtorizatsiya talab qilinadi', 401)
+    if claims.role != tokens.ADMIN and route not in SUBSCRIBER_ROUTES:
+        return None, ("Ruxsat yo‘q", 403)
+    return claims, None
+
+
+def status_uid(tg_id, claims, session_uid):
+    """uid a status request is about; PermissionError: a subscriber asking about someone else.
+    session_uid() reads the login session, only needed without tokens"""
+    if claims is None:  # API_AUTH off
+        return tg_id or session_uid()
+    if claims.role == tokens.ADMIN:
+        return tg_id or claims.uid
+    if tg_id and str(tg_id) != claims.uid:
+        raise PermissionError("Ruxsat yo‘q")
+    return claims.uid
+
+
+@app.before_request
+def _require_token():
+    if not API_AUTH or request.method == 'OPTIONS' or not request.path.startswith('/api/'):
+        return None
+    route = request.url_rule.rule if request.url_rule is not None else request.path
+    g.token, error = authorize(route, request.headers.get('Authorization'), request.cookies.get(TOKEN_COOKIE))
+    if error is not None:
+        return jsonify({'error': error[0]}), error[1]
 
 
 @app.route("/auth")
 def auth():
-    if check_auth(request.args):
-        session['tg_id'] = request.args['id']
-        session['username'] = request.args.get('username', '')
-        return f"Xush kelibsiz, {session['username'] or session['tg_id']}!"
-    return "Auth xatosi"
+    if not check_auth(request.args):
+        return "Auth xatosi"
+    session['tg_id'] = request.args['id']
+    session['username'] = request.args.get('username', '')
+    token, role, ttl = login_token(request.args)
+    if role == tokens.ADMIN:
+        resp = redirect('/admin.html')
+    else:
+        resp = make_response(f"Xush kelibsiz, {session['username'] or session['tg_id']}!")
+    # Sent with same-origin API calls (admin.html, the export link); other clients use it as a Bearer token
+    resp.set_cookie(TOKEN_COOKIE, token, max_age=ttl, httponly=True, samesite='Lax', secure=request.is_secure)
+    return resp
 
 
 @app.route("/")
@@ -283,6 +1053,7 @@ def index():
 
 # -------------- DB helpers --------------
 def db_list_subs():
+    import psycopg2.extras
     with get_conn() as conn:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
             cur.execute("SELECT uid, expiry, note FROM subscriptions")
@@ -290,81 +1061,209 @@ def db_list_subs():
             return [
                 {
                     'uid': r['uid'],
-                    'expiry': r['expiry'].replace(microsecond=0).isoformat() if r['expiry'] else None,
+                    'expiry': _db_iso(r['expiry']),
                     'note': r['note']
                 }
                 for r in rows
             ]
 
 
-def db_set_days(uid: str, new_days: int, note: str = None):
-    # Sets subscription to now + days, or extends if already active
+def _db_iso(expiry):
+    return expiry.replace(microsecond=0).isoformat() if expiry else None
+
+
+def _db_row(r) -> dict:
+    return {
+        'uid': r[0],
+        'expiry': _db_iso(r[1]),
+        'note': r[2]
+    }
+
+
+def _db_filters(query: listing.ListQuery):
+    """WHERE clauses and params for the query filters (without the keyset position)"""
+    clauses, params = [], []
+    if query.state == 'active':
+        clauses.append("expiry > now()")
+    elif query.state == 'expired':
+        clauses.append("(expiry IS NULL OR expiry <= now())")
+    elif query.state == 'expiring':
+        clauses.append("expiry > now() AND expiry <= now() + %s * interval '1 day'")
+        params.append(query.within)
+    if query.q:
+        needle = query.q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append("note ILIKE %s")
+        params.append('%' + needle + '%')
+    return clauses, params
+
+
+def _db_order(query: listing.ListQuery) -> str:
+    if query.key == 'uid':
+        return "uid DESC" if query.desc else "uid"
+    return "expiry DESC NULLS LAST, uid DESC" if query.desc else "expiry NULLS FIRST, uid"
+
+
+def _db_after(query: listing.ListQuery):
+    """Keyset condition for rows strictly after the cursor, in query order"""
+    key, uid = query.after
+    if query.key == 'uid':
+        return ("uid < %s" if query.desc else "uid > %s"), [uid]
+    if query.desc:
+        if key is None:
+            return "expiry IS NULL AND uid < %s", [uid]
+        return "((expiry, uid) < (%s::timestamptz, %s) OR expiry IS NULL)", [key, uid]
+    if key is None:
+        return "((expiry IS NULL AND uid > %s) OR expiry IS NOT NULL)", [uid]
+    return "(expiry, uid) > (%s::timestamptz, %s)", [key, uid]
+
+
+def db_list_page(query: listing.ListQuery) -> dict:
+    clauses, params = _db_filters(query)
+    if query.after is not None:
+        clause, extra = _db_after(query)
+        clauses.append(clause)
+        params += extra
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    sql = "SELECT uid, expiry, note FROM subscriptions %s ORDER BY %s LIMIT %%s" % (where, _db_order(query))
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT expiry FROM subscriptions WHERE uid=%s", (uid,))
-            row = cur.fetchone()
-            now = datetime.utcnow()
-            base = now
-            if row and row[0]:
-                old_expiry = row[0]
-                if old_expiry > now:
-                    base = old_expiry
-            
-            new_expiry = base + timedelta(days=new_days)
-
-            # Use INSERT ON CONFLICT to handle both new and existing users for expiry
-            cur.execute(
-                """
-                INSERT INTO subscriptions (uid, expiry) VALUES (%s, %s)
-                ON CONFLICT (uid) DO UPDATE SET expiry = EXCLUDED.expiry
-                """,
-                (uid, new_expiry)
-            )
-
-            # If a note is provided, update it. This works for both new and existing users
-            # because the previous query ensures the user exists.
-            if note is not None:
-                cur.execute(
-                    "UPDATE subscriptions SET note=%s WHERE uid=%s",
-                    (note, uid)
-                )
-            conn.commit()
+            cur.execute(sql, params + [query.limit + 1])
+            rows = cur.fetchall()
+    keys = [r[1].isoformat() if r[1] else None for r in rows]
+    return listing.page_result([_db_row(r) for r in rows], query, keys if query.key == 'expiry' else None)
 
 
-def db_add_days(uid: str, add_days: int):
+def db_iter_subs(query: listing.ListQuery):
+    clauses, params = _db_filters(query)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    sql = "SELECT uid, expiry, note FROM subscriptions %s ORDER BY %s" % (where, _db_order(query))
+    with get_conn() as conn:
+        # Named cursor: rows are fetched from the server itersize at a time
+        with conn.cursor(name='subs_export') as cur:
+            cur.itersize = listing.EXPORT_CHUNK
+            cur.execute(sql, params)
+            for r in cur:
+                yield _db_row(r)
+
+
+# Set-based statements for db_bulk, each applied to one wave of unique uids in
+# the bulk_ops temp table. now() is fixed for the whole transaction, so in the
+# upsert EXCLUDED.expiry - now() is exactly the requested number of days.
+_BULK_SQL = {
+    'set': """
+        INSERT INTO subscriptions (uid, expiry, note)
+        SELECT uid, now() + days * interval '1 day', note FROM bulk_ops WHERE op = 'set'
+        ON CONFLICT (uid) DO UPDATE SET
+          expiry = GREATEST(subscriptions.expiry, now()) + (EXCLUDED.expiry - now()),
+          note = COALESCE(EXCLUDED.note, subscriptions.note)
+        RETURNING uid, expiry
+    """,
+    'add': """
+        UPDATE subscriptions s SET expiry = GREATEST(s.expiry, now()) + b.days * interval '1 day'
+        FROM bulk_ops b WHERE b.op = 'add' AND s.uid = b.uid
+        RETURNING s.uid, s.expiry
+    """,
+    'reset': """
+        UPDATE subscriptions s SET expiry = now()
+        FROM bulk_ops b WHERE b.op = 'reset' AND s.uid = b.uid
+        RETURNING s.uid, s.expiry
+    """,
+    'note': """
+        UPDATE subscriptions s SET note = b.note
+        FROM bulk_ops b WHERE b.op = 'note' AND s.uid = b.uid
+        RETURNING s.uid, s.expiry
+    """,
+    'delete': """
+        DELETE FROM subscriptions s USING bulk_ops b
+        WHERE b.op = 'delete' AND s.uid = b.uid
+        RETURNING s.uid, NULL::timestamptz
+    """,
+}
+
+
+def db_bulk(items: list) -> list:
+    results = [None] * len(items)
+    for item in items:
+        if item['error'] is not None:
+            results[item['idx']] = bulk.result(item, error=item['error'])
+    import psycopg2.extras
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT expiry FROM subscriptions WHERE uid=%s", (uid,))
-            row = cur.fetchone()
-            now = datetime.utcnow()
-            base = row[0] if row and row[0] and row[0] > now else now
-            new_expiry = base + timedelta(days=add_days)
             cur.execute(
-                "UPDATE subscriptions SET expiry=%s WHERE uid=%s",
-                (new_expiry, uid)
+                "CREATE TEMP TABLE IF NOT EXISTS bulk_ops "
+                "(uid TEXT PRIMARY KEY, op TEXT, days INT, note TEXT) ON COMMIT DROP"
             )
-            if cur.rowcount == 0:
-                raise ValueError('Foydalanuvchi topilmadi')
+            for wave in bulk.waves(items):
+                cur.execute("TRUNCATE bulk_ops")
+                psycopg2.extras.execute_values(
+                    cur,
+                    "INSERT INTO bulk_ops (uid, op, days, note) VALUES %s",
+                    [(it['uid'], it['op'], it['days'], it['note']) for it in wave],
+                    page_size=1000
+                )
+                by_uid = {it['uid']: it for it in wave}
+                for op in {it['op'] for it in wave}:
+                    cur.execute(_BULK_SQL[op])
+                    for uid, expiry in cur.fetchall():
+                        item = by_uid.pop(uid)
+                        results[item['idx']] = bulk.result(item, expiry=_db_iso(expiry))
+                for item in by_uid.values():
+                    results[item['idx']] = bulk.result(item, error='Foydalanuvchi topilmadi')
             conn.commit()
+    return results
+
+
+def _db_set_days(cur, uid: str, new_days: int, note: str = None):
+    # Sets subscription to now + days, or extends if already active. One atomic
+    # upsert, so two concurrent clicks both count instead of one being lost.
+    cur.execute(
+        """
+        INSERT INTO subscriptions (uid, expiry, note)
+        VALUES (%s, now() + %s * interval '1 day', %s)
+        ON CONFLICT (uid) DO UPDATE SET
+          expiry = GREATEST(subscriptions.expiry, now()) + %s * interval '1 day',
+          note = COALESCE(EXCLUDED.note, subscriptions.note)
+        RETURNING expiry
+        """,
+        (uid, new_days, note, new_days)
+    )
+    return cur.fetchone()[0]
 
 
-def db_reset(uid: str):
+def db_set_days(uid: str, new_days: int, note: str = None):
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("UPDATE subscriptions SET expiry=%s WHERE uid=%s", (datetime.utcnow(), uid))
-            if cur.rowcount == 0:
-                raise ValueError('Foydalanuvchi topilmadi')
+            expiry = _db_set_days(cur, uid, new_days, note)
             conn.commit()
+    return _db_iso(expiry)
 
 
-def db_set_note(uid: str, note: str):
+def _db_update(sql: str, params: tuple):
+    """Run a single-row UPDATE ... RETURNING expiry; ValueError if the uid is unknown"""
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT 1 FROM subscriptions WHERE uid=%s", (uid,))
-            if cur.fetchone() is None:
+            cur.execute(sql, params)
+            row = cur.fetchone()
+            if row is None:
                 raise ValueError('Foydalanuvchi topilmadi')
-            cur.execute("UPDATE subscriptions SET note=%s WHERE uid=%s", (note, uid))
             conn.commit()
+    return _db_iso(row[0])
+
+
+def db_add_days(uid: str, add_days: int):
+    return _db_update(
+        "UPDATE subscriptions SET expiry = GREATEST(expiry, now()) + %s * interval '1 day' "
+        "WHERE uid=%s RETURNING expiry",
+        (add_days, uid)
+    )
+
+
+def db_reset(uid: str):
+    return _db_update("UPDATE subscriptions SET expiry = now() WHERE uid=%s RETURNING expiry", (uid,))
+
+
+def db_set_note(uid: str, note: str):
+    return _db_update("UPDATE subscriptions SET note=%s WHERE uid=%s RETURNING expiry", (note, uid))
 
 
 def db_delete(uid: str):
@@ -376,43 +1275,344 @@ def db_delete(uid: str):
             conn.commit()
 
 
+# Claim due notices through the (expiry, uid) index. SKIP LOCKED lets several
+# workers sweep at once without sending the same notice twice.
+_CLAIM_SQL = {
+    REMIND: """
+        UPDATE subscriptions s SET reminded_for = s.expiry
+        FROM (
+          SELECT uid FROM subscriptions
+          WHERE expiry > now() AND expiry <= now() + %s * interval '1 day'
+            AND reminded_for IS DISTINCT FROM expiry
+          ORDER BY expiry LIMIT %s FOR UPDATE SKIP LOCKED
+        ) due
+        WHERE s.uid = due.uid
+        RETURNING s.uid, s.expiry
+    """,
+    EXPIRED: """
+        UPDATE subscriptions s SET expired_for = s.expiry
+        FROM (
+          SELECT uid FROM subscriptions
+          WHERE expiry <= now() AND expiry > now() - %s * interval '1 day'
+            AND expired_for IS DISTINCT FROM expiry
+          ORDER BY expiry LIMIT %s FOR UPDATE SKIP LOCKED
+        ) due
+        WHERE s.uid = due.uid
+        RETURNING s.uid, s.expiry
+    """,
+}
+
+
+def db_claim_due(limit: int) -> list:
+    due = []
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_CLAIM_SQL[EXPIRED], (SWEEP_LOOKBACK_DAYS, limit))
+            due += [(uid, _db_iso(expiry), EXPIRED) for uid, expiry in cur.fetchall()]
+            cur.execute(_CLAIM_SQL[REMIND], (REMIND_DAYS, limit))
+            due += [(uid, _db_iso(expiry), REMIND) for uid, expiry in cur.fetchall()]
+            conn.commit()
+    return due
+
+
 def db_status(uid: str):
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT expiry FROM subscriptions WHERE uid=%s", (uid,))
+            # Compare against the server clock: expiry is timestamptz (tz-aware)
+            cur.execute("SELECT expiry, now() FROM subscriptions WHERE uid=%s", (uid,))
             row = cur.fetchone()
             if not row or not row[0]:
                 return {'subscribed': False, 'days_left': 0}
-            expiry = row[0]
-            now = datetime.utcnow()
+            expiry, now = row
             days_left = max(0, (expiry - now).days)
             return {'subscribed': days_left > 0, 'days_left': days_left}
 
 
+# Writes are single short transactions; rows committed within this many
+# microseconds before a changes read may be invisible to it, so the version
+# handed back trails the read by that much (and a few rows come back twice)
+CHANGES_SLACK_US = 5 * 1000000
+
+
+def db_changes(since: int) -> dict:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT (extract(epoch FROM clock_timestamp()) * 1000000)::bigint")
+            now = cur.fetchone()[0]
+            version = now - CHANGES_SLACK_US
+            cur.execute("DELETE FROM subscriptions_deleted WHERE deleted_at < now() - make_interval(days => %s)",
+                        (CHANGES_RETENTION_DAYS,))
+            conn.commit()
+            if since < now - CHANGES_RETENTION_DAYS * 86400 * 1000000:
+                return {'version': version, 'reset': True, 'changed': [], 'deleted': []}
+            cur.execute(
+                "SELECT uid, expiry, note FROM subscriptions WHERE updated_at > to_timestamp(%s / 1e6) "
+                "ORDER BY updated_at LIMIT %s", (since, CHANGES_LIMIT + 1))
+            changed = [_db_row(r) for r in cur.fetchall()]
+            cur.execute("SELECT uid FROM subscriptions_deleted WHERE deleted_at > to_timestamp(%s / 1e6) "
+                        "ORDER BY deleted_at LIMIT %s", (since, CHANGES_LIMIT + 1))
+            deleted = [r[0] for r in cur.fetchall()]
+            conn.commit()
+    if len(changed) + len(deleted) > CHANGES_LIMIT:
+        return {'version': version, 'reset': True, 'changed': [], 'deleted': []}
+    return {'version': version, 'reset': False, 'changed': changed, 'deleted': deleted}
+
+
+_PAYMENT_COLUMNS = "id, uid, name, file_id, months, received_at, status, digested_at, decided_at"
+
+
+def _db_payment(r) -> dict:
+    p = dict(zip(_PAYMENT_COLUMNS.split(', '), r))
+    for key in ('received_at', 'digested_at', 'decided_at'):
+        p[key] = _db_iso(p[key])
+    return p
+
+
+def db_record_payments(receipts: list) -> list:
+    import psycopg2.extras
+    rows = [(r['id'], r['uid'], r['name'], r['file_id'], r['months'], r['received_at']) for r in receipts]
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            # The primary key is the dedupe index: re-sent photos are skipped in the same statement
+            inserted = psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO payments (id, uid, name, file_id, months, received_at) VALUES %s "
+                "ON CONFLICT (id) DO NOTHING RETURNING id",
+                rows, template="(%s, %s, %s, %s, %s, %s::timestamp AT TIME ZONE 'UTC')", fetch=True)
+            conn.commit()
+    return [r[0] for r in inserted]
+
+
+def db_claim_digest(limit: int) -> list:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE payments SET digested_at = now() WHERE id IN ("
+                "  SELECT id FROM payments WHERE status = 'pending' AND digested_at IS NULL"
+                "  ORDER BY received_at LIMIT %s FOR UPDATE SKIP LOCKED) "
+                "RETURNING " + _PAYMENT_COLUMNS, (limit,))
+            rows = [_db_payment(r) for r in cur.fetchall()]
+            conn.commit()
+    rows.sort(key=lambda p: p['received_at'])
+    return rows
+
+
+def db_release_digest(ids: list):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE payments SET digested_at = NULL WHERE id = ANY(%s) AND status = 'pending'",
+                        (list(ids),))
+            conn.commit()
+
+
+def db_list_payments(status: str) -> list:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            order = '' if status == PENDING else ' DESC'
+            cur.execute("SELECT " + _PAYMENT_COLUMNS + " FROM payments WHERE status = %s "
+                        "ORDER BY received_at" + order + " LIMIT 1000", (status,))
+            return [_db_payment(r) for r in cur.fetchall()]
+
+
+def _db_pending_payment(cur, pid: str) -> tuple:
+    cur.execute("SELECT uid, months, status FROM payments WHERE id = %s FOR UPDATE", (pid,))
+    row = cur.fetchone()
+    if row is None:
+        raise LookupError('To‘lov topilmadi')
+    if row[2] != PENDING:
+        raise ValueError('To‘lov allaqachon ko‘rib chiqilgan')
+    return row
+
+
+def db_approve_payment(pid: str, months: int = None) -> dict:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            uid, chosen, _ = _db_pending_payment(cur, pid)
+            months = months or chosen
+            if not months:
+                raise ValueError('Tarif (oylar soni) ko‘rsatilsin')
+            # Both rows in one transaction: the days are added exactly when the payment flips
+            expiry = _db_set_days(cur, uid, months * DAYS_PER_MONTH)
+            cur.execute("UPDATE payments SET status = %s, months = %s, decided_at = now() WHERE id = %s",
+                        (APPROVED, months, pid))
+            conn.commit()
+    return {'id': pid, 'uid': uid, 'months': months, 'expiry': _db_iso(expiry)}
+
+
+def db_reject_payment(pid: str) -> dict:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            uid, _, _ = _db_pending_payment(cur, pid)
+            cur.execute("UPDATE payments SET status = %s, decided_at = now() WHERE id = %s", (REJECTED, pid))
+            conn.commit()
+    return {'id': pid, 'uid': uid}
+
+
+# One pass over the table for the counts; churn buckets come off the expiry index
+_STATS_SQL = """
+SELECT now() AT TIME ZONE 'UTC',
+       count(*),
+       count(*) FILTER (WHERE expiry > now()),
+       count(*) FILTER (WHERE expiry IS NULL),
+       %s,
+       (SELECT json_object_agg(month, n) FROM (
+          SELECT to_char(expiry AT TIME ZONE 'UTC', 'YYYY-MM') AS month, count(*) AS n
+          FROM subscriptions
+          WHERE expiry <= now()
+            AND expiry >= (date_trunc('month', now() AT TIME ZONE 'UTC') - make_interval(months => %%(back)s)) AT TIME ZONE 'UTC'
+          GROUP BY 1) m)
+FROM subscriptions
+""" % ',\n       '.join(
+    "count(*) FILTER (WHERE expiry > now() AND expiry <= now() + make_interval(days => %d))" % days
+    for days in analytics.WINDOWS)
+
+
+def db_stats(months: int) -> dict:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_STATS_SQL, {'back': months - 1})
+            row = cur.fetchone()
+    now, total, active, no_expiry = row[:4]
+    expiring = dict(zip(analytics.WINDOWS, row[4:-1]))
+    found = row[-1] or {}
+    churn = {m.strftime('%Y-%m'): found.get(m.strftime('%Y-%m'), 0) for m in analytics.month_starts(now, months)}
+    return analytics.report(total, active, no_expiry, expiring, churn, PLANS)
+
+
+Gauge('update_queue_depth', 'Telegram updates waiting for a dispatcher worker', lambda: updates.stats()['depth'])
+Gauge('update_wait_avg_seconds', 'Average time an update waited in the queue',
+      lambda: updates.stats()['wait_avg_ms'] / 1000)
+Gauge('sender_queue_depth', 'Outgoing Telegram calls waiting for a send slot', lambda: loaded_telegram().sender.stats()['depth'])
+Gauge('status_cache_hit_ratio', 'Hit ratio of the status() cache', lambda: status_cache.stats()['hit_ratio'])
+Gauge('db_pool_in_use', 'Postgres connections checked out',
+      lambda: _pool.stats()['in_use'] if _pool is not None else None)
+
+
+@app.route('/metrics')
+def _metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 # Debug info
 @app.route('/_debug')
 def _debug():
+    tg = loaded_telegram()
     return jsonify({
         'USE_DB': USE_DB,
         'DATABASE_URL_set': bool(DATABASE_URL),
         'SUBS_JSON': SUBS_JSON,
-        'version': VERSION
+        'version': VERSION,
+        'db_pool': _pool.stats() if _pool is not None else None,
+        'store': store.stats() if not USE_DB else None,
+        'expiry_columns': expiry_columns.stats() if not USE_DB else None,
+        'change_feed': change_feed.stats() if not USE_DB else None,
+        'status_cache': status_cache.stats(),
+        'invalidation': subs_listener.stats() if subs_listener is not None else None,
+        'updates': updates.stats(),
+        'prefilter': tg.prefilter.stats() if tg is not None else None,
+        'sweeper': sweeper.stats(),
+        'payments': payment_intake.stats(),
+        'sender': tg.sender.stats() if tg is not None else None,
+        'startup': startup.stats(),
+        'tokens': token_signer.stats(),
+        'tracing': tracer.stats(),
     })
 
 @app.route('/_version')
 def _version():
     return jsonify({'version': VERSION, 'subs_json': SUBS_JSON})
 
+
+@app.route('/_ready')
+def _ready():
+    """Readiness probe: 503 until the startup steps (schema, bot, webhook) are done"""
+    stats = startup.stats()
+    return jsonify(stats), 200 if stats['ready'] else 503
+
 # -------------- API --------------
+@app.route('/api/stats', methods=['GET'])
+def api_stats():
+    try:
+        months = int(request.args.get('months', 12))
+    except ValueError:
+        months = 0
+    if not 1 <= months <= 60:
+        return jsonify({'error': "months 1 dan 60 gacha bo‘lsin"}), 400
+    started = time.perf_counter()
+    try:
+        out = stats(months)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    out['took_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(out)
+
+
 @app.route('/api/subscriptions', methods=['GET'])
 def api_subscriptions():
+    # Without paging args the full list is returned, as older clients expect
+    try:
+        if not listing.wants_page(request.args):
+            return _full_list()
+        query = listing.parse_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    try:
+        return _conditional(page_etag(query, request.query_string), lambda: list_page(query))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def _full_list():
+    return _conditional(list_etag(), list_subs)
+
+
+def _conditional(tag, build):
+    """jsonify(build()) with a weak ETag, or a 304 without building it when
+    If-None-Match has ``tag``; tag None: the ETag is a hash of the body"""
+    if tag is not None and request.if_none_match.contains_weak(tag):
+        return Response(status=304, headers={'ETag': 'W/"%s"' % tag})
+    data = build()
+    with profiling.span('encode'):
+        resp = jsonify(data)
+    # Weak: the same ETag covers the gzip/br encodings _compress makes of it
+    if tag is None:
+        resp.add_etag(weak=True)
+    else:
+        resp.set_etag(tag, weak=True)
+    return resp.make_conditional(request)
+
+
+@app.route('/api/subscriptions/changes', methods=['GET'])
+def api_subscriptions_changes():
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'since: versiya raqami kerak'}), 400
     try:
-        data = list_subs()
-        return jsonify(data)
+        return jsonify(changes(since))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/subscriptions/export', methods=['GET'])
+def api_subscriptions_export():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in listing.EXPORT_FORMATS:
+        return jsonify({'error': 'format: ' + ', '.join(listing.EXPORT_FORMATS)}), 400
+    try:
+        query = listing.parse_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    mimetype, chunks = listing.EXPORT_FORMATS[fmt]
+    return Response(
+        stream_with_context(chunks(iter_subs(query))),
+        mimetype=mimetype,
+        headers={'Content-Disposition': 'attachment; filename=subscriptions.%s' % fmt}
+    )
+
+
 @app.route('/api/subscription', methods=['POST'])
 def api_subscription():
     data = request.get_json(force=True)
@@ -422,8 +1622,10 @@ def api_subscription():
     if not uid or days < 1:
         return jsonify({'error': "UID va kun to‘g‘ri kiritilsin"}), 400
     try:
-        set_days(uid, days, note)
-        return jsonify({'ok': True})
+        expiry = set_days(uid, days, note)
+        return jsonify({'ok': True, 'uid': uid, 'expiry': expiry})
+    except ValueError as e:  # a uid or note the store can't hold (binary: integer uids)
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -436,8 +1638,8 @@ def api_subscription_add():
     if not uid or add < 1:
         return jsonify({'error': "UID va kunni to‘g‘ri kiriting"}), 400
     try:
-        add_days(uid, add)
-        return jsonify({'ok': True})
+        expiry = add_days(uid, add)
+        return jsonify({'ok': True, 'uid': uid, 'expiry': expiry})
     except ValueError as e:
         return jsonify({'error': str(e)}), 404
     except Exception as e:
@@ -451,8 +1653,8 @@ def api_subscription_reset():
     if not uid:
         return jsonify({'error': "UID kiritilmadi"}), 400
     try:
-        reset(uid)
-        return jsonify({'ok': True})
+        expiry = reset(uid)
+        return jsonify({'ok': True, 'uid': uid, 'expiry': expiry})
     except ValueError as e:
         return jsonify({'error': str(e)}), 404
     except Exception as e:
@@ -467,8 +1669,8 @@ def api_subscription_note():
     if not uid:
         return jsonify({'error': "UID kiritilmadi"}), 400
     try:
-        set_note(uid, note)
-        return jsonify({'ok': True})
+        expiry = set_note(uid, note)
+        return jsonify({'ok': True, 'uid': uid, 'expiry': expiry})
     except ValueError as e:
         return jsonify({'error': str(e)}), 404
     except Exception as e:
@@ -490,20 +1692,160 @@ def api_subscription_delete():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/subscriptions/bulk', methods=['POST'])
+def api_subscriptions_bulk():
+    try:
+        items = bulk.parse_items(request.get_json(force=True), BULK_MAX_ITEMS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    started = time.perf_counter()
+    try:
+        results = bulk_apply(items)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(bulk.summary(results, time.perf_counter() - started))
+
+
+PAYMENT_STATUSES = (PENDING, APPROVED, REJECTED)
+
+
+@app.route('/api/payments', methods=['GET'])
+def api_payments():
+    status = request.args.get('status', PENDING)
+    if status not in PAYMENT_STATUSES:
+        return jsonify({'error': 'status: ' + ', '.join(PAYMENT_STATUSES)}), 400
+    try:
+        return jsonify(list_payments(status))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def parse_payment_decision(data) -> tuple:
+    """(payment id, months or None) from an approve/reject body"""
+    data = data if isinstance(data, dict) else {}
+    pid = data.get('id')
+    if not isinstance(pid, str) or not pid:
+        raise ValueError('To‘lov ID si kerak')
+    months = data.get('months')
+    if months is not None and (not isinstance(months, int) or isinstance(months, bool) or months < 1):
+        raise ValueError('months musbat butun son bo‘lsin')
+    return pid, months
+
+
+def decide_payment(fn, *args):
+    """Run approve/reject: (body, status code)"""
+    try:
+        return dict(fn(*args), ok=True), 200
+    except LookupError as e:
+        return {'error': str(e)}, 404
+    except ValueError as e:
+        return {'error': str(e)}, 409
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+@app.route('/api/payments/approve', methods=['POST'])
+def api_payment_approve():
+    try:
+        pid, months = parse_payment_decision(request.get_json(force=True, silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    body, code = decide_payment(approve_payment, pid, months)
+    return jsonify(body), code
+
+
+@app.route('/api/payments/reject', methods=['POST'])
+def api_payment_reject():
+    try:
+        pid, _ = parse_payment_decision(request.get_json(force=True, silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    body, code = decide_payment(reject_payment, pid)
+    return jsonify(body), code
+
+
+@app.route('/api/broadcast', methods=['POST'])
+def api_broadcast():
+    try:
+        text, query = parse_broadcast(request.get_json(force=True, silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    from sender import SenderFull  # with bot.py, on first use
+    try:
+        return jsonify(start_broadcast(text, query))
+    except SenderFull as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/broadcast/<bid>', methods=['GET'])
+def api_broadcast_status(bid):
+    tg = loaded_telegram()
+    stats = tg.sender.broadcast_stats(bid) if tg is not None else None
+    if stats is None:
+        return jsonify({'error': "Topilmadi"}), 404
+    return jsonify(stats)
+
+
 @app.route('/api/subscription/status', methods=['GET'])
 def api_subscription_status():
-    tg_id = request.args.get('tg_id')
-    if not tg_id:
+    try:
         # Fallback to session if available (after /login.html auth)
-        tg_id = session.get('tg_id')
+        tg_id = status_uid(request.args.get('tg_id'), g.get('token'), lambda: session.get('tg_id'))
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     if not tg_id:
         return jsonify({'subscribed': False, 'days_left': 0})
     try:
-        return jsonify(status(str(tg_id)))
+        st = status(str(tg_id))
     except Exception:
         return jsonify({'subscribed': False, 'days_left': 0})
+    return _conditional(status_etag(st), lambda: st)
+
+
+# -------------- Profiling (admin) --------------
+def profile_args(args) -> tuple:
+    """(seconds, interval in seconds) from ?seconds=&interval_ms=; ValueError if out of range"""
+    try:
+        seconds = float(args.get('seconds', 10))
+        interval_ms = float(args.get('interval_ms', PROFILE_INTERVAL_MS))
+    except ValueError:
+        raise ValueError("seconds va interval_ms son bo‘lsin")
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError("seconds 0 dan %g gacha bo‘lsin" % PROFILE_MAX_SECONDS)
+    if not 1 <= interval_ms <= 1000:
+        raise ValueError("interval_ms 1 dan 1000 gacha bo‘lsin")
+    return seconds, interval_ms / 1000
+
+
+def run_profile(seconds: float, interval: float):
+    """Sample this process (blocks for ``seconds``); collapsed stacks, or None if a profile is already running"""
+    counts = profiling.sample(seconds, interval)
+    return profiling.collapsed(counts) if counts is not None else None
+
+
+@app.route('/api/profile', methods=['GET'])
+def api_profile():
+    """Sampling profile of the worker process serving this request, as collapsed stacks (flamegraph.pl)"""
+    try:
+        seconds, interval = profile_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    profiling.expect_slow()
+    out = run_profile(seconds, interval)
+    if out is None:
+        return jsonify({'error': "Profil allaqachon olinmoqda"}), 409
+    return Response(out, content_type='text/plain; charset=utf-8')
+
+
+@app.route('/api/profile/slow', methods=['GET'])
+def api_profile_slow():
+    return jsonify({'tracing': tracer.stats(), 'slow': tracer.recent()})
 
 
 if __name__ == "__main__":
+    create_app()
+    start_background(setup_webhook=bool(os.environ.get('RENDER')) and TG_UPDATES == 'webhook')
     port = int(os.environ.get("PORT", 10000))
     app.run(host="0.0.0.0", port=port)
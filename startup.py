@@ -0,0 +1,106 @@
+import os
+import time
+import logging
+from threading import Lock, Thread, Event
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """Initialization steps run once per process on a background thread.
+
+    The server binds its port and answers immediately; ``ready()`` turns True
+    once every step has succeeded. A failing step (a sleeping database, an
+    unreachable Bot API) is retried with backoff; it delays readiness but not
+    the other steps. Like the other background workers the thread is started
+    after fork, never at import.
+    """
+
+    def __init__(self, retry_delay: float = 1.0, max_delay: float = 30.0):
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self._steps = []  # [(name, fn)]
+        self._state = {}  # name -> {'status', 'attempts', 'seconds', 'error'}
+        self._lock = Lock()
+        self._done = Event()
+        self._thread = None
+        self._pid = None
+        self._started_at = None
+        self._ready_at = None
+
+    def add(self, name: str, fn):
+        """Register ``fn()`` as a step; a name already registered is kept as is"""
+        with self._lock:
+            if name in self._state:
+                return
+            self._steps.append((name, fn))
+            self._state[name] = {'status': 'pending', 'attempts': 0, 'seconds': None, 'error': None}
+            self._done.clear()
+            started = self._pid == os.getpid()
+        if started:
+            self._ensure_thread()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._started_at = time.monotonic()
+            self._thread = None
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = Thread(target=self._run, name='startup', daemon=True)
+            self._thread.start()
+
+    def _attempt(self, name: str, fn) -> bool:
+        state = self._state[name]
+        state['status'] = 'running'
+        state['attempts'] += 1
+        started = time.monotonic()
+        try:
+            fn()
+        except Exception as e:
+            state.update(status='failed', error=str(e), seconds=round(time.monotonic() - started, 3))
+            logger.error('Startup step %s failed (attempt %d): %s', name, state['attempts'], e)
+            return False
+        state.update(status='ok', error=None, seconds=round(time.monotonic() - started, 3))
+        logger.info('Startup step %s done in %.3fs', name, state['seconds'])
+        return True
+
+    def _run(self):
+        delay = self.retry_delay
+        while True:
+            with self._lock:
+                pending = [(name, fn) for name, fn in self._steps if self._state[name]['status'] != 'ok']
+                if not pending:
+                    # Under the lock: an add() from now on starts a new thread
+                    self._ready_at = time.monotonic()
+                    self._done.set()
+                    self._thread = None
+                    return
+            # One slow or failing step doesn't hold up the others
+            if not all([self._attempt(name, fn) for name, fn in pending]):
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_delay)
+
+    def ready(self) -> bool:
+        return self._pid == os.getpid() and self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout) and self.ready()
+
+    def stats(self) -> dict:
+        with self._lock:
+            steps = {name: dict(self._state[name]) for name, _ in self._steps}
+        started, ready_at = self._started_at, self._ready_at
+        return {
+            'ready': self.ready(),
+            'ready_after_s': round(ready_at - started, 3) if ready_at and started and self.ready() else None,
+            'steps': steps,
+        }
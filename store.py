@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import atexit
+import logging
+import tempfile
+from contextlib import contextmanager
+from threading import Lock, RLock, Condition, Thread
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ('always', 'never')
+
+
+class SubscriptionStore:
+    """In-memory subscription records with write-behind persistence.
+
+    The JSON file is read once; lookups and mutations work on a dict under
+    ``lock``. Mutations only mark the store dirty - a background writer
+    coalesces bursts of them into a single atomic rewrite (temp file +
+    os.replace), so a crash mid-write never leaves a torn file behind.
+
+    Records are treated as immutable: callers build a new dict and ``put`` it,
+    which lets the writer serialize a shallow copy without holding the lock.
+
+    Secondary indexes follow mutations through ``subscribe``: listeners are
+    called as ``fn(uid, old, new)`` under the lock (``new`` is None on delete).
+    """
+
+    def __init__(self, path: str, flush_delay: float = 0.05, fsync: str = 'always'):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('SUBS_FSYNC must be one of %s' % (FSYNC_POLICIES,))
+        self.path = path
+        self.flush_delay = flush_delay
+        self.fsync = fsync
+        self.lock = RLock()
+        self._data = {}
+        self._dirty = False
+        self._cond = Condition(self.lock)
+        self._flush_lock = Lock()  # one rewrite at a time, snapshots taken in order
+        self._listeners = []
+        self._writer = None
+        self._writer_pid = None
+        self._closed = False
+        self.flushes = 0
+        self.writes = 0
+
+    # -------------- loading --------------
+    def _read_file(self, path: str) -> dict:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error('Failed to load %s: %s', path, e)
+            return {}
+
+    def _load_data(self) -> dict:
+        return self._read_file(self.path)
+
+    def load(self):
+        data = self._load_data()
+        with self.lock:
+            self._data = data
+            self._dirty = False
+        atexit.register(self.close)
+        return self
+
+    # -------------- reads --------------
+    def sync(self):
+        """Pick up changes made by other processes (no-op: this store is per-process)"""
+
+    def get(self, uid: str):
+        return self._data.get(uid)
+
+    def items(self) -> list:
+        with self.lock:
+            return list(self._data.items())
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, uid):
+        return uid in self._data
+
+    # -------------- listeners --------------
+    def subscribe(self, fn, replay: bool = True):
+        """Register ``fn(uid, old, new)``; with replay, feed it every current record first"""
+        with self.lock:
+            self._listeners.append(fn)
+            if replay:
+                for uid, record in self._data.items():
+                    fn(uid, None, record)
+
+    def _notify(self, uid: str, old, new):
+        for fn in self._listeners:
+            try:
+                fn(uid, old, new)
+            except Exception as e:
+                logger.error('Store listener %r failed for %s: %s', fn, uid, e)
+
+    # -------------- writes --------------
+    def put(self, uid: str, record: dict):
+        with self.lock:
+            old = self._data.get(uid)
+            self._data[uid] = record
+            self._notify(uid, old, record)
+            self._changed()
+
+    def remove(self, uid: str) -> bool:
+        with self.lock:
+            old = self._data.pop(uid, None)
+            if old is None:
+                return False
+            self._notify(uid, old, None)
+            self._changed()
+            return True
+
+    @contextmanager
+    def batch(self):
+        """Hold ``lock`` across a run of mutations; the writer persists them with one rewrite"""
+        with self.lock:
+            yield self
+
+    def _changed(self):
+        self.writes += 1
+        self._dirty = True
+        self._ensure_writer()
+        self._cond.notify()
+
+    # -------------- write-behind --------------
+    def _ensure_writer(self):
+        # Threads don't survive fork, so (re)start the writer in whichever
+        # process is actually mutating the store.
+        if self._writer is not None and self._writer_pid == os.getpid() and self._writer.is_alive():
+            return
+        self._writer_pid = os.getpid()
+        self._writer = Thread(target=self._run_writer, name='subs-writer', daemon=True)
+        self._writer.start()
+
+    def _run_writer(self):
+        while True:
+            with self.lock:
+                while not self._dirty and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._dirty:
+                    return
+            # Let a burst of mutations pile up before paying for one rewrite
+            if self.flush_delay > 0:
+                time.sleep(self.flush_delay)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('Failed to save %s: %s', self.path, e)
+                time.sleep(1)
+
+    def _snapshot(self) -> dict:
+        with self.lock:
+            self._dirty = False
+            return dict(self._data)
+
+    def flush(self):
+        """Write the current state to disk now (atomic replace)"""
+        with self._flush_lock:
+            data = self._snapshot()
+            try:
+                self._write_atomic(self.path, data)
+            except Exception:
+                with self.lock:
+                    self._dirty = True
+                raise
+            self.flushes += 1
+
+    def _write_atomic(self, path: str, data: dict):
+        directory = os.path.dirname(path) or '.'
+        fd, tmp = tempfile.mkstemp(prefix='.subs-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                if self.fsync == 'always':
+                    os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        if self.fsync == 'always':
+            self._fsync_dir(directory)
+
+    @staticmethod
+    def _fsync_dir(directory: str):
+        try:
+            dfd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dfd)
+        except OSError:
+            pass
+        finally:
+            os.close(dfd)
+
+    def close(self):
+        with self.lock:
+            self._closed = True
+            dirty = self._dirty
+            self._cond.notify_all()
+        if dirty:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('Failed to save %s: %s', self.path, e)
+
+    def stats(self) -> dict:
+        return {
+            'mode': 'memory',
+            'records': len(self._data),
+            'writes': self.writes,
+            'flushes': self.flushes,
+            'dirty': self._dirty,
+            'fsync': self.fsync,
+        }
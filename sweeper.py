@@ -0,0 +1,162 @@
+import os
+import heapq
+import asyncio
+import logging
+from threading import Lock
+from datetime import datetime, timedelta
+
+from binstore import NONE, EPOCH, iso_seconds
+
+logger = logging.getLogger(__name__)
+
+REMIND = 'remind'
+EXPIRED = 'expired'
+# Record fields remembering which expiry a notice was already sent for
+MARK_FIELDS = {REMIND: 'reminded_for', EXPIRED: 'expired_for'}
+
+
+class ExpiryHeap:
+    """Min-heap of upcoming expiry events for the JSON store.
+
+    Each record with an expiry yields two events: a reminder ``remind_days``
+    before it and the expiry itself. The heap is fed through
+    ``SubscriptionStore.subscribe``; superseded entries (expiry changed or
+    record deleted) are skipped lazily when popped, so every mutation and
+    every due event costs O(log N) and nothing ever rescans the store.
+    """
+
+    def __init__(self, remind_days: int, lookback_days: int):
+        self.remind = timedelta(days=remind_days)
+        self.lookback = timedelta(days=lookback_days)
+        self._heap = []  # (fire_at, uid, expiry_str, stage)
+        self._current = {}  # uid -> expiry_str the live events belong to
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def on_change(self, uid: str, old, new):
+        expiry = new.get('expiry') if new else None
+        with self._lock:
+            if old is not None and new is not None and old.get('expiry') == expiry:
+                return  # only notes/marks changed: existing events stay valid
+            if not expiry:
+                self._current.pop(uid, None)
+                return
+            try:
+                at = datetime.fromisoformat(expiry)
+            except ValueError:
+                self._current.pop(uid, None)
+                return
+            self._current[uid] = expiry
+            oldest = datetime.utcnow() - self.lookback
+            if new.get(MARK_FIELDS[REMIND]) != expiry and at > oldest:
+                heapq.heappush(self._heap, (at - self.remind, uid, expiry, REMIND))
+            if new.get(MARK_FIELDS[EXPIRED]) != expiry and at > oldest:
+                heapq.heappush(self._heap, (at, uid, expiry, EXPIRED))
+
+    def load_columns(self, uids, expiry, reminded, expired):
+        """on_change(uid, None, record) for a whole snapshot given as int64 columns
+        (epoch seconds, NONE for no value; see binstore.BinarySnapshot.columns),
+        without a record dict or an ISO parse per uid, and with one heapify"""
+        with self._lock:
+            oldest = (datetime.utcnow() - self.lookback - EPOCH).total_seconds()
+            events = []
+            for uid, at, reminded_at, expired_at in zip(uids, expiry, reminded, expired):
+                # Events older than the lookback are never pushed, so their uids need no _current entry
+                if at <= oldest or at == NONE:
+                    continue
+                uid = str(uid)
+                when = EPOCH + timedelta(seconds=at)
+                expiry_str = self._current[uid] = iso_seconds(at)
+                if reminded_at != at:
+                    events.append((when - self.remind, uid, expiry_str, REMIND))
+                if expired_at != at:
+                    events.append((when, uid, expiry_str, EXPIRED))
+            self._heap.extend(events)
+            heapq.heapify(self._heap)
+
+    def pop_due(self, now: datetime, limit: int) -> list:
+        """Pop up to ``limit`` live events due at ``now``: [(uid, expiry_str, stage)]"""
+        out = []
+        with self._lock:
+            while self._heap and len(out) < limit and self._heap[0][0] <= now:
+                _, uid, expiry, stage = heapq.heappop(self._heap)
+                if self._current.get(uid) != expiry:
+                    continue  # superseded by a later mutation
+                if stage == REMIND and datetime.fromisoformat(expiry) <= now:
+                    continue  # already expired; the expiry notice covers it
+                out.append((uid, expiry, stage))
+        return out
+
+
+class Sweeper:
+    """Periodically claims due expiry events and sends notices.
+
+    ``claim()`` is a blocking callable returning ``[(uid, expiry, stage)]``
+    that atomically marks what it returns as notified, so a notice is sent at
+    most once per (uid, expiry, stage) even across restarts. ``notify`` is a
+    coroutine ``notify(uid, stage, expiry)``; pacing is left to it (the
+    outbound sender), so a claimed batch is handed over all at once.
+    """
+
+    def __init__(self, claim, notify, interval: float = 60.0):
+        self.claim = claim
+        self.notify = notify
+        self.interval = interval
+        self._task = None
+        self._pid = None
+        self.sweeps = 0
+        self.sent = 0
+        self.failed = 0
+        self.last_sweep = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Start the sweep task on ``loop`` (thread-safe, once per process)"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        loop.call_soon_threadsafe(self._create_task)
+
+    def _create_task(self):
+        self._task = asyncio.get_running_loop().create_task(self._run(), name='expiry-sweeper')
+
+    def stop(self):
+        if self._task is not None and self._pid == os.getpid() and not self._task.done():
+            self._task.get_loop().call_soon_threadsafe(self._task.cancel)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error('Expiry sweep failed: %s', e)
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            due = await loop.run_in_executor(None, self.claim)
+            results = await asyncio.gather(*(self.notify(uid, stage, expiry) for uid, expiry, stage in due),
+                                           return_exceptions=True)
+            for (uid, expiry, stage), res in zip(due, results):
+                if isinstance(res, Exception):
+                    self.failed += 1
+                    logger.warning('Expiry notice %s to %s failed: %s', stage, uid, res)
+                else:
+                    self.sent += 1
+            if not due:
+                break
+        self.sweeps += 1
+        self.last_sweep = datetime.utcnow().replace(microsecond=0).isoformat()
+
+    def stats(self) -> dict:
+        return {
+            'running': self._task is not None and not self._task.done(),
+            'sweeps': self.sweeps,
+            'sent': self.sent,
+            'failed': self.failed,
+            'last_sweep': self.last_sweep,
+        }
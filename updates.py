@@ -0,0 +1,204 @@
+import os
+import time
+import asyncio
+import logging
+from threading import Lock, Thread, Event
+
+logger = logging.getLogger(__name__)
+
+FULL_POLICIES = ('reject', 'drop')
+
+
+class UpdateQueue:
+    """Feeds Telegram updates to the dispatcher from a dedicated event loop.
+
+    The loop lives in its own thread, so web threads only hand updates over
+    (``submit``) and return immediately. A fixed pool of consumer tasks calls
+    ``dp.feed_update`` concurrently, so one slow Telegram API call no longer
+    holds up every other update. The queue is bounded: when it is full,
+    ``submit`` returns False and the caller applies ``full_policy`` -
+    "reject" (answer 503 so Telegram redelivers later) or "drop".
+
+    The loop thread is started lazily and restarted after fork, so it is safe
+    to import under ``gunicorn --preload``. Servers that already run an event
+    loop (aioserver.py) call ``attach`` instead and skip the thread entirely.
+    """
+
+    def __init__(self, dp, bot, maxsize: int = 1000, workers: int = 8, full_policy: str = 'reject'):
+        if full_policy not in FULL_POLICIES:
+            raise ValueError('UPDATE_QUEUE_FULL must be one of %s' % (FULL_POLICIES,))
+        self.dp = dp
+        self.bot = bot
+        self.maxsize = maxsize
+        self.workers = workers
+        self.full_policy = full_policy
+        self._lock = Lock()
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+        self._thread = None
+        self._attached = False
+        self._pid = None
+        self._pending = 0  # queued, not yet picked up
+        self._active = 0  # being processed right now
+        # metrics
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._proc_total = 0.0
+        self._proc_max = 0.0
+
+    def bind(self, dp, bot):
+        """Set the dispatcher and bot when they are created after the queue (lazy imports)"""
+        self.dp = dp
+        self.bot = bot
+
+    # -------------- loop thread --------------
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        self.start()
+        return self._loop
+
+    def _running(self) -> bool:
+        if self._pid != os.getpid():
+            return False
+        if self._attached:
+            return True
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self._running():
+            return
+        with self._lock:
+            if self._running():
+                return
+            ready = Event()
+            self._pid = os.getpid()
+            self._pending = 0
+            self._active = 0
+            self._thread = Thread(target=self._run, args=(ready,), name='tg-updates', daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def _start_tasks(self, loop):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._tasks = [loop.create_task(self._consume(), name='tg-update-worker-%d' % i)
+                       for i in range(self.workers)]
+
+    def _run(self, ready: Event):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._start_tasks(loop)
+        ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def attach(self):
+        """Run the consumers on the current (already running) event loop"""
+        self.stop()
+        self._pid = os.getpid()
+        self._pending = 0
+        self._active = 0
+        self._attached = True
+        self._start_tasks(asyncio.get_running_loop())
+
+    async def detach(self, timeout: float = 5.0):
+        if self._attached:
+            await self._shutdown(timeout)
+            self._attached = False
+
+    def run(self, coro, timeout: float = None):
+        """Run a coroutine on the update loop from another thread and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def spawn(self, coro):
+        """Schedule a coroutine on the update loop without waiting for it"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # -------------- producer side --------------
+    def submit(self, update) -> bool:
+        """Hand an update to the consumers; False if the queue is full"""
+        self.start()
+        with self._lock:
+            if self._pending >= self.maxsize:
+                self.rejected += 1
+                return False
+            self._pending += 1
+            self.enqueued += 1
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (update, time.monotonic()))
+        return True
+
+    # -------------- consumer side --------------
+    async def _consume(self):
+        while True:
+            update, enqueued_at = await self._queue.get()
+            started = time.monotonic()
+            with self._lock:
+                self._pending -= 1
+                self._active += 1
+            try:
+                await self.dp.feed_update(bot=self.bot, update=update)
+                ok = True
+            except Exception as e:
+                ok = False
+                logger.error(f"Update qayta ishlashda xatolik: {e}")
+            finished = time.monotonic()
+            with self._lock:
+                self._active -= 1
+                wait = started - enqueued_at
+                proc = finished - started
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+                self._wait_total += wait
+                self._proc_total += proc
+                self._wait_max = max(self._wait_max, wait)
+                self._proc_max = max(self._proc_max, proc)
+
+    async def _shutdown(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._active) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pending or self._active:
+            logger.warning('Update queue stopped with %d pending updates', self._pending + self._active)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.bot is not None:
+            await self.bot.session.close()
+
+    def stop(self, timeout: float = 5.0):
+        """Let queued updates finish (up to ``timeout``) and stop the loop"""
+        if self._attached or self._thread is None or not self._running():
+            return
+        try:
+            self.run(self._shutdown(timeout), timeout + 1)
+        except Exception as e:
+            logger.warning('Update queue shutdown error: %s', e)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        done = self.processed + self.failed
+        return {
+            'depth': self._pending,
+            'in_flight': self._active,
+            'maxsize': self.maxsize,
+            'workers': self.workers,
+            'full_policy': self.full_policy,
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'wait_avg_ms': round(self._wait_total / done * 1000, 3) if done else 0.0,
+            'wait_max_ms': round(self._wait_max * 1000, 3),
+            'process_avg_ms': round(self._proc_total / done * 1000, 3) if done else 0.0,
+            'process_max_ms': round(self._proc_max * 1000, 3),
+        }